@@ -0,0 +1,125 @@
+from __future__ import division
+
+import json
+import math
+import os
+import sys
+import threading
+
+from atomic import atomic_write
+from timestamps import to_datetime, to_seconds
+
+
+# Spiders whose crawls take near enough the same time every run would
+# otherwise flag a crawl a few seconds slower.
+MIN_STD_SECONDS = 1.0
+
+_alerts_lock = threading.Lock()
+
+
+class AnomalyDetector(object):
+    """
+    Flag crawls that took much longer than is usual for their spider.
+
+    Each spider keeps an exponentially weighted moving mean and variance of
+    its crawl durations, the number of crawls seen and the latest end time
+    seen, four numbers however many crawls it runs. A crawl is flagged when
+    its duration is more than threshold standard deviations above the mean
+    before it, once the spider has warmup crawls behind it. Every crawl,
+    flagged or not, then moves the averages, so a lasting change becomes
+    the new normal.
+
+    Only crawls ending after a spider's latest end time are new, so each
+    run looks at a crawl once.
+    """
+
+    def __init__(self, path, alpha=0.1, threshold=3.0, warmup=10):
+        self.path = path
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.spiders = {}
+        if os.path.exists(path):
+            with open(path) as state_file:
+                self.spiders = json.load(state_file)['spiders']
+
+    def is_new(self, spider, end_time):
+        """
+        Whether a crawl ended after the last crawl of its spider seen.
+
+        :param spider:    the name of the spider that ran the crawl
+        :param end_time:  integer microseconds since the epoch
+        :returns new:  boolean
+        """
+        baseline = self.spiders.get(spider)
+        return baseline is None or end_time > baseline[3]
+
+    def observe(self, jobs):
+        """
+        Score the new crawls in the order they ended and update each
+        spider's averages.
+
+        :param jobs:  an iterable of (id, spider, start time, end time)
+        :returns alerts:  a list of dictionary objects, one per flagged crawl
+        """
+        alerts = []
+        for job_id, spider, start_time, end_time in sorted(
+                jobs, key=lambda job: job[3]):
+            if not self.is_new(spider, end_time):
+                continue
+
+            duration = to_seconds(end_time - start_time)
+            baseline = self.spiders.get(spider)
+            if baseline is None:
+                self.spiders[spider] = [1, duration, 0.0, end_time]
+                continue
+
+            count, mean, variance, _ = baseline
+            std = max(math.sqrt(variance), MIN_STD_SECONDS)
+            score = (duration - mean) / std
+            if count >= self.warmup and score > self.threshold:
+                alerts.append({'id': job_id,
+                               'spider': spider,
+                               'start_time': str(to_datetime(start_time)),
+                               'end_time': str(to_datetime(end_time)),
+                               'duration': duration,
+                               'mean': round(mean, 2),
+                               'std': round(std, 2),
+                               'z': round(score, 2)})
+
+            difference = duration - mean
+            increment = self.alpha * difference
+            self.spiders[spider] = [count + 1,
+                                    mean + increment,
+                                    (1 - self.alpha) *
+                                    (variance + difference * increment),
+                                    end_time]
+
+        return alerts
+
+    def save(self):
+        """Write the state file, replacing the old one in a single step."""
+        atomic_write(self.path, lambda state_file: json.dump(
+            {'spiders': self.spiders}, state_file))
+
+
+def write_alerts(path, alerts):
+    """
+    Append alerts to a json lines file, or print them to stdout for a path
+    of -. Writers on other threads wait their turn, so lines never mix.
+
+    :param path:    a string
+    :param alerts:  a list of dictionary objects
+    """
+    if not alerts:
+        return
+
+    lines = ''.join(json.dumps(alert, sort_keys=True) + '\n'
+                    for alert in alerts)
+    with _alerts_lock:
+        if path == '-':
+            sys.stdout.write(lines)
+            sys.stdout.flush()
+            return
+        with open(path, 'a') as alerts_file:
+            alerts_file.write(lines)
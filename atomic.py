@@ -0,0 +1,24 @@
+import os
+import threading
+
+
+def atomic_write(path, write, mode='w'):
+    """
+    Write a file through a temporary file next to it, then rename it over
+    the old one, so a reader never sees it half written. The temporary
+    name is unique to the process and thread, so concurrent writers of the
+    same path do not share it, and it is removed if the write fails.
+
+    :param path:   a string
+    :param write:  a function called with the open temporary file
+    :param mode:   the mode to open the temporary file with, 'w' or 'wb'
+    """
+    temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                      threading.current_thread().ident)
+    try:
+        with open(temp_path, mode) as temp_file:
+            write(temp_file)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,148 @@
+import glob
+import multiprocessing
+import os
+
+from jsonstream import iter_array_items
+from metrics import GroupedMetrics
+from replay import FileResponse
+from timestamps import parse_timestamp
+
+
+# The job ids of the last dump a worker read, reused when the next task
+# given to the same worker follows on from it.
+_last_dump = (None, frozenset())
+
+
+def find_dumps(patterns):
+    """
+    Expand directories and glob patterns into listjobs dump files.
+
+    :param patterns:  a list of directories, files or glob patterns; a
+                      matching directory stands for every .json file in it
+    :returns paths:  a sorted list of strings
+    """
+    paths = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.isdir(path):
+                paths.update(glob.glob(os.path.join(path, '*.json')))
+            else:
+                paths.add(path)
+
+    return sorted(paths)
+
+
+def build_tasks(paths, group_by=None, histogram_by=None):
+    """
+    A task per dump, naming the dump before it from the same node.
+
+    Dumps are taken to be archived one directory per node with file names
+    that sort in the order they were taken. A finished job stays listed by
+    scrapyd until it ages out, so each dump only counts the jobs that the
+    dump before it did not list.
+
+    :param paths:         a list of dump files
+    :param group_by:      None, metrics.GROUP_BY_SPIDER or GROUP_BY_SPIDER_DAY
+    :param histogram_by:  the grouping of the duration histograms, if any
+    :returns tasks:  a list of (path, previous path or None, group_by,
+                     histogram_by)
+    """
+    tasks = []
+    previous = {}
+    for path in sorted(paths, key=lambda path: (os.path.dirname(path),
+                                                os.path.basename(path))):
+        directory = os.path.dirname(path)
+        tasks.append((path, previous.get(directory), group_by,
+                      histogram_by))
+        previous[directory] = path
+
+    return tasks
+
+
+def iter_dump_jobs(path):
+    """
+    Iterate over the finished jobs of a dump, decoding a chunk at a time.
+
+    :param path:  a string
+    :returns finished_jobs:  an iterator of dictionaries
+    """
+    return iter_array_items(FileResponse(path).iter_content(), 'finished')
+
+
+def read_job_ids(path):
+    """
+    The ids of the finished jobs in a dump.
+
+    :param path:  a string
+    :returns ids:  a frozenset of strings
+    """
+    return frozenset(item['id'] for item in iter_dump_jobs(path))
+
+
+def analyse_dump(task):
+    """
+    Fold the new jobs of one dump into grouped aggregates, in a worker.
+
+    Only the aggregate state is sent back to the parent, a few kilobytes
+    whatever the number of jobs.
+
+    :param task:  a (path, previous path or None, group_by, histogram_by)
+                  tuple
+    :returns state:  the GroupedMetrics state of the dump's new jobs
+    """
+    global _last_dump
+    path, previous, group_by, histogram_by = task
+
+    seen_ids = frozenset()
+    if previous is not None:
+        if _last_dump[0] == previous:
+            seen_ids = _last_dump[1]
+        else:
+            seen_ids = read_job_ids(previous)
+
+    grouped_metrics = GroupedMetrics(group_by, keep_durations=False,
+                                     histogram_by=histogram_by)
+    current_ids = set()
+    for item in iter_dump_jobs(path):
+        current_ids.add(item['id'])
+        if item['id'] not in seen_ids:
+            grouped_metrics.add(item['spider'],
+                                parse_timestamp(item['start_time']),
+                                parse_timestamp(item['end_time']))
+
+    _last_dump = (path, frozenset(current_ids))
+    return grouped_metrics.to_state()
+
+
+def analyse_dumps(paths, group_by=None, processes=None, histogram_by=None):
+    """
+    Analyse many listjobs dumps over a pool of processes and merge the
+    aggregates of each dump in the parent, in dump order.
+
+    Tasks are handed out in runs of consecutive dumps, so a worker can
+    usually reuse the ids of the dump it just read rather than decode the
+    previous dump again.
+
+    :param paths:         a list of dump files
+    :param group_by:      None, metrics.GROUP_BY_SPIDER or GROUP_BY_SPIDER_DAY
+    :param processes:     number of worker processes, by default one per core
+    :param histogram_by:  the grouping of the duration histograms, if any
+    :returns grouped_metrics:  a metrics.GroupedMetrics object
+    """
+    tasks = build_tasks(paths, group_by, histogram_by)
+    grouped_metrics = GroupedMetrics(group_by, keep_durations=False,
+                                     histogram_by=histogram_by)
+    if not tasks:
+        return grouped_metrics
+
+    processes = processes or multiprocessing.cpu_count()
+    chunksize = max(1, len(tasks) // (processes * 4))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for state in pool.imap(analyse_dump, tasks, chunksize):
+            grouped_metrics.merge(GroupedMetrics.from_state(state))
+    finally:
+        pool.close()
+        pool.join()
+
+    return grouped_metrics
@@ -0,0 +1,465 @@
+"""
+Benchmarks for the overwatch hot paths and the whole pipeline.
+
+Run from the repository root:
+
+    python benchmark.py
+    python benchmark.py --jobs 1000 100000 1000000 --output results.json
+    python benchmark.py --compare results.json
+
+The pipeline suite serves synthetic listjobs payloads from a local
+stand-in scrapyd and times each stage on its own, then the whole run.
+Results are written as json so runs of different versions can be
+compared with --compare.
+"""
+import argparse
+import bisect
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# settings needs an output directory at import time.
+if 'DATA_EXPORT_DIR' not in os.environ:
+    os.environ['DATA_EXPORT_DIR'] = tempfile.mkdtemp(prefix='overwatch_bench')
+
+from forecast import DrainForecast, DurationModel
+from jsonstream import iter_array_items
+from metrics import GROUP_BY_SPIDER, GroupedMetrics
+from overwatch import Overwatch, create_session, parse_arguments, write_csv
+from timestamps import EPOCH, parse_timestamp, parse_timestamps, to_datetime
+
+
+START_TIME = parse_timestamp('2016-04-01 00:00:00')
+
+DURATIONS = {
+    'lognormal': lambda rand, mean: rand.lognormvariate(
+        math.log(mean) - 0.5 * 0.75 ** 2, 0.75),
+    'exponential': lambda rand, mean: rand.expovariate(1.0 / mean),
+    'uniform': lambda rand, mean: rand.uniform(0, 2 * mean),
+}
+
+# Stages faster than this in either run are too noisy to compare.
+MIN_COMPARE_SECONDS = 0.001
+
+STAGES = ['fetch', 'decode', 'parse', 'aggregate', 'outliers', 'metrics',
+          'csv', 'forecast', 'pipeline', 'stream_pipeline']
+
+
+def generate_timestamps(count, seed=0):
+    """
+    Build a list of scrapyd style timestamps spread over a month.
+
+    :param count:  integer
+    :param seed:   integer
+    :returns timestamps:  a list of strings
+    """
+    rand = random.Random(seed)
+    start = datetime.datetime(2016, 4, 1)
+    return [str(start + datetime.timedelta(
+                seconds=rand.randint(0, 30 * 86400),
+                microseconds=rand.randint(1, 999999)))
+            for _ in range(count)]
+
+
+def generate_listjobs(count, spiders=5, durations='lognormal',
+                      mean_duration=240.0, slots=8, seed=0):
+    """
+    Build a synthetic listjobs response.
+
+    Jobs run back to back on a fixed number of slots with short random
+    gaps, so concurrency looks like a busy scrapyd. Spiders are drawn
+    with Zipf weights, the first being the most common, and durations
+    from the named distribution. Finished jobs are listed by end time.
+
+    :param count:          number of finished jobs
+    :param spiders:        number of distinct spiders
+    :param durations:      lognormal, exponential or uniform
+    :param mean_duration:  mean crawl duration in seconds
+    :param slots:          number of crawls run at once
+    :param seed:           integer
+    :returns listjobs:  a dictionary object
+    """
+    rand = random.Random(seed)
+    draw = DURATIONS[durations]
+    names = ['spider_{}'.format(number) for number in range(spiders)]
+    cumulative = []
+    total = 0.0
+    for rank in range(spiders):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+
+    slot_free = [START_TIME] * slots
+    jobs = []
+    for number in range(count):
+        slot = number % slots
+        start_time = slot_free[slot] + int(rand.expovariate(0.2) * 10 ** 6)
+        end_time = start_time + max(1, int(draw(rand, mean_duration) *
+                                           10 ** 6))
+        slot_free[slot] = end_time
+        spider = names[bisect.bisect(cumulative, rand.random() * total)]
+        jobs.append((end_time, start_time, spider))
+
+    jobs.sort()
+    finished = [{'id': '{:032x}'.format(rand.getrandbits(128)),
+                 'spider': spider,
+                 'start_time': str(to_datetime(start_time)),
+                 'end_time': str(to_datetime(end_time))}
+                for end_time, start_time, spider in jobs]
+
+    return {'status': 'ok',
+            'node_name': 'benchmark',
+            'pending': [],
+            'running': [],
+            'finished': finished}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answer every listjobs request with the server's payload."""
+
+    def do_GET(self):
+        if not self.path.startswith('/listjobs.json'):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_scrapyd(body):
+    """
+    Serve a listjobs payload from a stand-in scrapyd on a free port.
+
+    :param body:  the encoded json payload
+    :returns server:  an HTTPServer object, call shutdown() when done
+    """
+    server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.body = body
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def best_of(func, repeat, setup=None):
+    """
+    The fastest of repeat timed calls of func, passing it the result of
+    setup() when given, which is left out of the timing.
+
+    :returns seconds:  a float
+    """
+    best = None
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        started = timeit.default_timer()
+        if setup is not None:
+            func(argument)
+        else:
+            func()
+        elapsed = timeit.default_timer() - started
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def bench_timestamps(count=100000, repeat=3):
+    """
+    Time strptime against parse_timestamp and parse_timestamps.
+
+    :param count:   number of timestamps parsed per run
+    :param repeat:  number of runs, the fastest is reported
+    :returns results:  a dictionary of seconds per timestamp
+    """
+    timestamps = generate_timestamps(count)
+
+    def strptime_all():
+        strptime = datetime.datetime.strptime
+        return [strptime(date_string, '%Y-%m-%d %H:%M:%S.%f') - EPOCH
+                for date_string in timestamps]
+
+    def parse_all():
+        return [parse_timestamp(date_string) for date_string in timestamps]
+
+    def parse_batch():
+        return parse_timestamps(timestamps)
+
+    results = {}
+    for name, func in [('strptime', strptime_all),
+                       ('parse_timestamp', parse_all),
+                       ('parse_timestamps', parse_batch)]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        results[name] = best / count
+
+    return results
+
+
+def bench_pipeline(listjobs, repeat=3):
+    """
+    Time each stage of a run over a listjobs payload served by a stand-in
+    scrapyd, then whole runs with and without --stream.
+
+    fetch is the HTTP transfer, decode the job by job json decoding the
+    runs use, parse the timestamp parsing, aggregate the single pass that
+    folds every job into per spider accumulators, outliers the earliest
+    start and latest end of a freshly fetched response, decoding and
+    folding its jobs on the way, metrics the derived columns,
+    csv the write of the rows, and forecast the drain forecast of a
+    pending queue as long as the list of finished jobs. Every csv file is
+    written to a temporary directory.
+
+    :param listjobs:  a dictionary object, from generate_listjobs
+    :param repeat:    number of runs of each stage, the fastest is reported
+    :returns result:  a dictionary of the job count, payload size and
+                      seconds per stage
+    """
+    body = json.dumps(listjobs).encode('utf-8')
+    server = start_scrapyd(body)
+    node = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    session = create_session(1)
+    output_dir = tempfile.mkdtemp(prefix='overwatch_bench')
+    arguments = parse_arguments(['-p', 'benchmark', '-d', node])
+    stream_arguments = parse_arguments(['-p', 'benchmark', '-d', node,
+                                        '--stream', '-s', '8'])
+
+    finished = json.loads(body.decode('utf-8'))['finished']
+    parsed = [(item['spider'],
+               parse_timestamp(item['start_time']),
+               parse_timestamp(item['end_time'])) for item in finished]
+
+    def run(run_arguments):
+        pipeline = Overwatch(run_arguments, node=node, session=session)
+        pipeline.output_file = os.path.join(output_dir, 'pipeline.csv')
+        pipeline.write_to_csv()
+
+    def aggregate(group_by=GROUP_BY_SPIDER):
+        grouped_metrics = GroupedMetrics(group_by)
+        for spider, start_time, end_time in parsed:
+            grouped_metrics.add(spider, start_time, end_time)
+        return grouped_metrics
+
+    def fetched():
+        return Overwatch(arguments, node=node, session=session)
+
+    overwatch = fetched()
+    grouped_metrics = aggregate()
+    model = DurationModel(grouped_metrics.total.jobs)
+    pending = [item['spider'] for item in finished]
+    rows = grouped_metrics.scrapy_metrics()
+    fieldnames = grouped_metrics.group_columns() + [
+        key for key in rows[0] if key not in grouped_metrics.group_columns()]
+
+    stages = [
+        ('fetch', lambda: session.get(overwatch.query_url).content, None),
+        ('decode', lambda: list(iter_array_items([body], 'finished')), None),
+        ('parse', lambda: [(item['spider'],
+                            parse_timestamp(item['start_time']),
+                            parse_timestamp(item['end_time']))
+                           for item in finished], None),
+        ('aggregate', aggregate, None),
+        ('outliers', lambda fresh: fresh.gather_crawl_outliers(), fetched),
+        ('metrics', lambda grouped: grouped.scrapy_metrics(), aggregate),
+        ('csv', lambda: write_csv(os.path.join(output_dir, 'bench.csv'),
+                                  fieldnames, rows), None),
+        ('forecast', lambda: DrainForecast(model, pending, [], 8), None),
+        ('pipeline', lambda: run(arguments), None),
+        ('stream_pipeline', lambda: run(stream_arguments), None),
+    ]
+
+    try:
+        timings = dict((name, best_of(func, repeat, setup))
+                       for name, func, setup in stages)
+    finally:
+        server.shutdown()
+        server.server_close()
+        session.close()
+        shutil.rmtree(output_dir)
+
+    return {'jobs': len(finished),
+            'payload_bytes': len(body),
+            'stages': timings}
+
+
+def print_results(title, results):
+    """Print a table of per item timings and speedups against strptime."""
+    print(title)
+    baseline = results.get('strptime')
+    for name in sorted(results, key=results.get, reverse=True):
+        line = '  {:<20} {:>8.3f} us'.format(name, results[name] * 1e6)
+        if baseline:
+            line += '  {:>6.1f}x'.format(baseline / results[name])
+        print(line)
+
+
+def print_pipeline(result):
+    """Print a table of stage timings, in total and per job."""
+    print('pipeline, {} jobs, {} byte payload'.format(
+        result['jobs'], result['payload_bytes']))
+    for name in STAGES:
+        seconds = result['stages'][name]
+        print('  {:<20} {:>10.2f} ms {:>8.3f} us/job'.format(
+            name, seconds * 1e3, seconds * 1e6 / result['jobs']))
+
+
+def compare(previous, current, threshold):
+    """
+    Compare the stage timings of two benchmark runs with the same job
+    counts, printing the ratio of each stage that took at least
+    MIN_COMPARE_SECONDS.
+
+    :param previous:   a results dictionary from an earlier run
+    :param current:    a results dictionary from this run
+    :param threshold:  a ratio above which a stage counts as slower
+    :returns regressions:  a list of (jobs, stage, ratio) tuples
+    """
+    before = dict((result['jobs'], result['stages'])
+                  for result in previous['pipeline'])
+    regressions = []
+    print('compared with {}'.format(previous['created']))
+    for result in current['pipeline']:
+        if result['jobs'] not in before:
+            continue
+        for name in STAGES:
+            if name not in before[result['jobs']]:
+                continue
+            if min(result['stages'][name],
+                   before[result['jobs']][name]) < MIN_COMPARE_SECONDS:
+                continue
+            ratio = result['stages'][name] / before[result['jobs']][name]
+            flag = ''
+            if ratio > threshold:
+                regressions.append((result['jobs'], name, ratio))
+                flag = '  slower'
+            print('  {:>8} {:<20} {:>6.2f}x{}'.format(result['jobs'], name,
+                                                     ratio, flag))
+
+    return regressions
+
+
+def parse_arguments_bench(arguments):
+    """
+    Parse the benchmark options.
+
+    :params arguments:  a list of arguments from sys.argv
+    :returns parser.parse_args(arguments):  argparse namespace object
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs',
+                        help=('Finished job counts to benchmark'),
+                        type=int,
+                        nargs='+',
+                        default=[1000, 10000, 100000])
+
+    parser.add_argument('--spiders',
+                        help=('Number of distinct spiders'),
+                        type=int,
+                        default=5)
+
+    parser.add_argument('--durations',
+                        help=('Crawl duration distribution'),
+                        choices=sorted(DURATIONS),
+                        default='lognormal')
+
+    parser.add_argument('--mean_duration',
+                        help=('Mean crawl duration in seconds'),
+                        type=float,
+                        default=240.0)
+
+    parser.add_argument('--slots',
+                        help=('Number of crawls run at once'),
+                        type=int,
+                        default=8)
+
+    parser.add_argument('--repeat',
+                        help=('Runs of each stage, the fastest is kept'),
+                        type=int,
+                        default=3)
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--output',
+                        help=('Write the results to this json file'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--compare',
+                        help=('Compare with the results in this json file'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--threshold',
+                        help=('Slowdown ratio reported as a regression by '
+                              '--compare, which then exits with status 1'),
+                        type=float,
+                        default=1.2)
+
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    """
+    Run the benchmarks, then write and compare the results.
+
+    :param arguments:  argparse namespace object
+    :returns status:   0, or 1 if --compare found a regression
+    """
+    results = {'created': datetime.datetime.utcnow().isoformat(),
+               'python': platform.python_version(),
+               'implementation': platform.python_implementation(),
+               'platform': platform.platform(),
+               'parameters': {'spiders': arguments.spiders,
+                              'durations': arguments.durations,
+                              'mean_duration': arguments.mean_duration,
+                              'slots': arguments.slots,
+                              'repeat': arguments.repeat,
+                              'seed': arguments.seed},
+               'timestamps': bench_timestamps(repeat=arguments.repeat),
+               'pipeline': []}
+    print_results('timestamp parsing (per timestamp)', results['timestamps'])
+
+    for count in arguments.jobs:
+        listjobs = generate_listjobs(count, arguments.spiders,
+                                     arguments.durations,
+                                     arguments.mean_duration,
+                                     arguments.slots,
+                                     arguments.seed)
+        result = bench_pipeline(listjobs, arguments.repeat)
+        del listjobs
+        results['pipeline'].append(result)
+        print_pipeline(result)
+
+    if arguments.output:
+        with open(arguments.output[0], 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if arguments.compare:
+        with open(arguments.compare[0]) as previous_file:
+            previous = json.load(previous_file)
+        if compare(previous, results, arguments.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments_bench(sys.argv[1:])))
@@ -0,0 +1,316 @@
+"""
+The crawl metrics of a scrapyd project, for use from other programs:
+
+    from client import OverwatchClient
+
+    client = OverwatchClient('http://127.0.0.1:6800', 'harvestman')
+    client.calculate_av_crawl_duration()   # fetches and folds the jobs
+    client.gather_scrapy_metrics()         # remembered, no work
+    client.refresh()                       # True if the finished jobs changed
+
+Unlike overwatch.py, importing this module reads no settings, creates no
+directories and defers importing requests until the first fetch.
+"""
+import datetime
+import hashlib
+
+from jsonstream import iter_array_items
+from metrics import GroupedMetrics
+from replay import FileResponse
+from timestamps import from_datetime, parse_timestamp
+
+
+# The remembered metrics that include the rolling windows.
+WINDOW_METRICS = ('scrapy_metrics', 'spider_metrics')
+
+
+class OverwatchClient(object):
+    """
+    The metrics of the finished jobs of one scrapyd project on one node,
+    configured with plain values rather than command line arguments.
+
+    Nothing is fetched until a metric is first asked for. The jobs are
+    then folded in a single pass and each metric is worked out once and
+    remembered, so asking again costs a dictionary lookup. refresh()
+    fetches listjobs again but keeps the remembered metrics unless the
+    finished jobs changed: an identical response is recognised by its
+    digest without decoding it, and a response that differs only in the
+    pending and running jobs is recognised by a digest of the finished
+    job ids and end times.
+
+    The returned dictionaries and lists are shared with later callers, so
+    treat them as read only. With no finished jobs the metrics, which are
+    mostly averages over the jobs, are None, and the lists of metrics are
+    empty.
+
+    node and project name the listjobs end point, input_path reads a saved
+    listjobs response instead. concurrent_spiders, windows and group_by
+    are as for metrics.CrawlMetrics.scrapy_metrics and GroupedMetrics.
+    timeout is a requests timeout, and session a requests.Session to reuse
+    connections across clients. The rolling windows end at the time on
+    clock, the node's local time, of the latest fetch, so every refresh
+    works the metrics that have windows out again. A saved response is
+    taken to be from the end of its latest crawl.
+    """
+
+    def __init__(self, node=None, project=None, concurrent_spiders=None,
+                 windows=None, group_by=None, session=None,
+                 timeout=(5.0, 30.0), input_path=None,
+                 clock=datetime.datetime.now):
+        if input_path is None and not (node and project):
+            raise ValueError('Either node and project or input_path is '
+                             'required')
+
+        self.node = node.rstrip('/') if node else None
+        self.project = project
+        self.query_url = None
+        if self.node:
+            self.query_url = '{}/listjobs.json?project={}'.format(self.node,
+                                                                  project)
+        self.concurrent_spiders = concurrent_spiders
+        self.windows = windows
+        self.group_by = group_by
+        self.session = session
+        self.timeout = timeout
+        self.input_path = input_path
+        self.clock = clock
+
+        self.grouped_metrics = None
+        self.response_digest = None
+        self.jobs_digest = None
+        self.reference = None
+        self.memo = {}
+
+    def fetch(self):
+        """
+        Read the listjobs response body.
+
+        :returns body:  a byte string
+        """
+        if self.input_path is not None:
+            return FileResponse(self.input_path).content
+
+        client = self.session
+        if client is None:
+            # Imported here, requests alone takes about 100 ms to import.
+            import requests
+            client = requests
+        response = client.get(self.query_url, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ValueError('response code {}'.format(response.status_code))
+        return response.content
+
+    def refresh(self):
+        """
+        Fetch the jobs again, forgetting the remembered metrics only if the
+        finished jobs changed, apart from the rolling windows, which move
+        on to the time of the fetch.
+
+        :returns changed:  True if the finished jobs changed, which the
+                           first fetch always does
+        """
+        body = self.fetch()
+        changed = False
+        response_digest = hashlib.sha1(body).hexdigest()
+        if response_digest != self.response_digest:
+            self.response_digest = response_digest
+            changed = self.fold(body)
+
+        self.move_reference(self.build_reference())
+        return changed
+
+    def fold(self, body):
+        """
+        Fold the finished jobs of a response, unless they are the ones
+        already folded.
+
+        :param body:  a byte string
+        :returns changed:  True if the finished jobs changed
+        """
+        # Digest the finished jobs first and parse their timestamps only if
+        # they changed, which is most of the cost of a fold.
+        jobs = []
+        jobs_digest = hashlib.sha1()
+        for item in iter_array_items([body], 'finished'):
+            jobs.append((item['spider'], item['start_time'],
+                         item['end_time']))
+            jobs_digest.update('{}\t{}\n'.format(
+                item['id'], item['end_time']).encode('utf-8'))
+
+        jobs_digest = jobs_digest.hexdigest()
+        if jobs_digest == self.jobs_digest:
+            return False
+
+        grouped_metrics = GroupedMetrics(self.group_by)
+        for spider, start_time, end_time in jobs:
+            grouped_metrics.add(spider, parse_timestamp(start_time),
+                                parse_timestamp(end_time))
+
+        self.jobs_digest = jobs_digest
+        self.grouped_metrics = grouped_metrics
+        self.memo = {}
+        return True
+
+    def build_reference(self):
+        """
+        The time the rolling windows end at: now on the node's clock, or
+        for a response saved to input_path, the end of its latest crawl.
+
+        :returns reference:  integer microseconds since the epoch
+        """
+        if self.input_path is not None:
+            latest_end = self.grouped_metrics.total.latest_end
+            if latest_end is not None:
+                return latest_end
+        return from_datetime(self.clock())
+
+    def move_reference(self, reference):
+        """
+        End the rolling windows at a new time, forgetting the remembered
+        metrics that have them.
+
+        :param reference:  integer microseconds since the epoch
+        """
+        self.reference = reference
+        if self.windows:
+            for name in WINDOW_METRICS:
+                self.memo.pop(name, None)
+
+    def memoised(self, name, compute):
+        """
+        A remembered metric, worked out on the first call.
+
+        :param name:     the name the metric is remembered under
+        :param compute:  a function of no arguments returning the metric
+        :returns value:  the metric
+        """
+        try:
+            return self.memo[name]
+        except KeyError:
+            value = self.memo[name] = compute()
+            return value
+
+    def memoised_metric(self, name, compute, empty=None):
+        """
+        A remembered metric of the finished jobs, or empty when there are
+        none to work it out from.
+
+        :param name:     the name the metric is remembered under
+        :param compute:  a function of no arguments returning the metric
+        :param empty:    the value without finished jobs
+        :returns value:  the metric
+        """
+        if not self.gather_completed_crawl_count():
+            return empty
+        return self.memoised(name, compute)
+
+    def gather_grouped_metrics(self):
+        """
+        The accumulator of the finished jobs, fetching them on first use.
+
+        :returns grouped_metrics:  a metrics.GroupedMetrics object
+        """
+        if self.grouped_metrics is None:
+            self.refresh()
+        return self.grouped_metrics
+
+    def gather_job_metrics(self):
+        """
+        The metrics of all finished jobs.
+
+        :returns job_metrics:  a metrics.CrawlMetrics object
+        """
+        return self.gather_grouped_metrics().total
+
+    def gather_scrapy_metrics(self):
+        """
+        Every metric written to a row of the csv file, for all jobs.
+
+        :returns scrapy_metrics:  a dictionary object, or None
+        """
+        return self.memoised_metric(
+            'scrapy_metrics',
+            lambda: self.gather_job_metrics().scrapy_metrics(
+                self.concurrent_spiders, self.windows, self.reference))
+
+    def gather_spider_metrics(self):
+        """
+        A metrics dictionary for each group of jobs, then for all jobs.
+
+        :returns spider_metrics:  a list of dictionary objects
+        """
+        return self.memoised_metric(
+            'spider_metrics',
+            lambda: self.gather_grouped_metrics().scrapy_metrics(
+                self.concurrent_spiders, self.windows, self.reference),
+            [])
+
+    def gather_histogram_rows(self):
+        """
+        The duration histogram of each group of jobs, then of all jobs.
+
+        :returns histogram_rows:  a list of dictionary objects
+        """
+        return self.memoised(
+            'histogram_rows',
+            lambda: self.gather_grouped_metrics().histogram_rows())
+
+    def metric(self, name):
+        """
+        One metric of all jobs, by its csv column name.
+
+        :param name:  a column name, e.g. 'Av CR (S)'
+        :returns value:  the metric, or None without finished jobs
+        """
+        scrapy_metrics = self.gather_scrapy_metrics()
+        if scrapy_metrics is None:
+            return None
+        return scrapy_metrics[name]
+
+    def gather_crawl_durations(self):
+        """
+        The duration of each finished crawl in seconds, in response order.
+
+        :returns crawl_durations:  a list of floats
+        """
+        return self.memoised('crawl_durations',
+                             lambda: self.gather_job_metrics().durations)
+
+    def gather_completed_crawl_count(self):
+        """
+        The number of finished crawls.
+
+        :returns completed_crawl_count:  integer
+        """
+        return self.gather_job_metrics().count
+
+    def calculate_av_crawl_duration(self):
+        """
+        The mean crawl duration, rounded to 2 decimal places.
+
+        :returns av_crawl_seconds:  a float, or None
+        """
+        return self.memoised_metric(
+            'av_crawl_duration',
+            lambda: self.gather_job_metrics().av_crawl_duration())
+
+    def calculate_single_crawls_per_hour(self):
+        """
+        The crawls a single spider can do per hour.
+
+        :returns single_crawls_per_hour:  a float, or None
+        """
+        return self.memoised_metric(
+            'single_crawls_per_hour',
+            lambda: self.gather_job_metrics().single_crawls_per_hour())
+
+    def calculate_est_total_crawls_per_hour(self):
+        """
+        The crawls all spiders can do per hour.
+
+        :returns est_total_crawls_per_hour:  a float, or None
+        """
+        return self.memoised_metric(
+            'est_total_crawls_per_hour',
+            lambda: self.gather_job_metrics().est_total_crawls_per_hour(
+                self.concurrent_spiders))
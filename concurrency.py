@@ -0,0 +1,162 @@
+from __future__ import division
+
+import vectorised
+
+from array import array
+from jobtable import TIME_TYPECODE
+from timestamps import to_datetime
+
+
+class ConcurrencyProfile(object):
+    """
+    How many crawls were running at each instant, from a sweep over the
+    start and end times of the finished jobs.
+
+    The starts and the ends are each sorted once, O(n log n), then walked
+    together in time order: every start raises the number of running
+    crawls by one and every end lowers it. An end is taken before a start
+    at the same instant, so back to back crawls do not overlap. Crawls
+    that did not end after they started are left out. With NumPy the
+    sorts, the busy time and the peak are array operations.
+    """
+
+    def __init__(self, start_times, end_times):
+        self.count = len(start_times)
+        if vectorised.available():
+            self.starts, self.ends, self.busy, self.peak = (
+                vectorised.sorted_intervals(start_times, end_times,
+                                            TIME_TYPECODE))
+        else:
+            self.sweep(start_times, end_times)
+
+        self.span = 0
+        if self.starts:
+            self.span = self.ends[-1] - self.starts[0]
+
+    def sweep(self, start_times, end_times):
+        """
+        Sort the start and end times, then walk them for the busy time and
+        the peak.
+
+        :param start_times:  integer microseconds since the epoch
+        :param end_times:    integer microseconds since the epoch
+        """
+        intervals = [(start_time, end_time)
+                     for start_time, end_time in zip(start_times, end_times)
+                     if end_time > start_time]
+        self.starts = array(TIME_TYPECODE,
+                            sorted(interval[0] for interval in intervals))
+        self.ends = array(TIME_TYPECODE,
+                          sorted(interval[1] for interval in intervals))
+
+        self.peak = 0
+        self.busy = 0
+        for segment_start, segment_end, level in self.segments():
+            self.busy += (segment_end - segment_start) * level
+            if level > self.peak:
+                self.peak = level
+
+    def segments(self):
+        """
+        Yield each stretch of time with a constant, non zero number of
+        running crawls.
+
+        :returns segments:  an iterator of (start, end, level) tuples, with
+                            times in integer microseconds since the epoch
+        """
+        starts = self.starts
+        ends = self.ends
+        count = len(starts)
+        i = j = 0
+        level = 0
+        previous = None
+
+        while j < count:
+            if i < count and starts[i] < ends[j]:
+                time, change = starts[i], 1
+                i += 1
+            else:
+                time, change = ends[j], -1
+                j += 1
+
+            if level and time > previous:
+                yield previous, time, level
+            level += change
+            previous = time
+
+    def mean(self):
+        """
+        Time weighted mean number of running crawls between the first
+        start and the last end.
+
+        :returns mean:  a float
+        """
+        if not self.span:
+            return 0.0
+        return self.busy / self.span
+
+    def timeline(self, bucket):
+        """
+        Mean and peak number of running crawls in each bucket of time,
+        from the bucket holding the first start to the one holding the
+        last end.
+
+        :param bucket:  the bucket length in integer microseconds
+        :returns timeline:  a list of (bucket start, mean, peak) tuples,
+                            with bucket starts in microseconds
+        """
+        if not self.starts:
+            return []
+
+        first = self.starts[0] // bucket
+        last = (self.ends[-1] - 1) // bucket
+        busy = [0] * (last - first + 1)
+        peak = [0] * (last - first + 1)
+
+        for segment_start, segment_end, level in self.segments():
+            for index in range(segment_start // bucket - first,
+                               (segment_end - 1) // bucket - first + 1):
+                bucket_start = (index + first) * bucket
+                overlap = (min(segment_end, bucket_start + bucket) -
+                           max(segment_start, bucket_start))
+                busy[index] += overlap * level
+                if level > peak[index]:
+                    peak[index] = level
+
+        return [((index + first) * bucket, busy[index] / bucket, peak[index])
+                for index in range(len(busy))]
+
+    def completions(self, bucket):
+        """
+        The number of crawls that ended in each bucket of the timeline,
+        after the bucket start and no later than its end.
+
+        :param bucket:  the bucket length in integer microseconds
+        :returns completions:  a list of integers, one per timeline bucket
+        """
+        if not self.starts:
+            return []
+
+        first = self.starts[0] // bucket
+        length = (self.ends[-1] - 1) // bucket - first + 1
+        if vectorised.available():
+            return vectorised.bucket_counts(self.ends, bucket, first, length)
+
+        completions = [0] * length
+        for end in self.ends:
+            completions[(end - 1) // bucket - first] += 1
+        return completions
+
+    def timeline_rows(self, bucket):
+        """
+        The timeline as csv rows.
+
+        :param bucket:  the bucket length in integer microseconds
+        :returns rows:  a list of dictionary objects
+        """
+        return [{'Bucket start': str(to_datetime(bucket_start)),
+                 'Mean concurrency': round(mean, 4),
+                 'Peak concurrency': peak,
+                 'Completions': completions}
+                for (bucket_start, mean, peak), completions
+                in zip(self.timeline(bucket), self.completions(bucket))]
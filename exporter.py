@@ -0,0 +1,271 @@
+import re
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'overwatch_'
+
+# csv column: (metric name, extra labels, help text)
+METRICS = {
+    'Completed crawls': ('completed_crawls', {},
+                         'Finished crawls listed by scrapyd'),
+    'Av CR (S)': ('crawl_duration_seconds_mean', {},
+                  'Mean crawl duration'),
+    'Longest CR (S)': ('crawl_duration_seconds_max', {},
+                       'Longest crawl duration'),
+    'Shortest CR (S)': ('crawl_duration_seconds_min', {},
+                        'Shortest crawl duration'),
+    'p50 CR (S)': ('crawl_duration_seconds', {'quantile': '0.5'},
+                   'Crawl duration quantiles'),
+    'p90 CR (S)': ('crawl_duration_seconds', {'quantile': '0.9'},
+                   'Crawl duration quantiles'),
+    'p99 CR (S)': ('crawl_duration_seconds', {'quantile': '0.99'},
+                   'Crawl duration quantiles'),
+    'Total Duration': ('span_seconds', {},
+                       'Time between the earliest start and latest end'),
+    'Single CR p/h': ('single_crawls_per_hour', {},
+                      'Crawls per hour one spider completes'),
+    'Max CR p/h': ('max_crawls_per_hour', {},
+                   'Crawls per hour all slots could complete'),
+    'Single CR p/d': ('single_crawls_per_day', {},
+                      'Crawls per day one spider completes'),
+    'Max CR p/d': ('max_crawls_per_day', {},
+                   'Crawls per day all slots could complete'),
+    'Single CR p/7d': ('single_crawls_per_week', {},
+                       'Crawls per week one spider completes'),
+    'Max CR p/7d': ('max_crawls_per_week', {},
+                    'Crawls per week all slots could complete'),
+    'Peak concurrency': ('concurrency_peak', {},
+                         'Most crawls seen running at once'),
+    'Mean concurrency': ('concurrency_mean', {},
+                         'Time weighted mean of running crawls'),
+    'Utilisation': ('utilisation', {},
+                    'Share of the spider slots in use'),
+    'Est CR p/h': ('est_crawls_per_hour', {},
+                   'Crawls per hour at the observed concurrency'),
+    'Logged crawls': ('logged_crawls', {},
+                      'Finished crawls whose log stats were read'),
+    'Items scraped': ('items_scraped', {},
+                      'Items scraped by the logged crawls'),
+    'Items p/s': ('items_per_second', {},
+                  'Items scraped per second of crawling'),
+    'Requests': ('requests', {}, 'Requests made by the logged crawls'),
+    'Requests p/s': ('requests_per_second', {},
+                     'Requests made per second of crawling'),
+    'Response bytes': ('response_bytes', {},
+                       'Response bytes downloaded by the logged crawls'),
+}
+
+WINDOW_METRICS = [
+    (re.compile(r'^CR (\w+)$'), 'window_crawls',
+     'Crawls finished in the trailing window'),
+    (re.compile(r'^Av CR (\w+) \(S\)$'), 'window_crawl_duration_seconds_mean',
+     'Mean crawl duration in the trailing window'),
+    (re.compile(r'^CR p/h (\w+)$'), 'window_crawls_per_hour',
+     'Crawls per hour in the trailing window'),
+]
+
+# csv column: label name
+LABEL_COLUMNS = {'Node': 'node', 'Project': 'project', 'Spider': 'spider',
+                 'Day': 'day'}
+
+
+def escape_label(value):
+    """
+    Escape a label value for the text exposition format.
+
+    :param value:  a string
+    :returns escaped:  a string
+    """
+    return (value.replace('\\', '\\\\')
+                 .replace('"', '\\"')
+                 .replace('\n', '\\n'))
+
+
+def format_value(value):
+    """
+    Format a sample value, ints as they are and floats in full.
+
+    :param value:  a number
+    :returns formatted:  a string
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def metric_for(column):
+    """
+    The metric a csv column is exported as.
+
+    :param column:  a csv column name
+    :returns metric:  (metric name, extra labels, help text), or None if the
+                      column is not exported
+    """
+    if column in METRICS:
+        return METRICS[column]
+
+    for pattern, name, help_text in WINDOW_METRICS:
+        match = pattern.match(column)
+        if match:
+            return name, {'window': match.group(1)}, help_text
+
+    return None
+
+
+def rows_to_samples(project, rows, node=None):
+    """
+    Convert csv rows into samples labelled by project, and by node, spider
+    and day where the rows have them. A Project column overrides project.
+
+    :param project:  the scrapy project name
+    :param rows:     a list of dictionary objects, as written to the csv
+    :param node:     the node label for rows without a Node column
+    :returns samples:  a list of (name, labels, value, help text) tuples
+    """
+    samples = []
+    for row in rows:
+        labels = {'project': project}
+        if node is not None:
+            labels['node'] = node
+        for column, label in LABEL_COLUMNS.items():
+            if column in row:
+                labels[label] = str(row[column])
+
+        for column, value in row.items():
+            metric = metric_for(column)
+            if metric is None or value is None:
+                continue
+            name, extra_labels, help_text = metric
+            sample_labels = dict(labels)
+            sample_labels.update(extra_labels)
+            samples.append((name, sample_labels, value, help_text))
+
+    return samples
+
+
+def render(samples):
+    """
+    Render samples in the Prometheus text exposition format, each metric
+    family under one HELP and TYPE header.
+
+    :param samples:  a list of (name, labels, value, help text) tuples
+    :returns body:  a string
+    """
+    families = {}
+    for name, labels, value, help_text in samples:
+        families.setdefault(name, (help_text, []))[1].append((labels, value))
+
+    lines = []
+    for name in sorted(families):
+        help_text, family = families[name]
+        lines.append('# HELP {}{} {}'.format(PREFIX, name, help_text))
+        lines.append('# TYPE {}{} gauge'.format(PREFIX, name))
+        for labels, value in sorted(family, key=lambda sample:
+                                    sorted(sample[0].items())):
+            label_text = ','.join(
+                '{}="{}"'.format(key, escape_label(labels[key]))
+                for key in sorted(labels))
+            lines.append('{}{}{{{}}} {}'.format(PREFIX, name, label_text,
+                                               format_value(value)))
+
+    if not lines:
+        return ''
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsCache(object):
+    """
+    The latest metrics of each project, rendered once per refresh.
+
+    update() is called by the background poller; it renders a new body and
+    swaps it in with a single assignment, so body() never waits on a lock,
+    a fetch or a recompute however many scrapers call it at once.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.encoded = render([]).encode('utf-8')
+
+    def update(self, project, rows, node=None):
+        """
+        Replace the samples of a project and render a new body.
+
+        :param project:  the scrapy project name
+        :param rows:     a list of dictionary objects, as written to the csv
+        :param node:     the node label for rows without a Node column
+        """
+        samples = rows_to_samples(project, rows, node)
+        samples.append(('last_refresh_timestamp_seconds',
+                        {'project': project},
+                        self.clock(),
+                        'When the metrics were last refreshed'))
+
+        with self.lock:
+            self.samples[project] = samples
+            all_samples = [sample for project_samples in self.samples.values()
+                           for sample in project_samples]
+            self.encoded = render(all_samples).encode('utf-8')
+
+    def body(self):
+        """
+        The rendered metrics of every project.
+
+        :returns body:  bytes
+        """
+        return self.encoded
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the cached body of server.cache on GET /metrics."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.cache.body()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server handling each scrape on its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        HTTPServer.__init__(self, address, MetricsHandler)
+        self.cache = cache
+
+
+def start_server(cache, host, port):
+    """
+    Serve the cache from a background thread.
+
+    :param cache:  a MetricsCache object
+    :param host:   the address to bind, '' for all interfaces
+    :param port:   integer, 0 for any free port
+    :returns server:  a MetricsServer object
+    """
+    server = MetricsServer((host, port), cache)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
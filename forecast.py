@@ -0,0 +1,211 @@
+from __future__ import division
+
+import bisect
+import heapq
+import random
+import vectorised
+
+from timestamps import to_seconds
+
+
+FORECAST_PERCENTILES = (50, 90, 99)
+# Long queues drain in much the same time on every run, so the runs of a
+# forecast are cut to keep the simulated crawls within a budget.
+FORECAST_CRAWL_BUDGET = 400000
+MIN_FORECAST_RUNS = 3
+
+
+class DurationModel(object):
+    """
+    The crawl durations of the finished jobs, per spider, to draw the
+    durations of queued and running crawls from.
+
+    A spider with no finished crawls borrows the durations of every
+    spider. Each spider's durations are kept sorted, so the remaining time
+    of a running crawl is drawn only from the crawls that outlasted it.
+    """
+
+    def __init__(self, job_table):
+        if vectorised.available():
+            self.spider_durations, self.all_durations = (
+                vectorised.spider_durations(job_table))
+            return
+
+        self.spider_durations = {}
+        start_times = job_table.start_times
+        end_times = job_table.end_times
+        spider_ids = job_table.spider_ids
+        by_spider = [[] for _ in job_table.spiders]
+        for index in range(len(end_times)):
+            by_spider[spider_ids[index]].append(
+                to_seconds(end_times[index] - start_times[index]))
+
+        self.all_durations = []
+        for spider, durations in zip(job_table.spiders, by_spider):
+            durations.sort()
+            self.spider_durations[spider] = durations
+            self.all_durations.extend(durations)
+        self.all_durations.sort()
+
+    def __len__(self):
+        return len(self.all_durations)
+
+    def durations(self, spider):
+        """
+        The sorted durations a crawl of a spider is drawn from.
+
+        :param spider:  the name of the spider
+        :returns durations:  a sorted list of seconds
+        """
+        return self.spider_durations.get(spider) or self.all_durations
+
+
+def drain_time(queue, running, slots, rand):
+    """
+    Simulate one run of the pending queue through the slots.
+
+    The event heap holds the time each slot next comes free. Each queued
+    crawl, in queue order, takes the slot that frees first and holds it for
+    a duration drawn from its spider, so a run costs O(n log slots).
+
+    :param queue:    a list of (durations, count) per pending crawl
+    :param running:  a list of (durations, elapsed seconds) per running crawl
+    :param slots:    the number of crawls that can run at once
+    :param rand:     a function returning a float in [0, 1)
+    :returns seconds:  the time until the last queued crawl finishes
+    """
+    free_at = []
+    for durations, elapsed in running:
+        first = bisect.bisect_right(durations, elapsed)
+        remaining = 0.0
+        if first < len(durations):
+            remaining = durations[
+                first + int(rand() * (len(durations) - first))] - elapsed
+        free_at.append(remaining)
+
+    free_at.extend([0.0] * (slots - len(free_at)))
+    heapq.heapify(free_at)
+    draws = [durations[int(rand() * count)] for durations, count in queue]
+    heapreplace = heapq.heapreplace
+    for duration in draws:
+        heapreplace(free_at, free_at[0] + duration)
+
+    return max(free_at) if free_at else 0.0
+
+
+def forecast_runs(runs, pending_count):
+    """
+    The number of runs of a forecast, cut for long queues to keep the
+    simulated crawls within FORECAST_CRAWL_BUDGET.
+
+    :param runs:           the number of runs asked for
+    :param pending_count:  the length of the pending queue, or of the
+                           longest queue of the nodes forecast together
+    :returns runs:  an integer
+    """
+    return min(runs, max(MIN_FORECAST_RUNS,
+                         FORECAST_CRAWL_BUDGET // max(1, pending_count)))
+
+
+def percentile(ordered, percent):
+    """
+    The nearest rank percentile of sorted values.
+
+    :param ordered:  a non-empty sorted list
+    :param percent:  a number from 0 to 100
+    :returns value:  an element of ordered
+    """
+    rank = int(round(percent / 100 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+class DrainForecast(object):
+    """
+    When the pending queue of a scrapyd node will clear, from a discrete
+    event simulation repeated runs times with freshly drawn durations.
+
+    pending is the spider of each queued crawl, in queue order, and running
+    a (spider, elapsed seconds) tuple per running crawl. Each run yields
+    one drain time; their mean is the expected drain time and their spread
+    gives the percentiles. Runs share a seeded random generator, so a
+    forecast is repeatable.
+
+    A run of 100,000 queued crawls takes about 50 ms, so queues longer than
+    FORECAST_CRAWL_BUDGET / runs get fewer runs, down to MIN_FORECAST_RUNS.
+    Forecasts to be combined should be given the runs of forecast_runs()
+    for the longest of their queues, so they all have the same number.
+    """
+
+    def __init__(self, model, pending, running, slots, runs=20, seed=0):
+        runs = forecast_runs(runs, len(pending))
+        self.pending_count = len(pending)
+        self.running_count = len(running)
+        self.slots = max(1, slots, len(running))
+        entries = {}
+        for spider in set(pending):
+            durations = model.durations(spider)
+            entries[spider] = (durations, len(durations))
+        queue = [entries[spider] for spider in pending]
+        running = [(model.durations(spider), elapsed)
+                   for spider, elapsed in running]
+
+        rand = random.Random(seed).random
+        self.drain_times = [drain_time(queue, running, self.slots, rand)
+                            for _ in range(runs)]
+
+    def combine(self, other):
+        """
+        The forecast of two nodes draining side by side, run by run: the
+        cluster is clear when the slower of the two is.
+
+        :param other:  a DrainForecast object with the same number of runs
+        :returns self:  the combined DrainForecast object
+        """
+        if len(other.drain_times) != len(self.drain_times):
+            raise ValueError('Cannot combine a forecast of {} runs with one '
+                             'of {}'.format(len(self.drain_times),
+                                            len(other.drain_times)))
+
+        self.pending_count += other.pending_count
+        self.running_count += other.running_count
+        self.slots += other.slots
+        self.drain_times = [max(drain, other_drain) for drain, other_drain
+                            in zip(self.drain_times, other.drain_times)]
+        return self
+
+    def expected(self):
+        """
+        The mean drain time of the runs.
+
+        :returns seconds:  a float
+        """
+        return sum(self.drain_times) / len(self.drain_times)
+
+    def row(self):
+        """
+        The forecast as a csv row.
+
+        :returns row:  a dictionary object
+        """
+        ordered = sorted(self.drain_times)
+        row = {'Pending crawls': self.pending_count,
+               'Running crawls': self.running_count,
+               'Slots': self.slots,
+               'Runs': len(self.drain_times),
+               'Expected drain (S)': round(self.expected(), 2)}
+        for percent in FORECAST_PERCENTILES:
+            row['Drain p{} (S)'.format(percent)] = round(
+                percentile(ordered, percent), 2)
+        return row
+
+
+def forecast_columns():
+    """
+    The csv column names of a forecast row.
+
+    :returns fieldnames:  a list of strings
+    """
+    return (['Pending crawls', 'Running crawls', 'Slots', 'Runs',
+             'Expected drain (S)'] +
+            ['Drain p{} (S)'.format(percent)
+             for percent in FORECAST_PERCENTILES])
@@ -0,0 +1,224 @@
+"""
+Fixed log scale crawl duration histograms.
+
+Every histogram has the same buckets, so histograms built on different
+nodes, projects or days add together bucket by bucket:
+
+    python histogram.py node_a.json node_b.json --by Spider > fleet.json
+"""
+from __future__ import division
+
+import argparse
+import json
+import math
+import sys
+from array import array
+
+from atomic import atomic_write
+
+
+# Buckets cover 10 ms to about 11.6 days, each 1.26 times as wide as the
+# one before, with one bucket below and one above the range.
+LOWEST_SECONDS = 0.01
+BUCKETS_PER_DECADE = 10
+DECADES = 8
+BUCKET_COUNT = BUCKETS_PER_DECADE * DECADES + 2
+LAST_BUCKET = BUCKET_COUNT - 1
+COUNT_KEY = 'counts'
+
+
+def bucket_bounds():
+    """
+    The lower bound in seconds of each bucket.
+
+    :returns bounds:  a list of BUCKET_COUNT floats, starting at 0
+    """
+    return [0.0] + [LOWEST_SECONDS * 10 ** (index / BUCKETS_PER_DECADE)
+                    for index in range(BUCKET_COUNT - 1)]
+
+
+def bucket_index(seconds):
+    """
+    The bucket a crawl duration falls in.
+
+    :param seconds:  a crawl duration
+    :returns index:  an integer from 0 to BUCKET_COUNT - 1
+    """
+    if seconds < LOWEST_SECONDS:
+        return 0
+    index = int(math.log10(seconds / LOWEST_SECONDS) *
+                BUCKETS_PER_DECADE) + 1
+    return min(index, LAST_BUCKET)
+
+
+class DurationHistogram(object):
+    """
+    The number of crawls whose duration fell in each log scale bucket,
+    held in an integer array of BUCKET_COUNT counts whatever the number of
+    crawls.
+
+    Unlike the mean, longest and shortest crawl, histograms of separate
+    jobs add up to the histogram of all of them, and show the shape of the
+    distribution, e.g. a second mode from banned crawls.
+    """
+
+    def __init__(self, counts=None):
+        if counts is None:
+            counts = [0] * BUCKET_COUNT
+        if len(counts) != BUCKET_COUNT:
+            raise ValueError('Expected {} buckets, got {}'.format(
+                BUCKET_COUNT, len(counts)))
+        self.counts = array('l', counts)
+
+    @property
+    def count(self):
+        """The number of crawls added."""
+        return sum(self.counts)
+
+    def add(self, seconds, log10=math.log10):
+        """
+        Count a crawl. Every finished job is added to a histogram or two,
+        so bucket_index() is inlined.
+
+        :param seconds:  the crawl duration
+        """
+        if seconds < LOWEST_SECONDS:
+            index = 0
+        else:
+            index = int(log10(seconds / LOWEST_SECONDS) *
+                        BUCKETS_PER_DECADE) + 1
+            if index > LAST_BUCKET:
+                index = LAST_BUCKET
+        self.counts[index] += 1
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram to this one.
+
+        :param other:  a DurationHistogram object
+        :returns self:  the merged DurationHistogram object
+        """
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        return self
+
+    def to_state(self):
+        """
+        The counts as a json serialisable list.
+
+        :returns state:  a list of integers
+        """
+        return self.counts.tolist()
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild a DurationHistogram from the output of to_state().
+
+        :param state:  a list of integers
+        :returns histogram:  a DurationHistogram object
+        """
+        return cls(state)
+
+
+def write_histograms(path, entries):
+    """
+    Write histograms to a json file with the bucket bounds, replacing the
+    file in one step.
+
+    :param path:     a string
+    :param entries:  a list of dictionary objects, each the label columns of
+                     a histogram and its counts under COUNT_KEY
+    """
+    atomic_write(path, lambda histogram_file: json.dump(
+        {'bounds': bucket_bounds(), 'histograms': entries}, histogram_file,
+        sort_keys=True))
+
+
+def read_histograms(path):
+    """
+    Read the histograms of a file written by write_histograms().
+
+    :param path:  a string
+    :returns entries:  a list of dictionary objects
+    """
+    with open(path) as histogram_file:
+        written = json.load(histogram_file)
+    if len(written['bounds']) != BUCKET_COUNT:
+        raise ValueError('{} has different buckets'.format(path))
+    return written['histograms']
+
+
+def merge_histograms(entries, labels):
+    """
+    Add up the histograms that share the same values of some labels, e.g.
+    the histograms of a spider across nodes and days.
+
+    :param entries:  a list of dictionary objects
+    :param labels:   the label columns to keep, the others are summed over
+    :returns entries:  a list of dictionary objects, in the order each
+                       combination of labels first appears
+    """
+    merged = {}
+    keys = []
+    for entry in entries:
+        key = tuple(entry.get(label, '') for label in labels)
+        histogram = merged.get(key)
+        if histogram is None:
+            histogram = merged[key] = DurationHistogram()
+            keys.append(key)
+        histogram.merge(DurationHistogram.from_state(entry[COUNT_KEY]))
+
+    results = []
+    for key in keys:
+        entry = dict(zip(labels, key))
+        entry[COUNT_KEY] = merged[key].to_state()
+        results.append(entry)
+    return results
+
+
+def parse_arguments(arguments):
+    """
+    Parse the arguments of the merge command.
+
+    :param arguments:  a list of arguments from sys.argv
+    :returns parser.parse_args(arguments):  argparse namespace object
+    """
+    parser = argparse.ArgumentParser(
+        description='Add up the histograms of several histogram files')
+    parser.add_argument('files',
+                        help=('Histogram json files written by overwatch '
+                              '--histograms'),
+                        type=str,
+                        nargs='+')
+
+    parser.add_argument('--by',
+                        help=('The label columns to keep, e.g. Spider or '
+                              'Node Spider; the histograms are summed over '
+                              'the rest'),
+                        type=str,
+                        nargs='*',
+                        default=['Spider'])
+
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    """
+    Print the merged histograms of the files as json.
+
+    :param arguments:  argparse namespace object
+    """
+    entries = []
+    for path in arguments.files:
+        entries.extend(read_histograms(path))
+    json.dump({'bounds': bucket_bounds(),
+               'histograms': merge_histograms(entries, arguments.by)},
+              sys.stdout, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,263 @@
+import binascii
+import hashlib
+import io
+import mmap
+import os
+import re
+import struct
+import threading
+
+from atomic import atomic_write
+from metrics import CrawlMetrics
+
+
+RECORD = struct.Struct('<16sIIqq')
+BLOCK = struct.Struct('<qq')
+BLOCK_RECORDS = 4096
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock_for(path):
+    """One lock per store directory, shared by every HistoryStore on it."""
+    with _locks_lock:
+        return _locks.setdefault(os.path.realpath(path), threading.RLock())
+
+
+def pack_job_id(job_id):
+    """
+    Pack a scrapyd job id into 16 bytes. Scrapyd ids are 32 hex digits;
+    any other id is stored as its md5 digest.
+
+    :param job_id:  a string
+    :returns packed:  16 bytes
+    """
+    if re.match(r'^[0-9a-fA-F]{32}$', job_id):
+        return binascii.unhexlify(job_id)
+    return hashlib.md5(job_id.encode('utf-8')).digest()
+
+
+class HistoryStore(object):
+    """
+    An append-only store of finished jobs in fixed-width binary records,
+    kept in a directory alongside the csv files.
+
+    Each record packs the job id, spider, node, and start and end times
+    in integer microseconds into RECORD.size bytes. Spider and node names
+    are interned in names.txt and stored as their line number. Records
+    are only ever appended to jobs.dat, which is memory-mapped for reads.
+
+    blocks.idx holds the lowest and highest end time of each run of
+    BLOCK_RECORDS records, so a time range query reads only the blocks
+    that can hold matching jobs. It is written before the records it
+    covers, and blocks missing from it, e.g. after a crash, are rebuilt
+    from the records.
+
+    Every HistoryStore on a directory shares one lock, and reads names.txt
+    and blocks.idx again under it before each append and query, so stores
+    opened by different threads never hand out the same name id twice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.records_path = os.path.join(path, 'jobs.dat')
+        self.blocks_path = os.path.join(path, 'blocks.idx')
+        self.names_path = os.path.join(path, 'names.txt')
+        self.lock = _lock_for(path)
+        with self.lock:
+            self.reload()
+
+    def reload(self):
+        """
+        Read the names and block index as they are on disk, rebuilding the
+        blocks the index is missing. Call with the lock held.
+        """
+        self.names = []
+        if os.path.exists(self.names_path):
+            with io.open(self.names_path, encoding='utf-8') as names_file:
+                self.names = [line.rstrip(u'\n') for line in names_file]
+        self.name_ids = dict((name, index)
+                             for index, name in enumerate(self.names))
+
+        self.blocks = []
+        if os.path.exists(self.blocks_path):
+            with open(self.blocks_path, 'rb') as blocks_file:
+                data = blocks_file.read()
+            self.blocks = [list(BLOCK.unpack_from(data, offset))
+                           for offset in range(0, len(data) - BLOCK.size + 1,
+                                               BLOCK.size)]
+
+        count = len(self)
+        if count > len(self.blocks) * BLOCK_RECORDS:
+            self.rebuild_blocks(count)
+
+    def rebuild_blocks(self, count):
+        """
+        Work out the blocks from the last indexed one on, which may be
+        missing later records too, from the records themselves.
+
+        :param count:  the number of records stored
+        """
+        first_block = max(0, len(self.blocks) - 1)
+        del self.blocks[first_block:]
+        with open(self.records_path, 'rb') as records_file:
+            records_file.seek(first_block * BLOCK_RECORDS * RECORD.size)
+            data = records_file.read(
+                (count - first_block * BLOCK_RECORDS) * RECORD.size)
+
+        end_times = [RECORD.unpack_from(data, offset)[4]
+                     for offset in range(0, len(data), RECORD.size)]
+        for first in range(0, len(end_times), BLOCK_RECORDS):
+            block = end_times[first:first + BLOCK_RECORDS]
+            self.blocks.append([min(block), max(block)])
+
+    def __len__(self):
+        if not os.path.exists(self.records_path):
+            return 0
+        return os.path.getsize(self.records_path) // RECORD.size
+
+    def name_id(self, name):
+        """
+        The number of a spider or node name, adding it if it is new.
+
+        :param name:  a string
+        :returns name_id:  integer
+        """
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            with io.open(self.names_path, 'a', encoding='utf-8') as names_file:
+                names_file.write(u'{}\n'.format(name))
+        return name_id
+
+    def append(self, jobs):
+        """
+        Append finished jobs, skipping any already stored.
+
+        Scrapyd lists a job from the moment it finishes, so a stored copy
+        of a job in the batch ends no earlier than the batch's earliest
+        end; only those blocks are read to find duplicates.
+
+        :param jobs:  a list of (job id, spider, node, start time, end time)
+                      tuples, with times in integer microseconds
+        :returns appended:  the number of jobs appended
+        """
+        if not jobs:
+            return 0
+
+        with self.lock:
+            self.reload()
+            earliest = min(job[4] for job in jobs)
+            stored_ids = set(pack_job_id(job_id) for job_id, _, _, _, _
+                             in self.query(earliest))
+
+            records = []
+            for job_id, spider, node, start_time, end_time in jobs:
+                packed_id = pack_job_id(job_id)
+                if packed_id in stored_ids:
+                    continue
+                stored_ids.add(packed_id)
+                records.append((packed_id, self.name_id(spider),
+                                self.name_id(node), start_time, end_time))
+
+            if not records:
+                return 0
+
+            count = len(self)
+            for number, record in enumerate(records, count):
+                end_time = record[4]
+                block = number // BLOCK_RECORDS
+                if block == len(self.blocks):
+                    self.blocks.append([end_time, end_time])
+                elif end_time < self.blocks[block][0]:
+                    self.blocks[block][0] = end_time
+                elif end_time > self.blocks[block][1]:
+                    self.blocks[block][1] = end_time
+
+            blocks = b''.join(BLOCK.pack(*block) for block in self.blocks)
+            atomic_write(self.blocks_path,
+                         lambda blocks_file: blocks_file.write(blocks), 'wb')
+
+            # Written after the last whole record rather than at the end of
+            # the file, so a torn record is overwritten instead of shifting
+            # every record after it.
+            mode = 'r+b' if os.path.exists(self.records_path) else 'wb'
+            with open(self.records_path, mode) as records_file:
+                records_file.seek(count * RECORD.size)
+                records_file.write(b''.join(RECORD.pack(*record)
+                                            for record in records))
+                records_file.truncate()
+
+        return len(records)
+
+    def query(self, start=None, end=None, spider=None, node=None):
+        """
+        Yield the stored jobs that ended at or after start and before end,
+        reading only the blocks whose end times overlap the range.
+
+        :param start:   integer microseconds since the epoch, or None
+        :param end:     integer microseconds since the epoch, or None
+        :param spider:  only jobs of this spider, if given
+        :param node:    only jobs from this node, if given
+        :returns jobs:  an iterator of (job id, spider, node, start time,
+                        end time) tuples
+        """
+        with self.lock:
+            self.reload()
+            count = len(self)
+        if not count:
+            return
+
+        spider_id = self.name_ids.get(spider, -1) if spider else None
+        node_id = self.name_ids.get(node, -1) if node else None
+
+        with open(self.records_path, 'rb') as records_file:
+            data = mmap.mmap(records_file.fileno(), count * RECORD.size,
+                             access=mmap.ACCESS_READ)
+            try:
+                for block, (lowest, highest) in enumerate(self.blocks):
+                    if start is not None and highest < start:
+                        continue
+                    if end is not None and lowest >= end:
+                        continue
+
+                    first = block * BLOCK_RECORDS
+                    last = min(count, first + BLOCK_RECORDS)
+                    for offset in range(first * RECORD.size,
+                                        last * RECORD.size,
+                                        RECORD.size):
+                        (packed_id, record_spider, record_node,
+                         start_time, end_time) = RECORD.unpack_from(data,
+                                                                    offset)
+                        if start is not None and end_time < start:
+                            continue
+                        if end is not None and end_time >= end:
+                            continue
+                        if spider_id is not None and record_spider != spider_id:
+                            continue
+                        if node_id is not None and record_node != node_id:
+                            continue
+                        yield (binascii.hexlify(packed_id).decode('ascii'),
+                               self.names[record_spider],
+                               self.names[record_node],
+                               start_time,
+                               end_time)
+            finally:
+                data.close()
+
+    def query_metrics(self, start=None, end=None, spider=None, node=None):
+        """
+        Fold the jobs matching a query into a CrawlMetrics.
+
+        :returns job_metrics:  a metrics.CrawlMetrics object
+        """
+        job_metrics = CrawlMetrics()
+        for _, _, _, start_time, end_time in self.query(start, end,
+                                                         spider, node):
+            job_metrics.add(start_time, end_time)
+        return job_metrics
@@ -0,0 +1,80 @@
+import json
+import os
+import re
+
+from atomic import atomic_write
+from metrics import GroupedMetrics
+
+
+class IncrementalState(object):
+    """
+    The running aggregates and seen job ids of one project on one node,
+    kept in a small json file between runs.
+
+    Scrapyd appends newly finished jobs and drops the oldest ones, so only
+    the ids in the latest response need to be remembered to tell new jobs
+    from ones that were already folded into the aggregates.
+    """
+
+    def __init__(self, path, seen_ids=None, job_metrics=None, group_by=None,
+                 histogram_by=None):
+        self.path = path
+        self.seen_ids = seen_ids if seen_ids is not None else set()
+        if job_metrics is None:
+            job_metrics = GroupedMetrics(group_by, keep_durations=False,
+                                         histogram_by=histogram_by)
+        self.job_metrics = job_metrics
+
+    @classmethod
+    def load(cls, path, group_by=None, histogram_by=None):
+        """
+        Read the state file, starting afresh if there is none yet, or if it
+        was saved with a different grouping or by an older version.
+
+        :param path:          a string
+        :param group_by:      the grouping of the aggregates
+        :param histogram_by:  the grouping of the duration histograms
+        :returns state:  an IncrementalState object
+        """
+        if not os.path.exists(path):
+            return cls(path, group_by=group_by, histogram_by=histogram_by)
+
+        with open(path) as state_file:
+            state = json.load(state_file)
+
+        if (state['metrics'].get('group_by') != group_by or
+                state['metrics'].get('histogram_by') != histogram_by):
+            return cls(path, group_by=group_by, histogram_by=histogram_by)
+
+        try:
+            job_metrics = GroupedMetrics.from_state(state['metrics'])
+        except KeyError:
+            return cls(path, group_by=group_by, histogram_by=histogram_by)
+
+        return cls(path,
+                   seen_ids=set(state['seen_ids']),
+                   job_metrics=job_metrics)
+
+    def save(self):
+        """Write the state file, replacing the old one in a single step."""
+        state = {'seen_ids': sorted(self.seen_ids),
+                 'metrics': self.job_metrics.to_state()}
+
+        atomic_write(self.path,
+                     lambda state_file: json.dump(state, state_file))
+
+
+def build_state_file(state_dir, project_name, node, kind='state'):
+    """
+    Path of the state file for a project on a node.
+
+    :param state_dir:     a string
+    :param project_name:  a string
+    :param node:          a scrapyd end point, e.g. http://127.0.0.1:6800
+    :param kind:          what the file keeps, e.g. state or logs
+    :returns state_file:  a string
+    """
+    node_name = re.sub(r'[^A-Za-z0-9.-]+', '_', re.sub(r'^\w+://', '', node))
+    filename = '{}_{}.{}.json'.format(project_name, node_name.strip('_'),
+                                      kind)
+    return os.path.join(state_dir, filename)
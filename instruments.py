@@ -0,0 +1,224 @@
+from __future__ import division
+
+import contextlib
+import json
+import sys
+import threading
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from atomic import atomic_write
+
+
+TRACEMALLOC_AVAILABLE = tracemalloc is not None
+
+
+class Stage(object):
+    """
+    Time one run of a stage. Set items and nbytes inside the with block
+    to record how much the stage processed.
+    """
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+        self.items = 0
+        self.nbytes = 0
+        self.started = None
+
+    def __enter__(self):
+        self.started = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name,
+                                timeit.default_timer() - self.started,
+                                self.items,
+                                self.nbytes)
+        return False
+
+
+class NullStage(object):
+    """A stage that records nothing, shared by every disabled stage."""
+
+    items = 0
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class NullInstruments(object):
+    """
+    Instrumentation that is switched off. stage() hands back the shared
+    NULL_STAGE, so a disabled stage costs one method call and nothing is
+    timed, counted or kept.
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def record(self, name, seconds, items=0, nbytes=0):
+        pass
+
+    def report(self):
+        pass
+
+
+NULL_INSTRUMENTS = NullInstruments()
+
+
+class Instruments(object):
+    """
+    Wall time, calls, items and bytes per stage of a run, summed over
+    every call of the stage, including calls from worker threads.
+
+    report() passes the summary to each sink, any callable taking the
+    summary dictionary: stderr_sink, a JSONFileSink, or a callback.
+    """
+
+    enabled = True
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.stages = {}
+        self.order = []
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Time a stage with a with block.
+
+        :param name:  the stage name, e.g. fetch
+        :returns stage:  a Stage object
+        """
+        return Stage(self, name)
+
+    def record(self, name, seconds, items=0, nbytes=0):
+        """
+        Add one call of a stage to its totals.
+
+        :param name:     the stage name
+        :param seconds:  wall time of the call
+        :param items:    number of items processed
+        :param nbytes:   number of bytes processed
+        """
+        with self.lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = [0, 0.0, 0, 0]
+                self.order.append(name)
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += items
+            totals[3] += nbytes
+
+    def summary(self):
+        """
+        The totals of each stage, in the order the stages first ran.
+
+        :returns summary:  a list of dictionary objects
+        """
+        with self.lock:
+            return [{'stage': name,
+                     'calls': self.stages[name][0],
+                     'seconds': self.stages[name][1],
+                     'items': self.stages[name][2],
+                     'bytes': self.stages[name][3]}
+                    for name in self.order]
+
+    def report(self):
+        """Send the summary to every sink."""
+        summary = self.summary()
+        for sink in self.sinks:
+            sink(summary)
+
+
+def stderr_sink(summary):
+    """
+    Print a table of the stage totals to stderr.
+
+    :param summary:  a list of dictionary objects, from Instruments.summary
+    """
+    sys.stderr.write('{:<12} {:>6} {:>12} {:>10} {:>12}\n'.format(
+        'stage', 'calls', 'ms', 'items', 'bytes'))
+    for stage in summary:
+        sys.stderr.write('{:<12} {:>6} {:>12.2f} {:>10} {:>12}\n'.format(
+            stage['stage'], stage['calls'], stage['seconds'] * 1e3,
+            stage['items'], stage['bytes']))
+
+
+class JSONFileSink(object):
+    """Write the summary to a json file, replacing it on each report."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, summary):
+        atomic_write(self.path, lambda json_file: json.dump(
+            {'stages': summary}, json_file, indent=2, sort_keys=True))
+
+
+class CountingChunks(object):
+    """Pass chunks of a response body through, counting their bytes."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.nbytes = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.nbytes += len(chunk)
+            yield chunk
+
+
+@contextlib.contextmanager
+def profiled(profile_path=None, tracemalloc_top=None, stream=None):
+    """
+    Run the body of a with block under cProfile, tracemalloc, or both.
+
+    The cProfile stats are saved to profile_path for pstats or snakeviz
+    and the slowest functions by cumulative time are printed; tracemalloc
+    prints the tracemalloc_top lines that allocated the most memory.
+
+    :param profile_path:     where to save the cProfile stats, or None
+    :param tracemalloc_top:  number of allocation sites to print, or None
+    :param stream:           where to print, stderr by default
+    """
+    stream = stream or sys.stderr
+    profile = None
+    if profile_path:
+        import cProfile
+        profile = cProfile.Profile()
+    if tracemalloc_top:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_path)
+            import pstats
+            pstats.Stats(profile, stream=stream).sort_stats(
+                'cumulative').print_stats(20)
+
+        if tracemalloc_top:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            for statistic in snapshot.statistics('lineno')[:tracemalloc_top]:
+                stream.write('{}\n'.format(statistic))
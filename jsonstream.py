@@ -0,0 +1,180 @@
+import codecs
+import json
+import numbers
+
+
+WHITESPACE = ' \t\n\r'
+
+
+class ChunkedJSONReader(object):
+    """
+    Decode JSON values one at a time from an iterable of byte chunks.
+
+    Only the text of the value being decoded is buffered, so a large
+    document can be walked with memory bounded by its largest element
+    rather than by its total size.
+    """
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Append the next chunk of text to the buffer, dropping the text that
+        has already been consumed.
+
+        :returns filled:  boolean, False once the body is exhausted
+        """
+        if self.eof:
+            return False
+
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+
+        tail = self.decoder.decode(b'', True)
+        self.buffer += tail
+        self.eof = True
+        return bool(tail)
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        :returns char:  a one character string, empty at the end of the body
+        """
+        while True:
+            while (self.pos < len(self.buffer) and
+                    self.buffer[self.pos] in WHITESPACE):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return u''
+
+    def expect(self, chars):
+        """
+        Consume the next character, which must be one of chars.
+
+        :param chars:   a string of acceptable characters
+        :returns char:  the character consumed
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expected one of {!r} at offset {}, got {!r}'
+                             .format(chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def decode_value(self):
+        """
+        Decode the next complete JSON value, reading more chunks as needed.
+
+        A number that runs to the end of the buffer may continue in the next
+        chunk, so it is only accepted once more text or the end is seen.
+
+        :returns value:  the decoded value
+        """
+        if (self.pos >= len(self.buffer) or
+                self.buffer[self.pos] in WHITESPACE):
+            self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer,
+                                                          self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+
+            if (end == len(self.buffer) and not self.eof and
+                    isinstance(value, numbers.Number)):
+                self.fill()
+                continue
+
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Yield each element of the JSON array starting at the cursor."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.decode_value()
+            if (self.pos < len(self.buffer) and
+                    self.buffer[self.pos] == ','):
+                self.pos += 1
+            elif self.expect(',]') == ']':
+                return
+
+
+def iter_array_items(chunks, key, encoding='utf-8'):
+    """
+    Yield the elements of the array stored under key in a top level JSON
+    object, decoding one element at a time.
+
+    Other arrays in the object are walked element by element and thrown
+    away, other values are decoded and thrown away.
+
+    :param chunks:    an iterable of byte strings
+    :param key:       the name of the array to yield from
+    :param encoding:  the text encoding of the chunks
+    """
+    reader = ChunkedJSONReader(chunks, encoding)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        name = reader.decode_value()
+        reader.expect(':')
+        if reader.peek() == '[':
+            for item in reader.iter_array():
+                if name == key:
+                    yield item
+        else:
+            reader.decode_value()
+
+        if reader.expect(',}') == '}':
+            return
+
+
+def iter_named_items(chunks, names, encoding='utf-8'):
+    """
+    Yield the elements of every array stored under one of names in a top
+    level JSON object, with the name of their array, in a single pass.
+
+    :param chunks:    an iterable of byte strings
+    :param names:     a collection of array names to yield from
+    :param encoding:  the text encoding of the chunks
+    :returns items:   an iterator of (name, element) tuples
+    """
+    reader = ChunkedJSONReader(chunks, encoding)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        name = reader.decode_value()
+        reader.expect(':')
+        if reader.peek() == '[':
+            for item in reader.iter_array():
+                if name in names:
+                    yield name, item
+        else:
+            reader.decode_value()
+
+        if reader.expect(',}') == '}':
+            return
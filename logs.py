@@ -0,0 +1,271 @@
+from __future__ import division
+
+import json
+import mmap
+import multiprocessing
+import os
+import re
+
+from atomic import atomic_write
+
+
+STATS_MARKER = b'Dumping Scrapy stats:'
+# The stats dump is the last thing a crawl logs, so only the tail of a log
+# is searched for it.
+TAIL_BYTES = 1024 * 1024
+STAT_PATTERN = re.compile(
+    br"'(item_scraped_count|downloader/request_count|"
+    br"downloader/response_bytes)': (\d+)")
+# Fewer uncached logs than this are scanned without starting a pool.
+MIN_PARALLEL_LOGS = 64
+
+
+def build_log_path(logs_dir, project, spider, job_id):
+    """
+    Path of the log scrapyd writes for a job.
+
+    :param logs_dir:  the scrapyd logs directory
+    :param project:   the project name
+    :param spider:    the spider name
+    :param job_id:    the job id
+    :returns path:  a string
+    """
+    return os.path.join(logs_dir, project, spider, '{}.log'.format(job_id))
+
+
+def read_log_stats(path):
+    """
+    Read the final Scrapy stats dump of a log, memory mapping the file and
+    searching back from its end.
+
+    :param path:  a string
+    :returns stats:  a dictionary of item_scraped_count,
+                     downloader/request_count and downloader/response_bytes,
+                     or None if the log has no stats dump
+    """
+    with open(path, 'rb') as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        if not size:
+            return None
+        log_map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = log_map.rfind(STATS_MARKER, max(0, size - TAIL_BYTES))
+            if start == -1:
+                return None
+            end = log_map.find(b'}', start)
+            dump = log_map[start:end if end != -1 else size]
+        finally:
+            log_map.close()
+
+    stats = {'item_scraped_count': 0,
+             'downloader/request_count': 0,
+             'downloader/response_bytes': 0}
+    for name, value in STAT_PATTERN.findall(dump):
+        stats[name.decode('ascii')] = int(value)
+    return stats
+
+
+def scan_log(path):
+    """
+    Read the stats of a log with the size and modification time they were
+    read at, in a worker.
+
+    :param path:  a string
+    :returns result:  a (path, size, mtime, stats or None) tuple, or None if
+                      the log cannot be read
+    """
+    try:
+        status = os.stat(path)
+        return path, status.st_size, status.st_mtime, read_log_stats(path)
+    except (IOError, OSError):
+        return None
+
+
+class LogStatsCache(object):
+    """
+    The stats read from each log, kept in a json file with the size and
+    modification time of the log, so a log is only read again once it
+    changes.
+
+    Saving keeps only the logs asked for since loading, so the entries of
+    jobs scrapyd no longer lists fall out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.used = {}
+        if os.path.exists(path):
+            with open(path) as cache_file:
+                self.entries = json.load(cache_file)
+
+    def lookup(self, path):
+        """
+        The cached stats of a log if it has not changed.
+
+        :param path:  a string
+        :returns found, stats:  a boolean and the stats or None
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return False, None
+        try:
+            status = os.stat(path)
+        except OSError:
+            return False, None
+        if [status.st_size, status.st_mtime] != entry[:2]:
+            return False, None
+        self.used[path] = entry
+        return True, entry[2]
+
+    def store(self, path, size, mtime, stats):
+        """
+        Remember the stats of a log.
+
+        :param path:   a string
+        :param size:   the size of the log when it was read
+        :param mtime:  the modification time of the log when it was read
+        :param stats:  a dictionary object, or None
+        """
+        self.used[path] = self.entries[path] = [size, mtime, stats]
+
+    def save(self):
+        """Write the cache file, replacing the old one in a single step."""
+        atomic_write(self.path,
+                     lambda cache_file: json.dump(self.used, cache_file))
+
+
+def scan_logs(paths, cache=None, processes=None, pool=None):
+    """
+    Read the stats of many logs, from the cache where a log has not changed
+    and otherwise over a pool of processes, or over the given pool when one
+    is shared between callers.
+
+    :param paths:      a list of log paths
+    :param cache:      a LogStatsCache object, or None
+    :param processes:  number of worker processes, by default one per core
+    :param pool:       a multiprocessing.Pool object, or None
+    :returns stats:  a dictionary of path to stats, for the logs that have a
+                     stats dump
+    """
+    stats = {}
+    uncached = []
+    for path in paths:
+        found, log_stats = False, None
+        if cache is not None:
+            found, log_stats = cache.lookup(path)
+        if not found:
+            uncached.append(path)
+        elif log_stats is not None:
+            stats[path] = log_stats
+
+    processes = processes or multiprocessing.cpu_count()
+    if len(uncached) < MIN_PARALLEL_LOGS or (pool is None and
+                                             processes == 1):
+        results = [scan_log(path) for path in uncached]
+    elif pool is not None:
+        chunksize = max(1, len(uncached) // (processes * 4))
+        results = pool.map(scan_log, uncached, chunksize)
+    else:
+        chunksize = max(1, len(uncached) // (processes * 4))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(scan_log, uncached, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    for result in results:
+        if result is None:
+            continue
+        path, size, mtime, log_stats = result
+        if cache is not None:
+            cache.store(path, size, mtime, log_stats)
+        if log_stats is not None:
+            stats[path] = log_stats
+
+    if cache is not None:
+        cache.save()
+    return stats
+
+
+class LogTotals(object):
+    """
+    Items, requests and response bytes summed over the crawls whose logs
+    were read, with the crawl time they took, so rates are per second of
+    crawling.
+    """
+
+    def __init__(self):
+        self.crawls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.requests = 0
+        self.response_bytes = 0
+
+    def add(self, seconds, stats):
+        """
+        Fold the stats of one crawl into the totals.
+
+        :param seconds:  the crawl duration
+        :param stats:    a dictionary object, from read_log_stats
+        """
+        self.crawls += 1
+        self.seconds += seconds
+        self.items += stats['item_scraped_count']
+        self.requests += stats['downloader/request_count']
+        self.response_bytes += stats['downloader/response_bytes']
+
+    def merge(self, other):
+        """
+        Fold another LogTotals into this one.
+
+        :param other:  a LogTotals object
+        :returns self:  the merged LogTotals object
+        """
+        self.crawls += other.crawls
+        self.seconds += other.seconds
+        self.items += other.items
+        self.requests += other.requests
+        self.response_bytes += other.response_bytes
+        return self
+
+    def to_state(self):
+        """
+        The totals as a json serialisable list.
+
+        :returns state:  a list
+        """
+        return [self.crawls, self.seconds, self.items, self.requests,
+                self.response_bytes]
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild a LogTotals from the output of to_state().
+
+        :param state:  a list
+        :returns log_totals:  a LogTotals object
+        """
+        log_totals = cls()
+        (log_totals.crawls, log_totals.seconds, log_totals.items,
+         log_totals.requests, log_totals.response_bytes) = state
+        return log_totals
+
+    def scrapy_metrics(self):
+        """
+        The log columns of the csv file.
+
+        :returns scrapy_metrics:  a dictionary object
+        """
+        items_per_second = requests_per_second = 0.0
+        if self.seconds:
+            items_per_second = round(self.items / self.seconds, 2)
+            requests_per_second = round(self.requests / self.seconds, 2)
+
+        return {'Logged crawls': self.crawls,
+                'Items scraped': self.items,
+                'Items p/s': items_per_second,
+                'Requests': self.requests,
+                'Requests p/s': requests_per_second,
+                'Response bytes': self.response_bytes}
@@ -0,0 +1,621 @@
+from concurrency import ConcurrencyProfile
+from decimal import Decimal, getcontext
+from histogram import COUNT_KEY, DurationHistogram
+from jobtable import JobTable
+from logs import LogTotals
+from tdigest import TDigest
+from timestamps import DAY_MICROSECONDS, to_datetime, to_seconds
+from windows import WindowIndex
+
+
+GROUP_BY_SPIDER = 'spider'
+GROUP_BY_SPIDER_DAY = 'spider_day'
+
+
+def build_group_key(group_by, spider, end_time):
+    """
+    The key of the group a crawl falls in.
+
+    :param group_by:  GROUP_BY_SPIDER or GROUP_BY_SPIDER_DAY
+    :param spider:    the name of the spider that ran the crawl
+    :param end_time:  integer microseconds since the epoch
+    :returns key:  a tuple
+    """
+    if group_by == GROUP_BY_SPIDER_DAY:
+        return (spider, end_time // DAY_MICROSECONDS)
+    return (spider,)
+
+
+class CrawlMetrics(object):
+    """
+    Accumulate crawl metrics from finished scrapyd jobs in a single pass.
+
+    Each finished job is folded in with add(), after which every metric
+    written to the csv file can be derived without walking the jobs again.
+
+    The individual crawls are kept in order in a compact JobTable unless
+    keep_durations is False, in which case memory use does not grow with
+    the number of jobs and rolling windows are not available. Duration
+    quantiles come from a t-digest and the shape of the distribution from
+    a log scale histogram, which both stay bounded either way.
+    """
+
+    def __init__(self, keep_durations=True):
+        self.count = 0
+        self.duration_sum = 0.0
+        self.longest = None
+        self.shortest = None
+        self.earliest_start = None
+        self.latest_end = None
+        self.jobs = JobTable() if keep_durations else None
+        self.digest = TDigest()
+        self.histogram = DurationHistogram()
+        self.logs = LogTotals()
+        self.window_index = None
+        self.profile = None
+
+    @property
+    def start_times(self):
+        """The kept start times in microseconds, or None."""
+        if self.jobs is None:
+            return None
+        return self.jobs.start_times
+
+    @property
+    def end_times(self):
+        """The kept end times in microseconds, or None."""
+        if self.jobs is None:
+            return None
+        return self.jobs.end_times
+
+    @property
+    def durations(self):
+        """The kept crawl durations in seconds, or None."""
+        if self.jobs is None:
+            return None
+        return self.jobs.durations()
+
+    def add(self, start_time, end_time, spider=None):
+        """
+        Fold a single finished crawl into the running aggregates.
+
+        :param start_time:  integer microseconds since the epoch
+        :param end_time:    integer microseconds since the epoch
+        :param spider:      the name of the spider that ran the crawl
+        """
+        duration = to_seconds(end_time - start_time)
+        if self.jobs is not None:
+            self.jobs.append(spider, start_time, end_time)
+        self.count += 1
+        self.duration_sum += duration
+        self.digest.add(duration)
+        self.histogram.add(duration)
+
+        if self.longest is None or duration > self.longest:
+            self.longest = duration
+        if self.shortest is None or duration < self.shortest:
+            self.shortest = duration
+
+        if self.earliest_start is None or start_time < self.earliest_start:
+            self.earliest_start = start_time
+        if self.latest_end is None or end_time > self.latest_end:
+            self.latest_end = end_time
+
+    def to_state(self):
+        """
+        The running aggregates as a json serialisable dictionary. The
+        individual durations are left out.
+
+        :returns state:  a dictionary object
+        """
+        return {'count': self.count,
+                'duration_sum': self.duration_sum,
+                'longest': self.longest,
+                'shortest': self.shortest,
+                'earliest_start': self.earliest_start,
+                'latest_end': self.latest_end,
+                'digest': self.digest.to_state(),
+                'histogram': self.histogram.to_state(),
+                'logs': self.logs.to_state()}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild a CrawlMetrics from the output of to_state(). Durations are
+        not kept by the rebuilt object.
+
+        :param state:  a dictionary object
+        :returns job_metrics:  a CrawlMetrics object
+        """
+        job_metrics = cls(keep_durations=False)
+        job_metrics.count = state['count']
+        job_metrics.duration_sum = state['duration_sum']
+        job_metrics.longest = state['longest']
+        job_metrics.shortest = state['shortest']
+        job_metrics.earliest_start = state['earliest_start']
+        job_metrics.latest_end = state['latest_end']
+        job_metrics.digest = TDigest.from_state(state['digest'])
+        if 'histogram' in state:
+            job_metrics.histogram = DurationHistogram.from_state(
+                state['histogram'])
+        if 'logs' in state:
+            job_metrics.logs = LogTotals.from_state(state['logs'])
+        return job_metrics
+
+    def merge(self, other):
+        """
+        Fold the aggregates of another CrawlMetrics into this one, e.g. to
+        combine the jobs of several scrapyd nodes.
+
+        Durations are only kept if both sides kept them.
+
+        :param other:  a CrawlMetrics object
+        :returns self:  the merged CrawlMetrics object
+        """
+        if self.jobs is not None and other.jobs is not None:
+            self.jobs.extend(other.jobs)
+        else:
+            self.jobs = None
+
+        self.count += other.count
+        self.duration_sum += other.duration_sum
+        self.digest.merge(other.digest)
+        self.histogram.merge(other.histogram)
+        self.logs.merge(other.logs)
+
+        if other.longest is not None and (self.longest is None or
+                                          other.longest > self.longest):
+            self.longest = other.longest
+        if other.shortest is not None and (self.shortest is None or
+                                           other.shortest < self.shortest):
+            self.shortest = other.shortest
+
+        if other.earliest_start is not None and (
+                self.earliest_start is None or
+                other.earliest_start < self.earliest_start):
+            self.earliest_start = other.earliest_start
+        if other.latest_end is not None and (
+                self.latest_end is None or
+                other.latest_end > self.latest_end):
+            self.latest_end = other.latest_end
+
+        return self
+
+    def total_duration(self):
+        """
+        Time between the earliest start and the latest end in seconds.
+
+        :returns total_duration:  a float
+        """
+        return to_seconds(self.latest_end - self.earliest_start)
+
+    def window_metrics(self, windows, reference=None):
+        """
+        Metrics for each trailing window ending at reference, from an index
+        of the jobs sorted by end time that is built once and reused while
+        no more jobs are added.
+
+        :param windows:    a list of window labels, e.g. ['15m', '1h']
+        :param reference:  integer microseconds since the epoch, by default
+                           the latest end time
+        :returns window_metrics:  a dictionary object
+        """
+        if self.end_times is None:
+            raise ValueError('Rolling windows need the individual crawls, '
+                             'which are not kept')
+
+        if self.window_index is None or self.window_index.count != self.count:
+            self.window_index = WindowIndex(self.start_times, self.end_times)
+
+        return self.window_index.window_metrics(windows, reference)
+
+    def concurrency_profile(self):
+        """
+        The observed number of running crawls over time, from a sweep over
+        the start and end times that is reused while no jobs are added.
+
+        :returns profile:  a concurrency.ConcurrencyProfile object
+        """
+        if self.end_times is None:
+            raise ValueError('Observed concurrency needs the individual '
+                             'crawls, which are not kept')
+
+        if self.profile is None or self.profile.count != self.count:
+            self.profile = ConcurrencyProfile(self.start_times,
+                                              self.end_times)
+
+        return self.profile
+
+    def slots(self, concurrent_spiders=None):
+        """
+        The number of spiders that can run at once: the configured number
+        when given, otherwise the peak observed concurrency.
+
+        :param concurrent_spiders:  integer or None
+        :returns slots:  integer
+        """
+        if concurrent_spiders is not None:
+            return concurrent_spiders
+        return self.concurrency_profile().peak
+
+    def concurrency_metrics(self, concurrent_spiders=None):
+        """
+        Peak and mean observed concurrency, the share of the slots in use,
+        and the crawls per hour the measured parallelism sustains.
+
+        :param concurrent_spiders:  integer or None
+        :returns concurrency_metrics:  a dictionary object
+        """
+        profile = self.concurrency_profile()
+        mean = profile.mean()
+        slots = self.slots(concurrent_spiders)
+
+        return {
+            'Peak concurrency': profile.peak,
+            'Mean concurrency': round(mean, 2),
+            'Utilisation': round(mean / slots, 4) if slots else None,
+            'Est CR p/h': round(self.single_crawls_per_hour() * mean, 2)
+        }
+
+    def crawl_duration_quantile(self, q):
+        """
+        Estimated crawl duration at quantile q, to the microsecond.
+
+        :param q:  a float between 0 and 1
+        :returns crawl_duration:  a float
+        """
+        return round(self.digest.quantile(q), 6)
+
+    def av_crawl_duration(self):
+        """
+        Mean crawl duration, rounded to 2 decimal places.
+
+        :returns av_crawl_seconds:  a float
+        """
+        getcontext().prec = 4
+        av_crawl_seconds = Decimal(self.duration_sum / self.count)
+        av_crawl_seconds = round(av_crawl_seconds, 2)
+
+        return float(av_crawl_seconds)
+
+    def single_crawls_per_hour(self):
+        """
+        Number of crawls a single spider can do per hour.
+
+        :returns single_crawls_per_hour:  a float
+        """
+        av_crawl_duration = self.av_crawl_duration()
+        single_crawls_per_hour = Decimal(3600) / Decimal(av_crawl_duration)
+
+        return float(single_crawls_per_hour)
+
+    def est_total_crawls_per_hour(self, concurrent_spiders=None):
+        """
+        Number of crawls all spiders can do per hour.
+
+        :param concurrent_spiders:  integer, or None for the peak observed
+                                    concurrency
+        :returns est_total_crawls_per_hour:  a float
+        """
+        single_crawls_per_hour = self.single_crawls_per_hour()
+        est_total_crawls_per_hour = single_crawls_per_hour * \
+                                        self.slots(concurrent_spiders)
+
+        return float(est_total_crawls_per_hour)
+
+    def single_crawls_per_day(self):
+        """
+        Number of crawls a single spider can do per day.
+
+        :returns single_crawls_per_day:  a float
+        """
+        single_crawls_per_hour = self.single_crawls_per_hour()
+        single_crawls_per_day = round((single_crawls_per_hour * 24), 2)
+
+        return float(single_crawls_per_day)
+
+    def est_total_crawls_per_day(self, concurrent_spiders=None):
+        """
+        Number of crawls all spiders can do per day.
+
+        :param concurrent_spiders:  integer, or None for the peak observed
+                                    concurrency
+        :returns est_total_crawls_per_day:  a float
+        """
+        est_total_crawls_per_hour = self.est_total_crawls_per_hour(
+            concurrent_spiders)
+        est_total_crawls_per_day = est_total_crawls_per_hour * 24
+
+        return float(est_total_crawls_per_day)
+
+    def single_crawls_per_week(self):
+        """
+        Number of crawls a single spider can do per week.
+
+        :returns single_crawls_per_week:  a float
+        """
+        single_crawls_per_day = self.single_crawls_per_day()
+        single_crawls_per_week = single_crawls_per_day * 7
+
+        return float(single_crawls_per_week)
+
+    def est_total_crawls_per_week(self, concurrent_spiders=None):
+        """
+        Number of crawls all spiders can do per week.
+
+        :param concurrent_spiders:  integer, or None for the peak observed
+                                    concurrency
+        :returns est_total_crawls_per_week:  a float
+        """
+        est_total_crawls_per_day = self.est_total_crawls_per_day(
+            concurrent_spiders)
+        est_total_crawls_per_week = est_total_crawls_per_day * 7
+
+        return float(est_total_crawls_per_week)
+
+    def scrapy_metrics(self, concurrent_spiders=None, windows=None,
+                       reference=None):
+        """
+        Populate a dictionary with every metric written to the csv file.
+        Observed concurrency is included when the individual crawls are
+        kept.
+
+        :param concurrent_spiders:  integer, or None for the peak observed
+                                    concurrency
+        :param windows:             a list of rolling window labels
+        :param reference:           the end of the windows in integer
+                                    microseconds since the epoch, by default
+                                    the latest end time
+        :returns scrapy_metrics:    a dictionary object
+        """
+        scrapy_metrics = {
+            'Av CR (S)': self.av_crawl_duration(),
+            'Longest CR (S)': self.longest,
+            'Shortest CR (S)': self.shortest,
+            'p50 CR (S)': self.crawl_duration_quantile(0.5),
+            'p90 CR (S)': self.crawl_duration_quantile(0.9),
+            'p99 CR (S)': self.crawl_duration_quantile(0.99),
+            'Total Duration': self.total_duration(),
+            'Single CR p/h': self.single_crawls_per_hour(),
+            'Max CR p/h': self.est_total_crawls_per_hour(concurrent_spiders),
+            'Single CR p/d': self.single_crawls_per_day(),
+            'Max CR p/d': self.est_total_crawls_per_day(concurrent_spiders),
+            'Single CR p/7d': self.single_crawls_per_week(),
+            'Max CR p/7d': self.est_total_crawls_per_week(concurrent_spiders),
+            'Completed crawls': self.count
+        }
+        if self.logs.crawls:
+            scrapy_metrics.update(self.logs.scrapy_metrics())
+        if self.end_times is not None:
+            scrapy_metrics.update(self.concurrency_metrics(concurrent_spiders))
+        if windows:
+            scrapy_metrics.update(self.window_metrics(windows, reference))
+
+        return scrapy_metrics
+
+
+class GroupedMetrics(object):
+    """
+    A CrawlMetrics for all finished jobs plus one for each group of jobs,
+    filled in by the same single pass.
+
+    Jobs are grouped by spider, or by spider and the day they finished on,
+    and each group's accumulator is found by a dictionary lookup on its
+    key. With no grouping only the total is kept.
+
+    With histogram_by the duration histograms are also kept under a
+    grouping of their own, so they can be broken down per spider however
+    the csv rows are grouped.
+    """
+
+    def __init__(self, group_by=None, keep_durations=True,
+                 histogram_by=None):
+        self.group_by = group_by
+        self.keep_durations = keep_durations
+        self.histogram_by = histogram_by
+        self.total = CrawlMetrics(keep_durations)
+        self.groups = {}
+        self.histograms = {}
+
+    def add(self, spider, start_time, end_time):
+        """
+        Fold a single finished crawl into the total and its group.
+
+        :param spider:      the name of the spider that ran the crawl
+        :param start_time:  integer microseconds since the epoch
+        :param end_time:    integer microseconds since the epoch
+        """
+        self.total.add(start_time, end_time, spider)
+        if self.histogram_by is not None:
+            key = build_group_key(self.histogram_by, spider, end_time)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = DurationHistogram()
+            histogram.add(to_seconds(end_time - start_time))
+
+        if self.group_by is None:
+            return
+
+        key = build_group_key(self.group_by, spider, end_time)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = CrawlMetrics(self.keep_durations)
+        group.add(start_time, end_time, spider)
+
+    def add_log_stats(self, spider, start_time, end_time, stats):
+        """
+        Fold the log stats of a finished crawl, already added, into the
+        total and its group.
+
+        :param spider:      the name of the spider that ran the crawl
+        :param start_time:  integer microseconds since the epoch
+        :param end_time:    integer microseconds since the epoch
+        :param stats:       a dictionary object, from logs.read_log_stats
+        """
+        seconds = to_seconds(end_time - start_time)
+        self.total.logs.add(seconds, stats)
+        if self.group_by is None:
+            return
+
+        key = build_group_key(self.group_by, spider, end_time)
+        self.groups[key].logs.add(seconds, stats)
+
+    def merge(self, other):
+        """
+        Fold the total and groups of another GroupedMetrics into this one.
+
+        :param other:  a GroupedMetrics object with the same grouping
+        :returns self:  the merged GroupedMetrics object
+        """
+        self.total.merge(other.total)
+        for key, other_group in other.groups.items():
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = CrawlMetrics(self.keep_durations)
+            group.merge(other_group)
+        for key, other_histogram in other.histograms.items():
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = DurationHistogram()
+            histogram.merge(other_histogram)
+
+        return self
+
+    def to_state(self):
+        """
+        The total and group aggregates as a json serialisable dictionary.
+
+        :returns state:  a dictionary object
+        """
+        return {'group_by': self.group_by,
+                'histogram_by': self.histogram_by,
+                'total': self.total.to_state(),
+                'groups': [[list(key), group.to_state()]
+                           for key, group in self.groups.items()],
+                'histograms': [[list(key), histogram.to_state()]
+                               for key, histogram in self.histograms.items()]}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild a GroupedMetrics from the output of to_state().
+
+        :param state:  a dictionary object
+        :returns grouped_metrics:  a GroupedMetrics object
+        """
+        grouped_metrics = cls(state['group_by'], keep_durations=False,
+                              histogram_by=state.get('histogram_by'))
+        grouped_metrics.total = CrawlMetrics.from_state(state['total'])
+        for key, group_state in state['groups']:
+            grouped_metrics.groups[tuple(key)] = CrawlMetrics.from_state(
+                group_state)
+        for key, histogram_state in state.get('histograms', []):
+            grouped_metrics.histograms[tuple(key)] = (
+                DurationHistogram.from_state(histogram_state))
+
+        return grouped_metrics
+
+    def group_columns(self, group_by=None):
+        """
+        The csv columns that name a group.
+
+        :param group_by:  the grouping, by default that of the csv rows
+        :returns columns:  a list of strings
+        """
+        if group_by is None:
+            group_by = self.group_by
+        if group_by == GROUP_BY_SPIDER_DAY:
+            return ['Spider', 'Day']
+        if group_by == GROUP_BY_SPIDER:
+            return ['Spider']
+        return []
+
+    def label_group(self, key, row, group_by=None):
+        """
+        Fill in the columns that name a group.
+
+        :param key:       a group key
+        :param row:       a dictionary object, updated in place
+        :param group_by:  the grouping, by default that of the csv rows
+        """
+        if group_by is None:
+            group_by = self.group_by
+        row['Spider'] = key[0]
+        if group_by == GROUP_BY_SPIDER_DAY:
+            row['Day'] = to_datetime(
+                key[1] * DAY_MICROSECONDS).strftime('%Y-%m-%d')
+
+    def label_total(self, row, group_by=None):
+        """
+        Fill in the columns that name the total.
+
+        :param row:       a dictionary object, updated in place
+        :param group_by:  the grouping, by default that of the csv rows
+        """
+        columns = self.group_columns(group_by)
+        for column in columns:
+            row[column] = ''
+        if columns:
+            row['Spider'] = 'total'
+
+    def histogram_rows(self):
+        """
+        The duration histogram of each group, sorted by key, then of the
+        total. The groups are those of histogram_by when it was given, and
+        otherwise those of the csv rows.
+
+        :returns histogram_rows:  a list of dictionary objects with the
+                                  counts under histogram.COUNT_KEY
+        """
+        group_by = self.histogram_by
+        histograms = self.histograms
+        if group_by is None:
+            group_by = self.group_by
+            histograms = dict((key, group.histogram)
+                              for key, group in self.groups.items())
+
+        rows = []
+        for key in sorted(histograms):
+            row = {COUNT_KEY: histograms[key].to_state()}
+            self.label_group(key, row, group_by)
+            rows.append(row)
+
+        row = {COUNT_KEY: self.total.histogram.to_state()}
+        self.label_total(row, group_by)
+        rows.append(row)
+        return rows
+
+    def scrapy_metrics(self, concurrent_spiders=None, windows=None,
+                       reference=None):
+        """
+        Populate a metrics dictionary for each group, sorted by key, then
+        one for the total.
+
+        Every row measures its windows back from the same reference, so a
+        spider that stopped finishing crawls shows empty recent windows
+        rather than windows ending at its own last crawl.
+
+        :param concurrent_spiders:  integer, or None for the peak observed
+                                    concurrency
+        :param windows:             a list of rolling window labels
+        :param reference:           the end of the windows in integer
+                                    microseconds since the epoch, by default
+                                    the latest end time of all the jobs
+        :returns scrapy_metrics:    a list of dictionary objects
+        """
+        if reference is None:
+            reference = self.total.latest_end
+
+        rows = []
+        for key in sorted(self.groups):
+            scrapy_metrics = self.groups[key].scrapy_metrics(
+                concurrent_spiders, windows, reference)
+            self.label_group(key, scrapy_metrics)
+            rows.append(scrapy_metrics)
+
+        scrapy_metrics = self.total.scrapy_metrics(concurrent_spiders, windows,
+                                                   reference)
+        self.label_total(scrapy_metrics)
+        rows.append(scrapy_metrics)
+
+        return rows
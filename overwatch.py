@@ -1,12 +1,300 @@
 import argparse
 import csv
 import datetime
+import multiprocessing
 import os
 import requests
 import settings
 import sys
+import threading
+import time
+
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from requests.packages.urllib3.util.retry import Retry
+from anomaly import AnomalyDetector, write_alerts
+from atomic import atomic_write
+from batch import analyse_dumps, find_dumps
+from exporter import MetricsCache, start_server
+from forecast import (DrainForecast, DurationModel, forecast_columns,
+                      forecast_runs)
+from histogram import write_histograms
+from history import HistoryStore
+from incremental import IncrementalState, build_state_file
+from instruments import (NULL_INSTRUMENTS, TRACEMALLOC_AVAILABLE,
+                         CountingChunks, Instruments, JSONFileSink,
+                         profiled, stderr_sink)
+from jsonstream import iter_array_items, iter_named_items
+from logs import LogStatsCache, build_log_path, scan_logs
+from metrics import GROUP_BY_SPIDER, GROUP_BY_SPIDER_DAY, GroupedMetrics
+from projects import ProjectDiscovery
+from replay import FileResponse, ResponseCache
+from timestamps import (from_datetime, parse_timestamp, to_datetime,
+                        to_seconds)
+from watch import NO_RESULT, Watcher
+from windows import parse_window
+
+STREAM_CHUNK_SIZE = 64 * 1024
+HISTORY_BATCH_SIZE = 4096
+RETRY_STATUSES = (502, 503, 504)
+ALL_PROJECTS = 'all_projects'
+
+
+def build_output_file(project_name, report=None, extension='csv'):
+    """
+    Path of today's csv file for a project under settings.OUTPUT_PATH.
+
+    :param project_name:  a string
+    :param report:        a string naming a secondary report, if any
+    :param extension:     the file extension, for reports that are not csv
+    :returns output_file:  a string
+    """
+    today = datetime.datetime.today().strftime('%d-%m-%Y')
+    filename = '{}_{}.{}'.format(today, project_name, extension)
+    if report:
+        filename = '{}_{}_{}.{}'.format(today, project_name, report,
+                                        extension)
+    return os.path.join(settings.OUTPUT_PATH, filename)
+
+
+def build_alerts_file(arguments, project_name):
+    """
+    Where the crawls flagged by --anomalies are appended: --alerts_file, or
+    a json lines file per project under settings.OUTPUT_PATH.
+
+    :param arguments:     argparse namespace object
+    :param project_name:  a string
+    :returns alerts_file:  a string, - for stdout
+    """
+    if arguments.alerts_file:
+        return arguments.alerts_file[0]
+    return os.path.join(settings.OUTPUT_PATH,
+                        '{}_alerts.jsonl'.format(project_name))
+
+
+def build_project_name(arguments):
+    """
+    The project the output files are named after: --project_name, or
+    all_projects when the projects are discovered.
+
+    :param arguments:  argparse namespace object
+    :returns project_name:  a string
+    """
+    if arguments.project_name:
+        return arguments.project_name[0]
+    return ALL_PROJECTS
+
+
+def build_node(arguments):
+    """
+    The scrapyd end point given by --domain_name and --port, or the saved
+    response given by --input.
+
+    :param arguments:  argparse namespace object
+    :returns node:     a string, e.g. http://127.0.0.1:6800
+    """
+    if arguments.input:
+        return arguments.input[0]
+    if arguments.port:
+        return '{}:{}'.format(arguments.domain_name[0], arguments.port[0])
+    return arguments.domain_name[0]
+
+
+def build_group_by(arguments):
+    """
+    The grouping asked for on the command line.
+
+    :param arguments:  argparse namespace object
+    :returns group_by:  metrics.GROUP_BY_SPIDER, metrics.GROUP_BY_SPIDER_DAY
+                        or None
+    """
+    if arguments.by_day:
+        return GROUP_BY_SPIDER_DAY
+    if arguments.by_spider:
+        return GROUP_BY_SPIDER
+    return None
+
+
+def build_histogram_by(arguments):
+    """
+    The grouping of the duration histograms, per spider, or per spider and
+    day with --by_day, whatever the grouping of the csv rows.
+
+    :param arguments:  argparse namespace object
+    :returns histogram_by:  metrics.GROUP_BY_SPIDER,
+                            metrics.GROUP_BY_SPIDER_DAY or None without
+                            --histograms
+    """
+    if not arguments.histograms:
+        return None
+    if arguments.by_day:
+        return GROUP_BY_SPIDER_DAY
+    return GROUP_BY_SPIDER
+
+
+def build_cache(arguments):
+    """
+    The on-disk response cache given by --cache_dir, if any.
+
+    :param arguments:  argparse namespace object
+    :returns cache:    a replay.ResponseCache object, or None
+    """
+    if not arguments.cache_dir:
+        return None
+
+    return ResponseCache(arguments.cache_dir[0],
+                         arguments.cache_ttl,
+                         int(arguments.cache_max_mb * 1024 * 1024))
+
+
+def build_discovery(arguments, session=None):
+    """
+    The project discovery for --all_projects, keeping the project lists
+    in the state directory.
+
+    :param arguments:  argparse namespace object
+    :param session:    a requests.Session object, or None
+    :returns discovery:  a projects.ProjectDiscovery object, or None
+    """
+    if not arguments.all_projects:
+        return None
+
+    state_dir = settings.OUTPUT_PATH
+    if arguments.state_dir:
+        state_dir = arguments.state_dir[0]
+    return ProjectDiscovery(os.path.join(state_dir, 'projects.json'),
+                            arguments.projects_ttl,
+                            session=session,
+                            timeout=(arguments.connect_timeout,
+                                     arguments.timeout))
+
+
+def build_retry(retries, backoff):
+    """
+    Retry failed connections and reads, and gateway errors where urllib3
+    can hand back the last response, waiting backoff * 2 ** n seconds
+    between attempts.
+
+    When the retries of a status run out the last response is returned,
+    so check_response_code still reports it. Older urllib3 releases would
+    raise instead, so there only connections and reads are retried.
+
+    :param retries:  the most retries of one request
+    :param backoff:  the backoff factor in seconds
+    :returns retry:  a urllib3 Retry object
+    """
+    try:
+        return Retry(total=retries, connect=retries, read=retries,
+                     status_forcelist=RETRY_STATUSES,
+                     backoff_factor=backoff,
+                     raise_on_status=False)
+    except TypeError:
+        return Retry(total=retries, connect=retries, read=retries,
+                     backoff_factor=backoff)
+
+
+def create_session(pool_size, retries=0, backoff=0.0):
+    """
+    Create a requests session whose keep-alive connection pool holds a
+    connection per worker, so concurrent requests reuse connections.
+
+    Responses are requested gzip compressed, which requests decodes
+    transparently, in --stream mode too.
+
+    :param pool_size:  integer
+    :param retries:    the most retries of one request
+    :param backoff:    the retry backoff factor in seconds
+    :returns session:  a requests.Session object
+    """
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = 'gzip'
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size,
+                                            max_retries=build_retry(retries,
+                                                                    backoff))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def build_fieldnames(columns, rows):
+    """
+    The csv column names of rows: the label columns, then every other
+    column in the order it first appears. Rows may have different columns,
+    e.g. only the spiders with logged crawls have the log columns.
+
+    :param columns:  a list of the leading column names
+    :param rows:     a list of dictionary objects
+    :returns fieldnames:  a list of column names
+    """
+    fieldnames = list(columns)
+    seen = set(fieldnames)
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                fieldnames.append(key)
+    return fieldnames
+
+
+def write_csv(output_file, fieldnames, rows):
+    """
+    Write rows of metrics to a csv file, replacing the file in one step so
+    a reader never sees it half written.
+
+    :param output_file:  a string
+    :param fieldnames:   a list of column names
+    :param rows:         a list of dictionary objects
+    """
+    def write(csvfile):
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    atomic_write(output_file, write)
+
+
+def write_timeline_csv(arguments, job_metrics):
+    """
+    Write the observed concurrency timeline, bucketed by --timeline, to
+    today's timeline csv file for the project.
+
+    :param arguments:    argparse namespace object
+    :param job_metrics:  a metrics.CrawlMetrics object
+    """
+    bucket = parse_window(arguments.timeline[0]) * 10 ** 6
+    rows = job_metrics.concurrency_profile().timeline_rows(bucket)
+    write_csv(build_output_file(build_project_name(arguments), 'timeline'),
+              ['Bucket start', 'Mean concurrency', 'Peak concurrency',
+               'Completions'],
+              rows)
+
+
+def write_histograms_file(arguments, rows):
+    """
+    Write the duration histograms to today's histograms json file for the
+    project, next to the csv file.
+
+    :param arguments:  argparse namespace object
+    :param rows:       a list of dictionary objects, labelled histograms
+    """
+    write_histograms(build_output_file(build_project_name(arguments),
+                                       'histograms', 'json'),
+                     rows)
+
+
+def write_forecast_csv(arguments, fieldnames, rows):
+    """
+    Write the pending queue drain forecast to today's forecast csv file for
+    the project.
+
+    :param arguments:   argparse namespace object
+    :param fieldnames:  a list of column names
+    :param rows:        a list of dictionary objects
+    """
+    write_csv(build_output_file(build_project_name(arguments), 'forecast'),
+              fieldnames, rows)
 
-from decimal import Decimal, getcontext
 
 class Overwatch(object):
     """
@@ -21,24 +309,87 @@ class Overwatch(object):
     Writes the results to a csv file on the disk.
     """
 
-    def __init__(self, arguments):
+    def __init__(self, arguments, node=None, session=None, instruments=None,
+                 project=None, clock=datetime.datetime.now, log_pool=None):
         self.arguments = arguments
-        if self.arguments.port:
-            self.query_url = '{}:{}/listjobs.json?project={}'.format(
-                self.arguments.domain_name[0],
-                self.arguments.port[0],
-                self.arguments.project_name[0])
-        else:
-            self.query_url = '{}/listjobs.json?project={}'.format(
-                self.arguments.domain_name[0],
-                self.arguments.project_name[0])
+        self.clock = clock
+        self.log_pool = log_pool
+        if node is None:
+            node = build_node(self.arguments)
+        if project is None:
+            project = self.arguments.project_name[0]
+
+        self.node = node
+        self.project = project
+        self.query_url = '{}/listjobs.json?project={}'.format(self.node,
+                                                              self.project)
+
+        self.con_spiders = None
+        if self.arguments.concurrent_spiders:
+            self.con_spiders = self.arguments.concurrent_spiders[0]
+        self.group_by = build_group_by(self.arguments)
+        self.histogram_by = build_histogram_by(self.arguments)
+
+        self.output_file = build_output_file(self.project)
+        state_dir = settings.OUTPUT_PATH
+        if self.arguments.state_dir:
+            state_dir = self.arguments.state_dir[0]
+
+        self.state_file = build_state_file(state_dir, self.project, self.node)
+        self.log_cache_file = build_state_file(state_dir, self.project,
+                                               self.node, 'logs')
+        self.anomaly_file = build_state_file(state_dir, self.project,
+                                             self.node, 'anomaly')
+        self.alerts_file = build_alerts_file(self.arguments, self.project)
+        self.history = None
+        if self.arguments.history:
+            self.history = HistoryStore(os.path.join(
+                self.arguments.history[0], self.project))
+
+        self.session = session
+        self.cache = build_cache(self.arguments)
+        self.instruments = instruments or NULL_INSTRUMENTS
+        self.stream_chunks = None
+        self.grouped_metrics = None
+        self.grouped_metrics_response = None
+        self.fetch()
+
+    def fetch(self):
+        """
+        Query the listjobs end point, replacing any previous response.
 
-        self.con_spiders = self.arguments.concurrent_spiders[0]
+        Uses the shared session when one was given, so keep-alive
+        connections are reused between requests. With --input the saved
+        response is read instead, and with --cache_dir a response fetched
+        within --cache_ttl seconds is read from the cache.
 
-        today = datetime.datetime.today().strftime('%d-%m-%Y')
-        filename = '{}_{}.csv'.format(today, self.arguments.project_name[0])
-        self.output_file = os.path.join(settings.OUTPUT_PATH, filename)
-        self.response = requests.get(self.query_url)
+        :returns response:  a requests.Response or replay.FileResponse
+                            object
+        """
+        client = self.session if self.session is not None else requests
+        with self.instruments.stage('fetch') as stage:
+            if self.arguments.input:
+                self.response = FileResponse(self.arguments.input[0])
+            elif self.cache is not None:
+                self.response = self.cache.fetch(client, self.query_url,
+                                                 self.build_timeout())
+            else:
+                self.response = client.get(self.query_url,
+                                           stream=self.arguments.stream,
+                                           timeout=self.build_timeout())
+            if self.instruments.enabled and not self.arguments.stream:
+                stage.nbytes = len(self.response.content)
+
+        return self.response
+
+    def build_timeout(self):
+        """
+        The connect and read timeouts of a request, so a node that accepts
+        the connection but never answers is given up on too.
+
+        :returns timeout:  a (connect seconds, read seconds) tuple
+        """
+        return self.arguments.connect_timeout, self.arguments.timeout
 
     def str_to_dt(self, date_string):
         """
@@ -47,9 +398,7 @@ class Overwatch(object):
         :param date_string: a date in format <"yy-mm-dd hh-mm-ss.mmmmmm">
         :return dt:         a datetime.datetime type object
         """
-        dt = datetime.datetime.strptime(
-                date_string,
-                '%Y-%m-%d %H:%M:%S.%f')
+        dt = to_datetime(parse_timestamp(date_string))
         return dt
 
     def check_response_code(self):
@@ -80,52 +429,304 @@ class Overwatch(object):
         calculated_delta = end_time - start_time
         return calculated_delta
 
-    def gather_scrapy_metrics(self):
+    def iter_finished_jobs(self):
+        """
+        Iterate over the finished jobs in the response.
+
+        Jobs are decoded one at a time as they are read, so only one job
+        dictionary is alive at once rather than the whole decoded list. In
+        streaming mode the body is also downloaded a chunk at a time. The
+        jobs can only be read once.
+
+        :returns finished_jobs:  an iterator of dictionaries
+        """
+        if self.arguments.stream:
+            chunks = self.response.iter_content(STREAM_CHUNK_SIZE)
+            if self.instruments.enabled:
+                chunks = self.stream_chunks = CountingChunks(chunks)
+        else:
+            chunks = [self.response.content]
+
+        return iter_array_items(chunks, 'finished')
+
+    def gather_grouped_metrics(self):
+        """
+        Decode the response once and fold every finished job into a
+        GroupedMetrics accumulator in a single pass.
+
+        The accumulator is kept until the response changes, so every
+        metric below is derived from the same pass over the jobs. In
+        streaming and incremental mode the individual crawl durations are
+        not kept.
+
+        :returns grouped_metrics:  a metrics.GroupedMetrics object
+        """
+        if (self.grouped_metrics is None or
+                self.grouped_metrics_response is not self.response):
+            jobs = self.iter_finished_jobs()
+            if self.arguments.incremental:
+                grouped_metrics = self.gather_incremental_metrics(jobs)
+            else:
+                grouped_metrics = GroupedMetrics(
+                    self.group_by,
+                    keep_durations=not self.arguments.stream,
+                    histogram_by=self.histogram_by)
+                self.fold_jobs(grouped_metrics, jobs)
+
+            self.grouped_metrics = grouped_metrics
+            self.grouped_metrics_response = self.response
+
+        return self.grouped_metrics
+
+    def fold_jobs(self, grouped_metrics, jobs):
+        """
+        Decode each finished job, parse its timestamps and add it to the
+        accumulator and, when a history store is kept, to the store in
+        batches of HISTORY_BATCH_SIZE jobs. With --logs_dir the stats of
+        each job's log are then added too, and with --anomalies the jobs
+        finished since the last run are scored.
+
+        :param grouped_metrics:  a metrics.GroupedMetrics object
+        :param jobs:             an iterator of dictionaries
+        """
+        log_jobs = [] if self.arguments.logs_dir else None
+        detector = None
+        new_jobs = []
+        if self.arguments.anomalies:
+            detector = AnomalyDetector(self.anomaly_file,
+                                       self.arguments.anomaly_alpha,
+                                       self.arguments.anomaly_z,
+                                       self.arguments.anomaly_warmup)
+        with self.instruments.stage('fold') as stage:
+            folded = grouped_metrics.total.count
+            batch = []
+            for item in jobs:
+                start_time = parse_timestamp(item['start_time'])
+                end_time = parse_timestamp(item['end_time'])
+                grouped_metrics.add(item['spider'], start_time, end_time)
+                if log_jobs is not None:
+                    log_jobs.append((item['id'], item['spider'], start_time,
+                                     end_time))
+                if (detector is not None and
+                        detector.is_new(item['spider'], end_time)):
+                    new_jobs.append((item['id'], item['spider'], start_time,
+                                     end_time))
+
+                if self.history is not None:
+                    batch.append((item['id'], item['spider'], self.node,
+                                  start_time, end_time))
+                    if len(batch) >= HISTORY_BATCH_SIZE:
+                        self.history.append(batch)
+                        batch = []
+
+            if batch:
+                self.history.append(batch)
+
+            stage.items = grouped_metrics.total.count - folded
+            if self.stream_chunks is not None:
+                stage.nbytes = self.stream_chunks.nbytes
+
+        if log_jobs:
+            self.fold_log_stats(grouped_metrics, log_jobs)
+        if detector is not None:
+            self.flag_anomalies(detector, new_jobs)
+
+    def fold_log_stats(self, grouped_metrics, log_jobs):
+        """
+        Read the final Scrapy stats of each job's log under --logs_dir and
+        add them to the accumulator. Logs are scanned in parallel, over the
+        fleet's shared pool when polled by one, and a log unchanged since an
+        earlier run is not read again.
+
+        :param grouped_metrics:  a metrics.GroupedMetrics object
+        :param log_jobs:         a list of (id, spider, start time, end time)
+        """
+        logs_dir = self.arguments.logs_dir[0]
+        paths = [build_log_path(logs_dir, self.project, spider, job_id)
+                 for job_id, spider, _, _ in log_jobs]
+        with self.instruments.stage('logs') as stage:
+            stats = scan_logs(paths, LogStatsCache(self.log_cache_file),
+                              self.arguments.processes, self.log_pool)
+            for path, (_, spider, start_time, end_time) in zip(paths,
+                                                              log_jobs):
+                if path in stats:
+                    grouped_metrics.add_log_stats(spider, start_time,
+                                                  end_time, stats[path])
+            stage.items = len(stats)
+
+    def flag_anomalies(self, detector, new_jobs):
+        """
+        Score the jobs finished since the last run against the moving
+        average duration of their spider, append those flagged to the
+        alerts file and keep the updated averages.
+
+        :param detector:  an anomaly.AnomalyDetector object
+        :param new_jobs:  a list of (id, spider, start time, end time)
+        """
+        with self.instruments.stage('anomalies') as stage:
+            alerts = detector.observe(new_jobs)
+            for alert in alerts:
+                alert['node'] = self.node
+                alert['project'] = self.project
+            write_alerts(self.alerts_file, alerts)
+            detector.save()
+            stage.items = len(new_jobs)
+
+    def gather_job_metrics(self):
+        """
+        The metrics of all finished jobs, from the single pass made by
+        gather_grouped_metrics.
+
+        :returns job_metrics:  a metrics.CrawlMetrics object
+        """
+        return self.gather_grouped_metrics().total
+
+    def gather_incremental_metrics(self, jobs=None):
+        """
+        Fold only the finished jobs that the previous run has not seen into
+        the aggregates kept in the state file, then save the state.
+
+        Seen jobs are skipped by id without parsing their timestamps.
+
+        :param jobs:  an iterator of dictionaries, by default the finished
+                      jobs in the response
+        :returns grouped_metrics:  a metrics.GroupedMetrics object
+        """
+        if jobs is None:
+            jobs = self.iter_finished_jobs()
+
+        state = IncrementalState.load(self.state_file, self.group_by,
+                                      self.histogram_by)
+        grouped_metrics = state.job_metrics
+        seen_ids = state.seen_ids
+        current_ids = set()
+
+        def unseen_jobs():
+            for item in jobs:
+                current_ids.add(item['id'])
+                if item['id'] not in seen_ids:
+                    yield item
+
+        self.fold_jobs(grouped_metrics, unseen_jobs())
+        state.seen_ids = current_ids
+        state.save()
+        return grouped_metrics
+
+    def gather_queued_jobs(self, now=None):
+        """
+        The spiders of the pending jobs, in queue order, and of the running
+        jobs with how long they have been running, from one pass over the
+        response. A running job scrapyd gives no start time counts as just
+        started.
+
+        :param now:  integer microseconds since the epoch, in the node's
+                     local time, by default the time now
+        :returns pending, running:  a list of spider names and a list of
+                                    (spider name, elapsed seconds) tuples
+        """
+        if now is None:
+            now = self.build_reference()
+
+        pending = []
+        running = []
+        for name, item in iter_named_items([self.response.content],
+                                           ('pending', 'running')):
+            if name == 'pending':
+                pending.append(item['spider'])
+            elif item.get('start_time'):
+                elapsed = to_seconds(now - parse_timestamp(item['start_time']))
+                running.append((item['spider'], max(0.0, elapsed)))
+            else:
+                running.append((item['spider'], 0.0))
+
+        return pending, running
+
+    def gather_forecast(self, now=None, runs=None):
+        """
+        Forecast when the pending queue will clear, drawing crawl durations
+        from the finished jobs of each spider.
+
+        :param now:   integer microseconds since the epoch, in the node's
+                      local time, by default the time now
+        :param runs:  the number of simulated runs, by default
+                      --forecast_runs cut to the length of the queue
+        :returns forecast:  a forecast.DrainForecast object, or None with no
+                            finished jobs to learn durations from
+        """
+        job_metrics = self.gather_job_metrics()
+        model = DurationModel(job_metrics.jobs)
+        if not len(model):
+            return None
+
+        if runs is None:
+            runs = self.arguments.forecast_runs
+
+        pending, running = self.gather_queued_jobs(now)
+        with self.instruments.stage('forecast') as stage:
+            forecast = DrainForecast(model, pending, running,
+                                     job_metrics.slots(self.con_spiders),
+                                     runs)
+            stage.items = len(pending)
+
+        return forecast
+
+    def build_reference(self):
+        """
+        The time now on the node's clock, which scrapyd timestamps are in,
+        to measure the rolling windows and running jobs back from. A
+        response read with --input was saved earlier, so its time is taken
+        to be the end of its latest finished crawl instead.
+
+        :returns reference:  integer microseconds since the epoch
+        """
+        if self.arguments.input:
+            latest_end = self.gather_job_metrics().latest_end
+            if latest_end is not None:
+                return latest_end
+        return from_datetime(self.clock())
+
+    def gather_scrapy_metrics(self, reference=None):
         """
         Populate a dictionary with scrapyd metrics.
 
+        :param reference:  the end of the rolling windows in integer
+                           microseconds since the epoch, by default now
         :returns scrapy_metrics:  a dictionary object
         """
-        self.scrapy_metrics = {
-            'Av CR (S)': self.calculate_av_crawl_duration(),
-            'Longest CR (S)': max(self.gather_crawl_durations()),
-            'Shortest CR (S)': min(self.gather_crawl_durations()),
-            'Total Duration': self.calculate_total_duration(),
-            'Single CR p/h': self.calculate_single_crawls_per_hour(),
-            'Max CR p/h': self.calculate_est_total_crawls_per_hour(),
-            'Single CR p/d': self.calculate_single_crawls_per_day(),
-            'Max CR p/d': self.calculate_est_total_crawls_per_day(),
-            'Single CR p/7d': self.calculate_single_crawls_per_week(),
-            'Max CR p/7d': self.calculate_est_total_crawls_per_week(),
-            'Completed crawls': self.gather_completed_crawl_count()
-        }
+        if reference is None:
+            reference = self.build_reference()
+        self.scrapy_metrics = self.gather_job_metrics().scrapy_metrics(
+            self.con_spiders,
+            self.arguments.windows,
+            reference)
         return self.scrapy_metrics
 
-    def gather_crawl_outliers(self):
+    def gather_spider_metrics(self, reference=None):
         """
-        Loop through a json response dictionary.
+        Populate a metrics dictionary for each spider, or each spider and
+        day, followed by one for all spiders.
 
-        Compare datetime to datetime in outliers dict, update the dict 
-        if conditions are met (i.e. the start time is earlier than the 
-        start time saved in the outliers dict).
+        :param reference:  the end of the rolling windows in integer
+                           microseconds since the epoch, by default now
+        :returns spider_metrics:  a list of dictionary objects
+        """
+        if reference is None:
+            reference = self.build_reference()
+        return self.gather_grouped_metrics().scrapy_metrics(
+            self.con_spiders,
+            self.arguments.windows,
+            reference)
 
-        Populate a dictionary with the values.
+    def gather_crawl_outliers(self):
+        """
+        Return the earliest start time and the latest end time of the
+        finished jobs.
 
         :returns outliers:  a dictionary object
         """
-        outliers = {'strt': None,
-                    'end': None}
-
-        for item in self.response.json()['finished']:
-            if not outliers['strt']:
-                outliers['strt'] = self.str_to_dt(item['start_time'])
-            elif self.str_to_dt(item['start_time']) < outliers['strt']:
-                outliers['strt'] = self.str_to_dt(item['start_time'])
-
-            if not outliers['end']:
-                outliers['end'] = self.str_to_dt(item['end_time'])
-            elif self.str_to_dt(item['end_time']) > outliers['end']:
-                outliers['end'] = self.str_to_dt(item['end_time'])
+        job_metrics = self.gather_job_metrics()
+        outliers = {'strt': to_datetime(job_metrics.earliest_start),
+                    'end': to_datetime(job_metrics.latest_end)}
         return outliers
 
     def calculate_total_duration(self):
@@ -135,27 +736,24 @@ class Overwatch(object):
 
         :returns total_duration.total_seconds:  a float
         """
-        outliers = self.gather_crawl_outliers()
-        total_duration = outliers['end'] - outliers['strt']
-        return total_duration.total_seconds()
+        return self.gather_job_metrics().total_duration()
 
     def gather_crawl_durations(self):
         """
-        Loop through the response dictionary, calculate delta for each
-        finished crawl, append timedelta.totalseconds value for each
-        to list.
+        Return the duration of each finished crawl in seconds, in the
+        order the jobs appear in the response.
+
+        Not available in streaming or incremental mode, where durations
+        are not kept.
 
         :return crawl_durations:  a list of floats
         """
-        crawl_durations = []
-        response_dictionary = self.response.json()
-        for item in response_dictionary['finished']:
-            start_dt = self.str_to_dt(item['start_time'])
-            end_dt = self.str_to_dt(item['end_time'])
-            duration = self.calculate_delta(start_dt, end_dt)
-            crawl_durations.append(duration.total_seconds())
-        
-        return crawl_durations
+        crawl_durations = self.gather_job_metrics().durations
+        if crawl_durations is None:
+            raise ValueError('Crawl durations are not kept in streaming '
+                             'or incremental mode')
+
+        return list(crawl_durations)
 
     def gather_completed_crawl_count(self):
         """
@@ -163,9 +761,7 @@ class Overwatch(object):
 
         :return completed_crawl_count:  integer
         """
-        response_dictionary = self.response.json()
-        completed_crawl_count = len(response_dictionary['finished'])      
-        return completed_crawl_count
+        return self.gather_job_metrics().count
 
     def calculate_av_crawl_duration(self):
         """
@@ -175,12 +771,7 @@ class Overwatch(object):
 
         :return av_crawl_seconds:  a float
         """
-        crawl_durations = self.gather_crawl_durations()
-        getcontext().prec = 4
-        av_crawl_seconds = Decimal(sum(crawl_durations) / len(crawl_durations))
-        av_crawl_seconds = round(av_crawl_seconds, 2)
-
-        return float(av_crawl_seconds)
+        return self.gather_job_metrics().av_crawl_duration()
 
     def calculate_single_crawls_per_hour(self):
         """
@@ -192,10 +783,7 @@ class Overwatch(object):
 
         :returns single_crawls_per_hour:  a float
         """
-        av_crawl_duration = self.calculate_av_crawl_duration()
-        single_crawls_per_hour = Decimal(3600) / Decimal(av_crawl_duration)
-
-        return float(single_crawls_per_hour)
+        return self.gather_job_metrics().single_crawls_per_hour()
 
     def calculate_est_total_crawls_per_hour(self):
         """
@@ -206,11 +794,8 @@ class Overwatch(object):
 
         :returns est_total_crawls_per_hour:  a float
         """
-        single_crawls_per_hour = self.calculate_single_crawls_per_hour()
-        est_total_crawls_per_hour = single_crawls_per_hour * \
-                                        self.arguments.concurrent_spiders[0]
-
-        return float(est_total_crawls_per_hour)
+        return self.gather_job_metrics().est_total_crawls_per_hour(
+            self.con_spiders)
 
     def calculate_single_crawls_per_day(self):
         """
@@ -221,10 +806,7 @@ class Overwatch(object):
 
         :returns single_crawls_per_day:  a float
         """
-        single_crawls_per_hour = self.calculate_single_crawls_per_hour()
-        single_crawls_per_day = round((single_crawls_per_hour * 24), 2)
-
-        return float(single_crawls_per_day)
+        return self.gather_job_metrics().single_crawls_per_day()
 
     def calculate_est_total_crawls_per_day(self):
         """
@@ -235,10 +817,8 @@ class Overwatch(object):
 
         :returns est_total_crawls_per_day:  a float
         """
-        est_total_crawls_per_hour = self.calculate_est_total_crawls_per_hour()
-        est_total_crawls_per_day = est_total_crawls_per_hour * 24
-
-        return float(est_total_crawls_per_day)
+        return self.gather_job_metrics().est_total_crawls_per_day(
+            self.con_spiders)
 
     def calculate_single_crawls_per_week(self):
         """
@@ -249,10 +829,7 @@ class Overwatch(object):
 
         :returns single_crawls_per_week:  a float
         """
-        single_crawls_per_day = self.calculate_single_crawls_per_day()
-        single_crawls_per_week = single_crawls_per_day * 7
-        
-        return float(single_crawls_per_week)
+        return self.gather_job_metrics().single_crawls_per_week()
 
     def calculate_est_total_crawls_per_week(self):
         """
@@ -263,20 +840,651 @@ class Overwatch(object):
 
         :returns est_total_crawls_per_week:  a float
         """
-        est_total_crawls_per_day = self.calculate_est_total_crawls_per_day()
-        est_total_crawls_per_week = est_total_crawls_per_day * 7
-       
-        return float(est_total_crawls_per_week)
+        return self.gather_job_metrics().est_total_crawls_per_week(
+            self.con_spiders)
+
+    def gather_csv_rows(self):
+        """
+        The csv column names and rows for this run, none when there are no
+        finished jobs, e.g. just after scrapyd restarts.
+
+        :returns fieldnames, rows:  a list of column names and a list of
+                                    dictionary objects
+        """
+        grouped_metrics = self.gather_grouped_metrics()
+        if not grouped_metrics.total.count:
+            return [], []
+
+        with self.instruments.stage('metrics') as stage:
+            if self.group_by:
+                rows = self.gather_spider_metrics()
+                fieldnames = build_fieldnames(grouped_metrics.group_columns(),
+                                              rows)
+            else:
+                rows = [self.gather_scrapy_metrics()]
+                fieldnames = list(rows[0].keys())
+            stage.items = len(rows)
+
+        return fieldnames, rows
 
     def write_to_csv(self):
         """Create a csv file from a dictionary."""
-        scrapy_metrics = self.gather_scrapy_metrics()
-        fieldnames = scrapy_metrics.keys()
-        
-        with open(self.output_file, 'w+') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerow(scrapy_metrics)
+        fieldnames, rows = self.gather_csv_rows()
+        if not rows:
+            print('No finished jobs')
+            return
+
+        with self.instruments.stage('write') as stage:
+            write_csv(self.output_file, fieldnames, rows)
+            if self.arguments.timeline:
+                write_timeline_csv(self.arguments, self.gather_job_metrics())
+            if self.arguments.histograms:
+                write_histograms_file(
+                    self.arguments,
+                    self.gather_grouped_metrics().histogram_rows())
+            stage.items = len(rows)
+
+        if self.arguments.forecast:
+            forecast = self.gather_forecast()
+            if forecast is None:
+                print('No finished jobs to forecast the pending queue from')
+            else:
+                write_forecast_csv(self.arguments, forecast_columns(),
+                                   [forecast.row()])
+
+
+class OverwatchFleet(object):
+    """
+    Query the listjobs end point of many scrapyd nodes concurrently.
+
+    Each node is fetched, and its metrics computed, by a worker from a
+    bounded thread pool through one shared keep-alive session. A node
+    that fails or times out is reported and left out of the results, as
+    are the nodes still outstanding when the --deadline passes.
+
+    With targets, the (node, project) pairs found by project discovery,
+    every project of every node is polled at once and each row is labelled
+    with its Project as well.
+
+    Writes a row per node plus a merged cluster-wide row, per project, to a
+    csv file on the disk.
+    """
+
+    def __init__(self, arguments, nodes, session=None, instruments=None,
+                 targets=None, clock=datetime.datetime.now):
+        self.arguments = arguments
+        self.clock = clock
+        self.nodes = nodes
+        self.discovered = targets is not None
+        if targets is None:
+            targets = [(node, self.arguments.project_name[0])
+                       for node in nodes]
+
+        self.targets = targets
+        self.workers = max(1, min(self.arguments.workers, len(self.targets)))
+        if session is None:
+            session = create_session(self.workers, self.arguments.retries,
+                                     self.arguments.backoff)
+
+        self.session = session
+        self.instruments = instruments or NULL_INSTRUMENTS
+        self.cancelled = threading.Event()
+        self.group_by = build_group_by(self.arguments)
+        self.histogram_by = build_histogram_by(self.arguments)
+        self.output_file = build_output_file(build_project_name(
+            self.arguments))
+        self.log_pool = self.create_log_pool()
+        try:
+            self.overwatches = self.poll()
+        finally:
+            if self.log_pool is not None:
+                if self.cancelled.is_set():
+                    self.log_pool.terminate()
+                else:
+                    self.log_pool.close()
+                    self.log_pool.join()
+
+    def create_log_pool(self):
+        """
+        Start the one process pool every node scans its logs over, before
+        any worker thread runs, rather than forking a pool per node from
+        the worker threads mid-poll.
+
+        :returns pool:  a multiprocessing.Pool object, or None without
+                        --logs_dir or with a single process
+        """
+        if not self.arguments.logs_dir or self.arguments.processes == 1:
+            return None
+        return multiprocessing.Pool(self.arguments.processes)
+
+    def describe_target(self, node, project):
+        """
+        How a node, or a project on a node once discovered, is reported.
+
+        :param node:     a scrapyd end point
+        :param project:  a project name
+        :returns description:  a string
+        """
+        if self.discovered:
+            return '{} {}'.format(node, project)
+        return node
+
+    def poll_node(self, node, project=None):
+        """
+        Fetch a single node and fold its finished jobs.
+
+        :param node:     a scrapyd end point, e.g. http://127.0.0.1:6800
+        :param project:  the project to query, by default --project_name
+        :returns overwatch:  an Overwatch object, or None on failure
+        """
+        try:
+            if self.cancelled.is_set():
+                return None
+            overwatch = Overwatch(self.arguments, node=node,
+                                  session=self.session,
+                                  instruments=self.instruments,
+                                  project=project,
+                                  clock=self.clock,
+                                  log_pool=self.log_pool)
+            if self.cancelled.is_set():
+                return None
+            if not overwatch.check_response_code():
+                print('Skipping node: {}'.format(
+                    self.describe_target(node, overwatch.project)))
+                return None
+
+            overwatch.gather_grouped_metrics()
+        except (requests.RequestException, ValueError) as error:
+            print('Request to {} failed: {}'.format(
+                self.describe_target(node, project), error))
+            return None
+
+        return overwatch
+
+    def poll_indexed(self, indexed_target):
+        """
+        Poll a node, keeping its position in the target list.
+
+        :param indexed_target:  an (index, (node, project)) tuple
+        :returns result:  an (index, Overwatch object or None) tuple
+        """
+        index, (node, project) = indexed_target
+        try:
+            return index, self.poll_node(node, project)
+        except Exception:
+            # A node dropped at the deadline may still be failing as the
+            # interpreter shuts down, its module globals already gone.
+            if self.cancelled.is_set():
+                return index, None
+            raise
+
+    def poll(self):
+        """
+        Poll every node through the worker pool, taking each node as soon
+        as it is done.
+
+        With a --deadline, the nodes still outstanding when it passes are
+        reported and dropped. Their workers are left to finish as daemon
+        threads, skipping the fold once the fetch returns, rather than
+        holding up the results of the nodes that answered in time.
+
+        :returns overwatches:  a list of Overwatch objects, in node order
+        """
+        deadline = None
+        if self.arguments.deadline:
+            deadline = time.time() + self.arguments.deadline[0]
+
+        results = [None] * len(self.targets)
+        done = set()
+        pool = ThreadPool(self.workers)
+        arrivals = pool.imap_unordered(self.poll_indexed,
+                                       enumerate(self.targets))
+        try:
+            for _ in self.targets:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0, deadline - time.time())
+                index, overwatch = arrivals.next(timeout)
+                results[index] = overwatch
+                done.add(index)
+        except TimeoutError:
+            self.cancelled.set()
+            pool.close()
+            outstanding = [self.describe_target(node, project)
+                           for index, (node, project)
+                           in enumerate(self.targets) if index not in done]
+            print('Deadline passed, skipping nodes: {}'.format(
+                ', '.join(outstanding)))
+        else:
+            pool.close()
+            pool.join()
+
+        return [overwatch for overwatch in results if overwatch is not None]
+
+    def gather_projects(self):
+        """
+        The nodes that responded, by project.
+
+        :returns projects:  a list of (project, list of Overwatch objects),
+                            in the order the projects were first polled
+        """
+        projects = []
+        overwatches_by_project = {}
+        for overwatch in self.overwatches:
+            overwatches = overwatches_by_project.get(overwatch.project)
+            if overwatches is None:
+                overwatches = overwatches_by_project[overwatch.project] = []
+                projects.append((overwatch.project, overwatches))
+            overwatches.append(overwatch)
+
+        return projects
+
+    def gather_grouped_metrics(self, overwatches=None):
+        """
+        Merge the total and grouped metrics of every node that responded.
+
+        :param overwatches:  the Overwatch objects to merge, by default all
+        :returns grouped_metrics:  a metrics.GroupedMetrics object
+        """
+        if overwatches is None:
+            overwatches = self.overwatches
+
+        grouped_metrics = GroupedMetrics(self.group_by,
+                                         histogram_by=self.histogram_by)
+        for overwatch in overwatches:
+            grouped_metrics.merge(overwatch.gather_grouped_metrics())
+
+        return grouped_metrics
+
+    def gather_job_metrics(self):
+        """
+        Merge the job metrics of every node that responded.
+
+        :returns job_metrics:  a metrics.CrawlMetrics object
+        """
+        return self.gather_grouped_metrics().total
+
+    def gather_cluster_slots(self, overwatches=None):
+        """
+        The number of spiders the cluster can run at once, or None to use
+        the peak observed concurrency.
+
+        :param overwatches:  the Overwatch objects of the cluster, by
+                             default all
+        :returns slots:  integer or None
+        """
+        if not self.arguments.concurrent_spiders:
+            return None
+        if overwatches is None:
+            overwatches = self.overwatches
+        return self.arguments.concurrent_spiders[0] * len(overwatches)
+
+    def gather_fleet_metrics(self):
+        """
+        Populate a list of metrics dictionaries: the rows of each node with
+        finished jobs, followed by the cluster-wide rows of each project.
+        With grouping a node or the cluster has a row per group plus a
+        total row.
+
+        The cluster can run concurrent_spiders on each responding node, or
+        without it as many as were seen running at once across the cluster.
+
+        Every node and the cluster measure their rolling windows back from
+        the same time, now.
+
+        :returns fleet_metrics:  a list of dictionary objects
+        """
+        reference = from_datetime(self.clock())
+        fleet_metrics = []
+        for overwatch in self.overwatches:
+            if overwatch.gather_completed_crawl_count():
+                for scrapy_metrics in overwatch.gather_spider_metrics(
+                        reference):
+                    scrapy_metrics['Node'] = overwatch.node
+                    if self.discovered:
+                        scrapy_metrics['Project'] = overwatch.project
+                    fleet_metrics.append(scrapy_metrics)
+
+        for project, overwatches in self.gather_projects():
+            grouped_metrics = self.gather_grouped_metrics(overwatches)
+            if not grouped_metrics.total.count:
+                continue
+            for scrapy_metrics in grouped_metrics.scrapy_metrics(
+                    self.gather_cluster_slots(overwatches),
+                    self.arguments.windows,
+                    reference):
+                scrapy_metrics['Node'] = 'cluster'
+                if self.discovered:
+                    scrapy_metrics['Project'] = project
+                fleet_metrics.append(scrapy_metrics)
+
+        return fleet_metrics
+
+    def gather_histogram_rows(self):
+        """
+        The duration histograms of each node with finished jobs, then of
+        the cluster per project, labelled like the csv rows.
+
+        :returns histogram_rows:  a list of dictionary objects
+        """
+        histogram_rows = []
+        for overwatch in self.overwatches:
+            if overwatch.gather_completed_crawl_count():
+                for row in overwatch.gather_grouped_metrics().histogram_rows():
+                    row['Node'] = overwatch.node
+                    if self.discovered:
+                        row['Project'] = overwatch.project
+                    histogram_rows.append(row)
+
+        for project, overwatches in self.gather_projects():
+            grouped_metrics = self.gather_grouped_metrics(overwatches)
+            if not grouped_metrics.total.count:
+                continue
+            for row in grouped_metrics.histogram_rows():
+                row['Node'] = 'cluster'
+                if self.discovered:
+                    row['Project'] = project
+                histogram_rows.append(row)
+
+        return histogram_rows
+
+    def gather_forecast_rows(self):
+        """
+        A forecast row for each node with finished jobs, followed by a
+        cluster row, per project. Each simulated run of the cluster drains
+        when the slowest node does, so every node of a project is given the
+        number of runs the budget allows its longest queue.
+
+        :returns rows:  a list of dictionary objects
+        """
+        now = from_datetime(self.clock())
+        rows = []
+        for project, overwatches in self.gather_projects():
+            runs = forecast_runs(self.arguments.forecast_runs,
+                                 max(len(overwatch.gather_queued_jobs(now)[0])
+                                     for overwatch in overwatches))
+            cluster = None
+            for overwatch in overwatches:
+                forecast = overwatch.gather_forecast(now, runs)
+                if forecast is None:
+                    continue
+                row = forecast.row()
+                row['Node'] = overwatch.node
+                rows.append(row)
+                if cluster is None:
+                    cluster = forecast
+                else:
+                    cluster.combine(forecast)
+
+            if cluster is not None:
+                row = cluster.row()
+                row['Node'] = 'cluster'
+                rows.append(row)
+
+            if self.discovered:
+                for row in rows:
+                    row.setdefault('Project', project)
+        return rows
+
+    def build_columns(self):
+        """
+        The label columns that lead every row: Node, and Project once
+        discovered.
+
+        :returns columns:  a list of strings
+        """
+        if self.discovered:
+            return ['Node', 'Project']
+        return ['Node']
+
+    def gather_csv_rows(self):
+        """
+        The csv column names and rows for this run, Node first.
+
+        :returns fieldnames, rows:  a list of column names and a list of
+                                    dictionary objects
+        """
+        with self.instruments.stage('metrics') as stage:
+            fleet_metrics = self.gather_fleet_metrics()
+            stage.items = len(fleet_metrics)
+
+        if not fleet_metrics:
+            return self.build_columns(), []
+
+        columns = (self.build_columns() +
+                   GroupedMetrics(self.group_by).group_columns())
+        return build_fieldnames(columns, fleet_metrics), fleet_metrics
+
+    def write_to_csv(self):
+        """Create a csv file with a row per node and a cluster row."""
+        fieldnames, rows = self.gather_csv_rows()
+        if not rows:
+            print('No finished jobs on any node')
+            return
+
+        with self.instruments.stage('write') as stage:
+            write_csv(self.output_file, fieldnames, rows)
+            if self.arguments.timeline:
+                write_timeline_csv(self.arguments, self.gather_job_metrics())
+            if self.arguments.histograms:
+                write_histograms_file(self.arguments,
+                                      self.gather_histogram_rows())
+            stage.items = len(rows)
+
+        if self.arguments.forecast:
+            write_forecast_csv(self.arguments,
+                               self.build_columns() + forecast_columns(),
+                               self.gather_forecast_rows())
+
+
+def discover_targets(arguments, nodes, session=None):
+    """
+    The (node, project) pairs to poll with --all_projects.
+
+    :param arguments:  argparse namespace object
+    :param nodes:      a list of scrapyd end points
+    :param session:    a requests.Session object, or None
+    :returns targets:  a list of (node, project) tuples, or None to poll
+                       --project_name on every node
+    """
+    discovery = build_discovery(arguments, session)
+    if discovery is None:
+        return None
+    return discovery.discover(nodes, arguments.workers)
+
+
+def poll_once(arguments, nodes, session, instruments=None):
+    """
+    Fetch and compute a single round of metrics for watch mode.
+
+    :param arguments:    argparse namespace object
+    :param nodes:        a list of scrapyd end points, empty for one node
+    :param session:      a requests.Session object shared between polls
+    :param instruments:  an instruments.Instruments object, or None
+    :returns output:   (output_file, fieldnames, rows), watch.NO_RESULT
+                       without finished jobs, or None if the poll failed
+    """
+    try:
+        if nodes:
+            overwatch = OverwatchFleet(
+                arguments, nodes, session=session, instruments=instruments,
+                targets=discover_targets(arguments, nodes, session))
+        else:
+            overwatch = Overwatch(arguments, session=session,
+                                  instruments=instruments)
+            if not overwatch.check_response_code():
+                return None
+
+        fieldnames, rows = overwatch.gather_csv_rows()
+    except (requests.RequestException, ValueError) as error:
+        print('Poll failed: {}'.format(error))
+        return None
+
+    if not rows:
+        print('No finished jobs')
+        return NO_RESULT
+
+    return overwatch.output_file, fieldnames, rows
+
+
+def watch(arguments, nodes, instruments=None):
+    """
+    Keep polling on --interval and rewrite the csv file after each poll,
+    until interrupted.
+
+    :param arguments:    argparse namespace object
+    :param nodes:        a list of scrapyd end points, empty for one node
+    :param instruments:  an instruments.Instruments object, or None
+    """
+    session = create_session(max(1, min(arguments.workers, len(nodes))),
+                             arguments.retries, arguments.backoff)
+    watcher = Watcher(lambda: poll_once(arguments, nodes, session,
+                                        instruments),
+                      lambda output: write_csv(*output),
+                      arguments.interval,
+                      jitter=arguments.jitter,
+                      max_interval=arguments.max_interval)
+    watcher.run()
+
+
+def serve(arguments, nodes, instruments=None):
+    """
+    Serve the metrics in the Prometheus text format on /metrics, refreshing
+    them every --interval in the background, until interrupted. Scrapes are
+    answered from the last refresh. With --watch the csv file is rewritten
+    after each refresh too.
+
+    :param arguments:    argparse namespace object
+    :param nodes:        a list of scrapyd end points, empty for one node
+    :param instruments:  an instruments.Instruments object, or None
+    """
+    node = None if nodes else build_node(arguments)
+    cache = MetricsCache()
+    server = start_server(cache, arguments.serve_host, arguments.serve[0])
+    print('Serving metrics on port {}'.format(server.server_address[1]))
+
+    def write(output):
+        output_file, fieldnames, rows = output
+        cache.update(build_project_name(arguments), rows, node)
+        if arguments.watch:
+            write_csv(output_file, fieldnames, rows)
+
+    session = create_session(max(1, min(arguments.workers, len(nodes))),
+                             arguments.retries, arguments.backoff)
+    watcher = Watcher(lambda: poll_once(arguments, nodes, session,
+                                        instruments),
+                      write,
+                      arguments.interval,
+                      jitter=arguments.jitter,
+                      max_interval=arguments.max_interval)
+    try:
+        watcher.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_batch(arguments):
+    """
+    Analyse archived listjobs dumps over a process pool and write one csv
+    file for all of them.
+
+    :param arguments:  argparse namespace object
+    """
+    paths = find_dumps(arguments.batch)
+    grouped_metrics = analyse_dumps(paths, build_group_by(arguments),
+                                    arguments.processes,
+                                    build_histogram_by(arguments))
+    if not grouped_metrics.total.count:
+        print('No finished jobs in {} dumps'.format(len(paths)))
+        return
+
+    rows = grouped_metrics.scrapy_metrics(arguments.concurrent_spiders[0])
+    columns = grouped_metrics.group_columns()
+    fieldnames = columns + [key for key in rows[0] if key not in columns]
+    write_csv(build_output_file(arguments.project_name[0], 'batch'),
+              fieldnames, rows)
+    if arguments.histograms:
+        write_histograms(build_output_file(arguments.project_name[0],
+                                           'batch_histograms', 'json'),
+                         grouped_metrics.histogram_rows())
+
+
+def build_instruments(arguments):
+    """
+    Per-stage instrumentation reporting to the sinks chosen on the command
+    line, or the disabled instrumentation when none were.
+
+    :param arguments:  argparse namespace object
+    :returns instruments:  an instruments.Instruments object
+    """
+    sinks = []
+    if arguments.instrument:
+        sinks.append(stderr_sink)
+    if arguments.instrument_file:
+        sinks.append(JSONFileSink(arguments.instrument_file[0]))
+    if not sinks:
+        return NULL_INSTRUMENTS
+
+    return Instruments(sinks)
+
+
+def run(arguments, instruments=None):
+    """
+    Run overwatch in the mode chosen on the command line.
+
+    :param arguments:    argparse namespace object
+    :param instruments:  an instruments.Instruments object, or None
+    """
+    nodes = gather_nodes(arguments)
+    if arguments.batch:
+        run_batch(arguments)
+    elif arguments.serve:
+        serve(arguments, nodes, instruments)
+    elif arguments.watch:
+        watch(arguments, nodes, instruments)
+    elif nodes:
+        session = create_session(max(1, min(arguments.workers, len(nodes))),
+                                 arguments.retries, arguments.backoff)
+        OverwatchFleet(arguments, nodes, session=session,
+                       instruments=instruments,
+                       targets=discover_targets(arguments, nodes, session)
+                       ).write_to_csv()
+    else:
+        session = create_session(1, arguments.retries, arguments.backoff)
+        Overwatch(arguments, session=session,
+                  instruments=instruments).write_to_csv()
+
+
+def read_nodes_file(path):
+    """
+    Read scrapyd end points from a file, one per line. Blank lines and
+    lines starting with # are ignored.
+
+    :param path:  a string
+    :returns nodes:  a list of strings
+    """
+    with open(path) as nodes_file:
+        lines = [line.strip() for line in nodes_file]
+
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def gather_nodes(arguments):
+    """
+    Collect the node end points given on the command line or in a file.
+    With --all_projects a single node is polled as a fleet of one.
+
+    :param arguments:  argparse namespace object
+    :returns nodes:    a list of strings
+    """
+    nodes = list(arguments.nodes or [])
+    if arguments.nodes_file:
+        nodes.extend(read_nodes_file(arguments.nodes_file[0]))
+    if arguments.all_projects and not nodes:
+        nodes.append(build_node(arguments))
+
+    return [node.rstrip('/') for node in nodes]
 
 
 def parse_arguments(arguments):
@@ -292,8 +1500,19 @@ def parse_arguments(arguments):
                         '--project_name',
                         help=('The name of your scrapy project'),
                         type=str,
-                        nargs=1,
-                        required=True)
+                        nargs=1)
+
+    parser.add_argument('--all_projects',
+                        help=('Query every project listed by each node\'s '
+                              'listprojects.json instead of --project_name, '
+                              'writing one report'),
+                        action='store_true')
+
+    parser.add_argument('--projects_ttl',
+                        help=('Seconds a discovered project list is reused '
+                              'for'),
+                        type=float,
+                        default=3600.0)
 
 
     parser.add_argument('-d',
@@ -301,8 +1520,7 @@ def parse_arguments(arguments):
                         help=('The fully qualified domain of your scrapy '
                               'instance. e.g. https://www.example.com'),
                         type=str,
-                        nargs=1,
-                        required=True)
+                        nargs=1)
 
     parser.add_argument('-P',
                         '--port',
@@ -313,13 +1531,318 @@ def parse_arguments(arguments):
     parser.add_argument('-s',
                         '--concurrent_spiders',
                         help=('The number of spiders your scrapyd instance'
-                              ' can process concurrently'),
+                              ' can process concurrently, defaults to the'
+                              ' most seen running at once'),
+                        type=int,
+                        nargs=1)
+
+    parser.add_argument('--input',
+                        help=('Read a saved listjobs json response from '
+                              'this file instead of querying scrapyd'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--batch',
+                        help=('Analyse archived listjobs dumps, given as '
+                              'directories, files or glob patterns, over a '
+                              'process pool; keep one directory per node'),
+                        type=str,
+                        nargs='+')
+
+    parser.add_argument('--processes',
+                        help=('Worker processes for --batch and --logs_dir, '
+                              'defaults to one per core'),
+                        type=int)
+
+    parser.add_argument('--logs_dir',
+                        help=('The scrapyd logs directory; add the items, '
+                              'requests and response bytes from the stats '
+                              'dump at the end of each job\'s log'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--cache_dir',
+                        help=('Keep fetched listjobs responses in this '
+                              'directory and reuse them for --cache_ttl '
+                              'seconds'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--cache_ttl',
+                        help=('Seconds a cached response is reused for'),
+                        type=float,
+                        default=300.0)
+
+    parser.add_argument('--cache_max_mb',
+                        help=('Largest size of the response cache, the '
+                              'oldest responses are removed first'),
+                        type=float,
+                        default=256.0)
+
+    parser.add_argument('--forecast',
+                        help=('Also write when the pending queue will clear, '
+                              'simulating it on --concurrent_spiders slots '
+                              'with crawl durations drawn from the finished '
+                              'jobs of each spider'),
+                        action='store_true')
+
+    parser.add_argument('--forecast_runs',
+                        help=('Simulated runs of the pending queue, their '
+                              'spread gives the drain time percentiles; '
+                              'long queues get fewer'),
+                        type=int,
+                        default=20)
+
+    parser.add_argument('--anomalies',
+                        help=('Flag crawls finished since the last run that '
+                              'took far longer than the moving average of '
+                              'their spider, appending them to '
+                              '--alerts_file'),
+                        action='store_true')
+
+    parser.add_argument('--anomaly_z',
+                        help=('Standard deviations above the moving average '
+                              'a crawl must take to be flagged'),
+                        type=float,
+                        default=3.0)
+
+    parser.add_argument('--anomaly_alpha',
+                        help=('Weight of each new crawl in the moving '
+                              'average and variance, from 0 to 1'),
+                        type=float,
+                        default=0.1)
+
+    parser.add_argument('--anomaly_warmup',
+                        help=('Crawls a spider must have run before its '
+                              'crawls are flagged'),
+                        type=int,
+                        default=10)
+
+    parser.add_argument('--alerts_file',
+                        help=('The json lines file flagged crawls are '
+                              'appended to, - for stdout, defaults to '
+                              '<project>_alerts.jsonl in the output '
+                              'directory'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--stream',
+                        help=('Decode the finished jobs from the response '
+                              'body as it downloads, keeping memory use '
+                              'flat for very long job histories'),
+                        action='store_true')
+
+    parser.add_argument('--by_spider',
+                        help=('Write a row of metrics per spider, plus a '
+                              'total row'),
+                        action='store_true')
+
+    parser.add_argument('--by_day',
+                        help=('Write a row of metrics per spider per day '
+                              'the crawls finished on, plus a total row'),
+                        action='store_true')
+
+    parser.add_argument('--histograms',
+                        help=('Also write a log scale crawl duration '
+                              'histogram per spider, or per spider and day '
+                              'with --by_day, to a json file; histograms of '
+                              'several runs add up with histogram.py'),
+                        action='store_true')
+
+    parser.add_argument('--windows',
+                        help=('Add metrics for trailing windows ending '
+                              'now on the node\'s clock, or at the latest '
+                              'finished crawl with --input, e.g. 15m 1h 24h '
+                              '7d'),
+                        type=str,
+                        nargs='+')
+
+    parser.add_argument('--timeline',
+                        help=('Also write the observed number of running '
+                              'crawls per bucket of this length, e.g. 5m'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('-i',
+                        '--incremental',
+                        help=('Only process jobs finished since the last '
+                              'run, keeping running totals in a state file'),
+                        action='store_true')
+
+    parser.add_argument('--state_dir',
+                        help=('Where incremental state files are kept, '
+                              'defaults to the output directory'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--history',
+                        help=('Append every finished job to a compact '
+                              'history store in this directory'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--watch',
+                        help=('Keep running, polling every --interval '
+                              'seconds and rewriting the csv file in place'),
+                        action='store_true')
+
+    parser.add_argument('--serve',
+                        help=('Serve the metrics for Prometheus on this '
+                              'port, refreshing them every --interval'),
+                        type=int,
+                        nargs=1)
+
+    parser.add_argument('--serve_host',
+                        help=('The address to serve the metrics on'),
+                        type=str,
+                        default='')
+
+    parser.add_argument('--interval',
+                        help=('Seconds between polls in watch and serve '
+                              'mode'),
+                        type=float,
+                        default=60.0)
+
+    parser.add_argument('--jitter',
+                        help=('Fraction of the interval each poll is '
+                              'randomly moved by in watch and serve mode'),
+                        type=float,
+                        default=0.1)
+
+    parser.add_argument('--max_interval',
+                        help=('Longest back off in seconds after failed '
+                              'polls in watch and serve mode'),
+                        type=float,
+                        default=900.0)
+
+    parser.add_argument('-n',
+                        '--nodes',
+                        help=('Scrapyd end points to query concurrently, '
+                              'e.g. http://10.0.0.1:6800 http://10.0.0.2:6800'),
+                        type=str,
+                        nargs='+')
+
+    parser.add_argument('--nodes_file',
+                        help=('A file of scrapyd end points, one per line'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('-w',
+                        '--workers',
+                        help=('The maximum number of nodes queried at once'),
+                        type=int,
+                        default=8)
+
+    parser.add_argument('-t',
+                        '--timeout',
+                        help=('Seconds to wait on a node for data before '
+                              'giving up'),
+                        type=float,
+                        default=30.0)
+
+    parser.add_argument('--connect_timeout',
+                        help=('Seconds to wait on a node to accept the '
+                              'connection before giving up'),
+                        type=float,
+                        default=5.0)
+
+    parser.add_argument('--retries',
+                        help=('Times to retry a failed connection, read or '
+                              'gateway error'),
                         type=int,
+                        default=2)
+
+    parser.add_argument('--backoff',
+                        help=('Retry backoff factor, waiting backoff * 2 ** n '
+                              'seconds before retry n'),
+                        type=float,
+                        default=0.5)
+
+    parser.add_argument('--deadline',
+                        help=('Seconds to wait on all the nodes, leaving out '
+                              'those not done in time'),
+                        type=float,
                         nargs=1)
 
-    return parser.parse_args(arguments)
+    parser.add_argument('--instrument',
+                        help=('Print the wall time, calls, items and bytes '
+                              'of each stage to stderr'),
+                        action='store_true')
+
+    parser.add_argument('--instrument_file',
+                        help=('Write the per stage instrumentation to this '
+                              'json file'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--profile',
+                        help=('Run under cProfile and save the stats to '
+                              'this file'),
+                        type=str,
+                        nargs=1)
+
+    parser.add_argument('--tracemalloc',
+                        help=('Trace memory allocations and print this many '
+                              'of the largest allocation sites'),
+                        type=int,
+                        nargs=1)
+
+    parsed = parser.parse_args(arguments)
+    if not (parsed.project_name or parsed.all_projects):
+        parser.error('one of --project_name or --all_projects is required')
+
+    if parsed.project_name and parsed.all_projects:
+        parser.error('--project_name cannot be used with --all_projects')
+
+    if parsed.all_projects and (parsed.input or parsed.batch):
+        parser.error('--all_projects cannot be used with --input or --batch')
+
+    if not (parsed.domain_name or parsed.nodes or parsed.nodes_file or
+            parsed.input or parsed.batch):
+        parser.error('one of --domain_name, --nodes, --nodes_file, --input '
+                     'or --batch is required')
+
+    if parsed.input and (parsed.nodes or parsed.nodes_file):
+        parser.error('--input cannot be used with --nodes or --nodes_file')
+
+    if parsed.stream or parsed.incremental or parsed.batch:
+        if parsed.windows or parsed.timeline:
+            parser.error('--windows and --timeline cannot be used with '
+                         '--stream, --incremental or --batch')
+        if not parsed.concurrent_spiders:
+            parser.error('--concurrent_spiders is required with --stream, '
+                         '--incremental or --batch')
+
+    if parsed.forecast and (parsed.stream or parsed.incremental or
+                            parsed.batch):
+        parser.error('--forecast cannot be used with --stream, --incremental '
+                     'or --batch')
+
+    if parsed.anomalies and parsed.batch:
+        parser.error('--anomalies cannot be used with --batch')
+
+    if not 0 < parsed.anomaly_alpha <= 1:
+        parser.error('--anomaly_alpha must be greater than 0 and at most 1')
+
+    if parsed.tracemalloc and not TRACEMALLOC_AVAILABLE:
+        parser.error('--tracemalloc needs Python 3.4 or later')
+
+    for window in (parsed.windows or []) + (parsed.timeline or []):
+        try:
+            parse_window(window)
+        except ValueError as error:
+            parser.error(str(error))
+
+    return parsed
 
 
 if __name__ == '__main__':
     arguments = parse_arguments(sys.argv[1:])
-    Overwatch(arguments).write_to_csv()
+    instruments = build_instruments(arguments)
+    try:
+        with profiled(arguments.profile[0] if arguments.profile else None,
+                      arguments.tracemalloc[0] if arguments.tracemalloc
+                      else None):
+            run(arguments, instruments)
+    finally:
+        instruments.report()
@@ -0,0 +1,125 @@
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+from atomic import atomic_write
+
+
+def build_listprojects_url(node):
+    """
+    The listprojects end point of a node.
+
+    :param node:  a scrapyd end point, e.g. http://127.0.0.1:6800
+    :returns url:  a string
+    """
+    return '{}/listprojects.json'.format(node)
+
+
+class ProjectDiscovery(object):
+    """
+    Find the projects deployed on each scrapyd node from listprojects.json.
+
+    The list of each node is kept in a json file with the time it was
+    fetched and reused for ttl seconds, so runs within ttl go straight to
+    the listjobs queries. A node whose list cannot be fetched falls back to
+    the last list kept for it, however old, and is skipped only when it has
+    never answered.
+    """
+
+    def __init__(self, path, ttl, session=None, timeout=None,
+                 clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.session = session
+        self.timeout = timeout
+        self.clock = clock
+
+    def load(self):
+        """
+        Read the kept project lists, starting afresh if there are none.
+
+        :returns known:  a dictionary of node to {'fetched', 'projects'}
+        """
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path) as projects_file:
+            return json.load(projects_file)
+
+    def save(self, known):
+        """
+        Write the project lists, replacing the old file in a single step.
+
+        :param known:  a dictionary of node to {'fetched', 'projects'}
+        """
+        atomic_write(self.path, lambda projects_file: json.dump(
+            known, projects_file, sort_keys=True))
+
+    def fetch_projects(self, node):
+        """
+        Query the listprojects end point of a node.
+
+        :param node:  a scrapyd end point
+        :returns projects:  a list of strings
+        """
+        client = self.session if self.session is not None else requests
+        response = client.get(build_listprojects_url(node),
+                              timeout=self.timeout)
+        if response.status_code != 200:
+            raise ValueError('response code {}'.format(response.status_code))
+        return response.json()['projects']
+
+    def node_projects(self, node, known):
+        """
+        The projects deployed on a node, fetching them unless the kept list
+        is younger than ttl seconds.
+
+        :param node:   a scrapyd end point
+        :param known:  the kept project lists, updated in place
+        :returns projects:  a list of strings, empty if the node has never
+                            answered
+        """
+        entry = known.get(node)
+        if entry is not None and self.clock() - entry['fetched'] < self.ttl:
+            return entry['projects']
+
+        try:
+            projects = self.fetch_projects(node)
+        except (requests.RequestException, ValueError, KeyError) as error:
+            if entry is None:
+                print('Listing projects on {} failed: {}'.format(node, error))
+                return []
+            print('Listing projects on {} failed, using the last list: '
+                  '{}'.format(node, error))
+            return entry['projects']
+
+        known[node] = {'fetched': self.clock(), 'projects': projects}
+        return projects
+
+    def discover(self, nodes, workers=8):
+        """
+        List the projects of every node concurrently, then keep the lists.
+
+        :param nodes:    a list of scrapyd end points
+        :param workers:  the most nodes listed at once
+        :returns targets:  a list of (node, project) tuples, in node order
+        """
+        if not nodes:
+            return []
+
+        known = self.load()
+        pool = ThreadPool(max(1, min(workers, len(nodes))))
+        try:
+            node_projects = pool.map(
+                lambda node: self.node_projects(node, known), nodes)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.save(known)
+        return [(node, project)
+                for node, projects in zip(nodes, node_projects)
+                for project in projects]
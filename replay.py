@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+
+from atomic import atomic_write
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FileResponse(object):
+    """
+    A saved listjobs response read from a file, standing in for the
+    requests.Response of a live fetch. The body is only read when first
+    asked for and then kept, and iter_content reads it a chunk at a time
+    for --stream.
+    """
+
+    status_code = 200
+
+    def __init__(self, path):
+        self.path = path
+        self.body = None
+
+    @property
+    def content(self):
+        if self.body is None:
+            with open(self.path, 'rb') as body_file:
+                self.body = body_file.read()
+        return self.body
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        with open(self.path, 'rb') as body_file:
+            while True:
+                chunk = body_file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class ResponseCache(object):
+    """
+    Listjobs responses kept on disk, one file per url, so repeated runs
+    within ttl seconds cost no round trip to scrapyd.
+
+    A response is written to the cache a chunk at a time as it downloads
+    and then read back from the file, so caching keeps the memory use of
+    --stream flat. After each write the expired entries, then the oldest,
+    are removed until the cache fits in max_bytes.
+    """
+
+    def __init__(self, path, ttl, max_bytes, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def entry_path(self, url):
+        """
+        The cache file of a url.
+
+        :param url:  a string
+        :returns path:  a string
+        """
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, '{}.json'.format(key))
+
+    def lookup(self, url):
+        """
+        The cache file of a url if it was fetched within ttl seconds.
+
+        :param url:  a string
+        :returns path:  a string, or None on a miss
+        """
+        path = self.entry_path(url)
+        try:
+            fetched = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        if self.clock() - fetched >= self.ttl:
+            return None
+        return path
+
+    def store(self, url, chunks):
+        """
+        Write a response body to the cache, replacing the file in one step,
+        then evict. A download that fails part way leaves no file behind.
+
+        :param url:     a string
+        :param chunks:  an iterator of bytes
+        :returns path:  the cache file
+        """
+        path = self.entry_path(url)
+
+        def write(body_file):
+            for chunk in chunks:
+                body_file.write(chunk)
+
+        atomic_write(path, write, 'wb')
+
+        now = self.clock()
+        os.utime(path, (now, now))
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """
+        Remove expired entries, then the least recently fetched, until the
+        cache fits in max_bytes.
+
+        :param keep:  a cache file never to remove, e.g. one being served
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                entries.append((os.path.getmtime(path),
+                                os.path.getsize(path), path))
+            except OSError:
+                continue
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        now = self.clock()
+        for fetched, size, path in entries:
+            if path == keep:
+                continue
+            if now - fetched < self.ttl and total <= self.max_bytes:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def fetch(self, client, url, timeout=None):
+        """
+        The cached response of a url, fetching and caching it on a miss.
+        Failed responses are returned as they are and not cached.
+
+        :param client:   requests or a requests.Session object
+        :param url:      a string
+        :param timeout:  seconds to wait for the server
+        :returns response:  a FileResponse, or the failed requests.Response
+        """
+        path = self.lookup(url)
+        if path is None:
+            response = client.get(url, stream=True, timeout=timeout)
+            if response.status_code != 200:
+                return response
+            path = self.store(url, response.iter_content(CHUNK_SIZE))
+
+        return FileResponse(path)
@@ -0,0 +1,173 @@
+from __future__ import division
+
+import math
+
+
+class TDigest(object):
+    """
+    A merging t-digest: a bounded size summary of a stream of values that
+    answers quantile queries, accurate to a small fraction of a percent
+    and most accurate in the tails.
+
+    Values are buffered and periodically merged into at most about
+    compression centroids, so memory does not grow with the number of
+    values. Digests built separately, e.g. on different nodes or runs,
+    merge into a digest of the combined values.
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.buffer_size = compression * 10
+        self.centroids = []
+        self.buffer = []
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        """
+        Add a value to the digest.
+
+        :param value:   a number
+        :param weight:  how many times the value was seen
+        """
+        self.buffer.append((value, weight))
+        self.count += weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if len(self.buffer) >= self.buffer_size:
+            self.compress()
+
+    def merge(self, other):
+        """
+        Fold another digest into this one.
+
+        :param other:  a TDigest object
+        :returns self:  the merged TDigest object
+        """
+        if not other.count:
+            return self
+
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+
+        self.compress()
+        return self
+
+    def _q_limit(self, q):
+        """
+        The furthest quantile a centroid starting at q may reach, from the
+        k1 scale function k(q) = compression / 2pi * asin(2q - 1).
+        """
+        scale = self.compression / (2 * math.pi)
+        k = scale * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k / scale) + 1) / 2
+
+    def compress(self):
+        """Merge the buffered values into the centroids."""
+        if not self.buffer:
+            return
+
+        points = self.centroids + self.buffer
+        points.sort(key=lambda point: point[0])
+        self.buffer = []
+
+        total = self.count
+        merged = []
+        weight_so_far = 0
+        mean, weight = points[0]
+        limit = total * self._q_limit(0)
+
+        for point_mean, point_weight in points[1:]:
+            if weight_so_far + weight + point_weight <= limit:
+                weight += point_weight
+                mean += (point_mean - mean) * point_weight / weight
+            else:
+                merged.append((mean, weight))
+                weight_so_far += weight
+                limit = total * self._q_limit(min(1.0, weight_so_far / total))
+                mean, weight = point_mean, point_weight
+
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q):
+        """
+        Estimate the value at quantile q, interpolating between centroid
+        centres and the observed minimum and maximum.
+
+        :param q:  a float between 0 and 1
+        :returns value:  a float, or None if the digest is empty
+        """
+        self.compress()
+        if not self.centroids:
+            return None
+
+        centroids = self.centroids
+        if len(centroids) == 1:
+            return centroids[0][0]
+
+        target = q * self.count
+        first_mean, first_weight = centroids[0]
+        if target < first_weight / 2:
+            if first_weight == 1:
+                return self.min
+            return self.min + ((first_mean - self.min) * target /
+                               (first_weight / 2))
+
+        cumulative = 0
+        for index in range(len(centroids) - 1):
+            left_mean, left_weight = centroids[index]
+            right_mean, right_weight = centroids[index + 1]
+            left_centre = cumulative + left_weight / 2
+            right_centre = cumulative + left_weight + right_weight / 2
+            if target < right_centre:
+                fraction = (target - left_centre) / (right_centre -
+                                                     left_centre)
+                return left_mean + (right_mean - left_mean) * fraction
+            cumulative += left_weight
+
+        last_mean, last_weight = centroids[-1]
+        last_centre = self.count - last_weight / 2
+        if last_weight == 1 or target >= self.count:
+            return self.max
+        return last_mean + ((self.max - last_mean) * (target - last_centre) /
+                            (last_weight / 2))
+
+    def to_state(self):
+        """
+        The digest as a json serialisable dictionary.
+
+        :returns state:  a dictionary object
+        """
+        self.compress()
+        return {'compression': self.compression,
+                'centroids': [list(centroid) for centroid in self.centroids],
+                'count': self.count,
+                'min': self.min,
+                'max': self.max}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild a digest from the output of to_state().
+
+        :param state:  a dictionary object
+        :returns digest:  a TDigest object
+        """
+        digest = cls(state['compression'])
+        digest.centroids = [tuple(centroid) for centroid in state['centroids']]
+        digest.count = state['count']
+        digest.min = state['min']
+        digest.max = state['max']
+        return digest
@@ -1,14 +1,55 @@
 import csv
 import datetime
 import json
+import math
 import os
+import random
 import requests
 import requests_mock
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from anomaly import AnomalyDetector, write_alerts
+from atomic import atomic_write
+from batch import analyse_dump, analyse_dumps, build_tasks, find_dumps
+from benchmark import bench_pipeline, generate_listjobs
+from client import OverwatchClient
+from concurrency import ConcurrencyProfile
 from decimal import Decimal, getcontext
-from overwatch import settings, Overwatch, parse_arguments
+from exporter import MetricsCache, render, rows_to_samples, start_server
+from forecast import DrainForecast, DurationModel, drain_time
+from histogram import (BUCKET_COUNT, COUNT_KEY, DurationHistogram,
+                       bucket_bounds, bucket_index, merge_histograms,
+                       read_histograms, write_histograms)
+from history import RECORD, HistoryStore
+from incremental import IncrementalState, build_state_file
+from instruments import (NULL_INSTRUMENTS, NULL_STAGE, Instruments,
+                         JSONFileSink, profiled)
+from jobtable import JobTable
+from jsonstream import iter_array_items, iter_named_items
+from logs import (LogStatsCache, LogTotals, build_log_path, read_log_stats,
+                  scan_logs)
+from metrics import CrawlMetrics, GroupedMetrics
+from mock import patch
+from overwatch import (settings, Overwatch, OverwatchFleet, create_session,
+                       discover_targets, gather_nodes, parse_arguments,
+                       poll_once)
+from projects import ProjectDiscovery
+from replay import FileResponse, ResponseCache
+from tdigest import TDigest
+from timestamps import (EPOCH, from_datetime, parse_timestamp,
+                        parse_timestamps, to_datetime)
+from vectorised import available as numpy_available
+from watch import NO_RESULT, STOP, Watcher
+from windows import WindowIndex, parse_window
 
 class TestParseArgs(unittest.TestCase):
     def setUp(self):
@@ -175,6 +216,9 @@ class TestOverwatch(unittest.TestCase):
             'Av CR (S)': 244.56, 
             'Longest CR (S)': 258.652448, 
             'Shortest CR (S)': 233.489018, 
+            'p50 CR (S)': 241.547793,
+            'p90 CR (S)': 258.652448,
+            'p99 CR (S)': 258.652448,
             'Total Duration': 343.416054, 
             'Single CR p/h': 14.72, 
             'Max CR p/h': 736, 
@@ -182,7 +226,11 @@ class TestOverwatch(unittest.TestCase):
             'Max CR p/d': 17664, 
             'Single CR p/7d': 2472.96, 
             'Max CR p/7d': 123648,
-            'Completed crawls': 3 
+            'Completed crawls': 3,
+            'Peak concurrency': 3,
+            'Mean concurrency': 2.14,
+            'Utilisation': 0.0427,
+            'Est CR p/h': 31.45
         } 
         self.assertEqual(self.overwatch.gather_scrapy_metrics(), expected)  
 
@@ -371,5 +419,2290 @@ class TestGatherCrawlOutliers(unittest.TestCase):
 
         self.assertEqual(self.outliers, expted)
 
+class TestCrawlMetrics(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'http://192.168.124.30',
+                                     '-P',
+                                     '6800',
+                                     '-s',
+                                     '50'])
+
+        with patch.object(Overwatch, 'fetch'):
+            self.overwatch = Overwatch(arguments)
+
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.json_file_name = 'scrapyd_list_jobs_outliers_json.json'
+        self.json_path = self.create_file_path(self.json_file_name)
+        json_dict = json.loads(open(self.json_path, 'rb').read())
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            json=json_dict,
+            status_code=200,
+            )
+
+        self.overwatch.response = self.session.get(
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman')
+
+    def test_add(self):
+        job_metrics = CrawlMetrics()
+        job_metrics.add(parse_timestamp('2016-04-29 10:00:00.000000'),
+                        parse_timestamp('2016-04-29 10:01:00.000000'))
+        job_metrics.add(parse_timestamp('2016-04-29 09:00:00.000000'),
+                        parse_timestamp('2016-04-29 09:00:30.000000'))
+
+        self.assertEqual(job_metrics.count, 2)
+        self.assertEqual(job_metrics.durations, [60.0, 30.0])
+        self.assertEqual(job_metrics.longest, 60.0)
+        self.assertEqual(job_metrics.shortest, 30.0)
+        self.assertEqual(to_datetime(job_metrics.earliest_start),
+                         datetime.datetime(2016, 4, 29, 9, 0, 0))
+        self.assertEqual(to_datetime(job_metrics.latest_end),
+                         datetime.datetime(2016, 4, 29, 10, 1, 0))
+        self.assertEqual(job_metrics.total_duration(), 3660.0)
+
+    def test_gather_scrapy_metrics_decodes_response_once(self):
+        with patch.object(self.overwatch, 'iter_finished_jobs',
+                          wraps=self.overwatch.iter_finished_jobs) as iter_mock:
+            self.overwatch.gather_scrapy_metrics()
+            self.overwatch.gather_crawl_outliers()
+            self.overwatch.gather_crawl_durations()
+
+        self.assertEqual(iter_mock.call_count, 1)
+
+    def test_new_response_is_recomputed(self):
+        self.assertEqual(self.overwatch.gather_completed_crawl_count(), 3)
+        self.adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=empty',
+            json={'finished': []},
+            status_code=200,
+            )
+        self.overwatch.response = self.session.get(
+            'mock://0.0.0.1:6800/listjobs.json?project=empty')
+        self.assertEqual(self.overwatch.gather_completed_crawl_count(), 0)
+
+
+class TestParseTimestamp(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.timestamps = []
+        for file_name in ['scrapyd_list_jobs_response_json.json',
+                          'scrapyd_list_jobs_outliers_json.json',
+                          'scrapyd_list_jobs_for_loop_json.json']:
+            json_dict = json.loads(
+                open(self.create_file_path(file_name), 'rb').read())
+            for item in json_dict['finished']:
+                self.timestamps.append(item['start_time'])
+                self.timestamps.append(item['end_time'])
+
+        self.timestamps.extend(['1969-12-31 23:59:59.999999',
+                                '1970-01-01 00:00:00.000000',
+                                '2000-02-29 12:30:45.500000',
+                                '2016-12-31 23:59:59.000001',
+                                '2038-01-19 03:14:08.123456',
+                                '2016-04-29 10:28:08.4732',
+                                '2016-04-29 10:28:08.0'])
+
+    def strptime_microseconds(self, date_string):
+        delta = datetime.datetime.strptime(
+            date_string, '%Y-%m-%d %H:%M:%S.%f') - EPOCH
+        return ((delta.days * 86400 + delta.seconds) * 1000000 +
+                delta.microseconds)
+
+    def test_parse_timestamp_matches_strptime(self):
+        for date_string in self.timestamps:
+            self.assertEqual(parse_timestamp(date_string),
+                             self.strptime_microseconds(date_string))
+
+    def test_parse_timestamps(self):
+        expected = [self.strptime_microseconds(date_string)
+                    for date_string in self.timestamps]
+        self.assertEqual(parse_timestamps(self.timestamps), expected)
+
+    def test_parse_timestamp_without_fraction(self):
+        self.assertEqual(to_datetime(parse_timestamp('2016-04-29 10:28:08')),
+                         datetime.datetime(2016, 4, 29, 10, 28, 8))
+
+    def test_to_datetime(self):
+        for date_string in self.timestamps:
+            self.assertEqual(
+                to_datetime(parse_timestamp(date_string)),
+                datetime.datetime.strptime(date_string,
+                                           '%Y-%m-%d %H:%M:%S.%f'))
+
+    def test_parse_timestamp_invalid(self):
+        for date_string in ['2016-04-29T10:28:08.004732',
+                            '2016-02-30 10:28:08.004732',
+                            '2016-04-29 24:28:08.004732',
+                            '2016-04-29 10:28:08.0047321',
+                            '2016-04-29 10:28:08.',
+                            '2016/04/29 10:28:08.004732',
+                            '2016-04-29 -1:00:00',
+                            '2016-04-29 10:00:00.-12',
+                            '2016-04-29 10: 0:00',
+                            '2016-04-29 10:00:+1.5',
+                            '2016- 4-29 10:00:00',
+                            '2016-04-29 10:00:00. 12',
+                            '']:
+            self.assertRaises(ValueError, parse_timestamp, date_string)
+
+
+class TestIterArrayItems(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.json_file_name = 'scrapyd_list_jobs_response_json.json'
+        self.scrapyd_json = open(self.create_file_path(self.json_file_name),
+                                 'rb').read()
+
+    def chunk(self, body, size):
+        return [body[i:i + size] for i in range(0, len(body), size)]
+
+    def test_iter_array_items(self):
+        expected = json.loads(self.scrapyd_json)['finished']
+        for size in [1, 7, 64, len(self.scrapyd_json)]:
+            items = list(iter_array_items(
+                self.chunk(self.scrapyd_json, size), 'finished'))
+            self.assertEqual(items, expected)
+
+    def test_iter_array_items_skips_other_keys(self):
+        body = json.dumps({
+            'status': 'ok',
+            'node_name': 'node-1',
+            'pending': [{'id': 'a', 'spider': 'finished'}],
+            'running': [],
+            'finished': [{'id': 'b'}, {'id': 'c', 'count': 12345}],
+            'total': 1234567}).encode('utf-8')
+
+        for size in [1, 3, len(body)]:
+            items = list(iter_array_items(self.chunk(body, size),
+                                          'finished'))
+            self.assertEqual(items, [{'id': 'b'},
+                                     {'id': 'c', 'count': 12345}])
+
+    def test_iter_array_items_multibyte(self):
+        body = u'{"finished": [{"spider": "caf\u00e9"}]}'.encode('utf-8')
+        items = list(iter_array_items(self.chunk(body, 1), 'finished'))
+        self.assertEqual(items, [{'spider': u'caf\u00e9'}])
+
+    def test_iter_array_items_truncated(self):
+        body = self.scrapyd_json[:-20]
+        self.assertRaises(ValueError, list,
+                          iter_array_items(self.chunk(body, 64), 'finished'))
+
+
+class TestOverwatchStream(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'http://192.168.124.30',
+                                     '-P',
+                                     '6800',
+                                     '-s',
+                                     '50',
+                                     '--stream'])
+
+        with patch.object(Overwatch, 'fetch'):
+            self.overwatch = Overwatch(arguments)
+
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.json_file_name = 'scrapyd_list_jobs_outliers_json.json'
+        self.scrapyd_json = open(self.create_file_path(self.json_file_name),
+                                 'rb').read()
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            content=self.scrapyd_json,
+            status_code=200,
+            )
+
+        self.overwatch.response = self.session.get(
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            stream=True)
+
+    def test_gather_scrapy_metrics(self):
+        expected = {
+            'Av CR (S)': 244.56,
+            'Longest CR (S)': 258.652448,
+            'Shortest CR (S)': 233.489018,
+            'p50 CR (S)': 241.547793,
+            'p90 CR (S)': 258.652448,
+            'p99 CR (S)': 258.652448,
+            'Total Duration': 343.416054,
+            'Single CR p/h': 14.72,
+            'Max CR p/h': 736,
+            'Single CR p/d': 353.28,
+            'Max CR p/d': 17664,
+            'Single CR p/7d': 2472.96,
+            'Max CR p/7d': 123648,
+            'Completed crawls': 3
+        }
+        self.assertEqual(self.overwatch.gather_scrapy_metrics(), expected)
+        self.assertEqual(self.overwatch.gather_completed_crawl_count(), 3)
+
+    def test_gather_crawl_durations(self):
+        self.assertRaises(ValueError, self.overwatch.gather_crawl_durations)
+
+
+class TestOverwatchFleet(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.nodes_file = os.path.join(self.temp_dir, 'nodes.txt')
+        with open(self.nodes_file, 'w') as nodes_file:
+            nodes_file.write('# fleet\nmock://node3:6800\n\n')
+
+        self.arguments = parse_arguments(['-p',
+                                          'harvestman',
+                                          '-n',
+                                          'mock://node1:6800',
+                                          'mock://node2:6800/',
+                                          '--nodes_file',
+                                          self.nodes_file,
+                                          '-s',
+                                          '10',
+                                          '-w',
+                                          '2'])
+
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        outliers_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json'), 'rb').read())
+        for_loop_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_for_loop_json.json'), 'rb').read())
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET',
+            'mock://node1:6800/listjobs.json?project=harvestman',
+            json=outliers_json,
+            status_code=200,
+            )
+        self.adapter.register_uri(
+            'GET',
+            'mock://node2:6800/listjobs.json?project=harvestman',
+            json=for_loop_json,
+            status_code=200,
+            )
+        self.adapter.register_uri(
+            'GET',
+            'mock://node3:6800/listjobs.json?project=harvestman',
+            status_code=500,
+            )
+
+        self.fleet = OverwatchFleet(self.arguments,
+                                    gather_nodes(self.arguments),
+                                    session=self.session)
+
+    def test_gather_nodes(self):
+        self.assertEqual(gather_nodes(self.arguments),
+                         ['mock://node1:6800',
+                          'mock://node2:6800',
+                          'mock://node3:6800'])
+
+    def test_parse_arguments_requires_a_node(self):
+        self.assertRaises(SystemExit, parse_arguments,
+                          ['-p', 'harvestman', '-s', '10'])
+
+    def test_poll(self):
+        self.assertEqual([overwatch.node for overwatch in
+                          self.fleet.overwatches],
+                         ['mock://node1:6800', 'mock://node2:6800'])
+
+    def test_gather_job_metrics(self):
+        job_metrics = self.fleet.gather_job_metrics()
+        self.assertEqual(job_metrics.count, 6)
+        self.assertEqual(to_datetime(job_metrics.earliest_start),
+                         datetime.datetime(2016, 4, 1, 1, 1, 59, 999999))
+        self.assertEqual(to_datetime(job_metrics.latest_end),
+                         datetime.datetime(2016, 4, 29, 10, 33, 51, 420786))
+        self.assertEqual(
+            sorted(job_metrics.durations),
+            sorted(self.fleet.overwatches[0].gather_crawl_durations() +
+                   self.fleet.overwatches[1].gather_crawl_durations()))
+
+    def test_gather_fleet_metrics(self):
+        fleet_metrics = self.fleet.gather_fleet_metrics()
+        self.assertEqual([row['Node'] for row in fleet_metrics],
+                         ['mock://node1:6800', 'mock://node2:6800',
+                          'cluster'])
+        self.assertEqual(fleet_metrics[0]['Av CR (S)'], 244.56)
+        self.assertAlmostEqual(fleet_metrics[0]['Max CR p/h'], 147.2)
+        self.assertEqual(fleet_metrics[2]['Completed crawls'], 6)
+        self.assertEqual(fleet_metrics[2]['Longest CR (S)'],
+                         max(fleet_metrics[0]['Longest CR (S)'],
+                             fleet_metrics[1]['Longest CR (S)']))
+
+    def test_gather_forecast_rows_share_runs(self):
+        for node, queued in [('node1', 5), ('node2', 50)]:
+            listjobs = json.loads(open(self.create_file_path(
+                'scrapyd_list_jobs_outliers_json.json'), 'rb').read())
+            listjobs['pending'] = [{'id': str(number),
+                                    'spider': 'google_serp_spider'}
+                                   for number in range(queued)]
+            self.adapter.register_uri(
+                'GET',
+                'mock://{}:6800/listjobs.json?project=harvestman'.format(node),
+                json=listjobs,
+                status_code=200,
+                )
+
+        fleet = OverwatchFleet(self.arguments, gather_nodes(self.arguments),
+                               session=self.session)
+        with patch('forecast.FORECAST_CRAWL_BUDGET', 100):
+            rows = fleet.gather_forecast_rows()
+
+        self.assertEqual([row['Node'] for row in rows],
+                         ['mock://node1:6800', 'mock://node2:6800',
+                          'cluster'])
+        self.assertEqual([row['Runs'] for row in rows], [3, 3, 3])
+        self.assertEqual(rows[2]['Pending crawls'], 55)
+
+    def test_write_to_csv(self):
+        self.fleet.output_file = os.path.join(self.temp_dir, 'fleet.csv')
+        self.fleet.write_to_csv()
+
+        with open(self.fleet.output_file, 'rb') as csvfile:
+            reader = csv.DictReader(csvfile)
+            csv_data = [row for row in reader]
+            self.assertEqual(reader.fieldnames[0], 'Node')
+            self.assertEqual(len(csv_data), 3)
+            self.assertEqual(csv_data[2]['Node'], 'cluster')
+            self.assertEqual(csv_data[2]['Completed crawls'], '6')
+
+    def test_poll_drops_nodes_past_the_deadline(self):
+        released = threading.Event()
+        for_loop_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_for_loop_json.json'), 'rb').read())
+
+        def slow_node(request, context):
+            released.wait(5)
+            return for_loop_json
+
+        self.adapter.register_uri(
+            'GET',
+            'mock://node2:6800/listjobs.json?project=harvestman',
+            json=slow_node,
+            status_code=200,
+            )
+        self.arguments.deadline = [0.2]
+        try:
+            fleet = OverwatchFleet(self.arguments,
+                                   gather_nodes(self.arguments),
+                                   session=self.session)
+        finally:
+            released.set()
+
+        self.assertTrue(fleet.cancelled.is_set())
+        self.assertEqual([overwatch.node for overwatch in fleet.overwatches],
+                         ['mock://node1:6800'])
+
+    def test_nodes_share_one_log_pool(self):
+        self.arguments.logs_dir = [self.temp_dir]
+        self.arguments.state_dir = [self.temp_dir]
+        with patch('overwatch.multiprocessing.Pool') as create_pool, \
+                patch('overwatch.scan_logs', return_value={}) as scan:
+            OverwatchFleet(self.arguments, gather_nodes(self.arguments),
+                           session=self.session)
+
+        self.assertEqual(create_pool.call_count, 1)
+        self.assertEqual(scan.call_count, 2)
+        for call in scan.call_args_list:
+            self.assertIs(call[0][3], create_pool.return_value)
+        self.assertTrue(create_pool.return_value.join.called)
+
+    def test_timeouts(self):
+        self.assertEqual(self.fleet.overwatches[0].build_timeout(),
+                         (5.0, 30.0))
+
+    def test_create_session(self):
+        session = create_session(4, retries=3, backoff=0.25)
+        adapter = session.get_adapter('http://127.0.0.1:6800')
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertEqual(adapter.max_retries.backoff_factor, 0.25)
+        self.assertEqual(session.headers['Accept-Encoding'], 'gzip')
+        self.assertEqual(create_session(1).get_adapter(
+            'http://127.0.0.1:6800').max_retries.total, 0)
+
+
+class TestOverwatchClient(unittest.TestCase):
+    url = 'mock://0.0.0.1:6800/listjobs.json?project=harvestman'
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.listjobs = generate_listjobs(50, spiders=3)
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+
+    def build_client(self):
+        return OverwatchClient('mock://0.0.0.1:6800', 'harvestman',
+                               concurrent_spiders=2, windows=['1h'],
+                               session=self.session)
+
+    def test_import_is_cheap(self):
+        environment = dict(os.environ,
+                           PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+        environment.pop('DATA_EXPORT_DIR', None)
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import client, sys; print(sorted(set(sys.modules) & '
+             'set(["numpy", "overwatch", "requests", "settings"])))'],
+            env=environment)
+        self.assertEqual(output.decode('utf-8').strip(), '[]')
+
+    def test_fetches_lazily_and_memoises(self):
+        self.adapter.register_uri('GET', self.url, json=self.listjobs)
+        client = self.build_client()
+        self.assertEqual(self.adapter.call_count, 0)
+
+        scrapy_metrics = client.gather_scrapy_metrics()
+        self.assertEqual(self.adapter.call_count, 1)
+        self.assertIs(client.gather_scrapy_metrics(), scrapy_metrics)
+        self.assertEqual(client.metric('Completed crawls'), 50)
+        self.assertEqual(client.calculate_av_crawl_duration(),
+                         scrapy_metrics['Av CR (S)'])
+        self.assertEqual(self.adapter.call_count, 1)
+
+        path = os.path.join(self.temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump(self.listjobs, listjobs_file)
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '-s', '2', '--windows', '1h'])
+        saved_metrics = Overwatch(arguments).gather_scrapy_metrics()
+        # A saved response is measured back from its latest crawl, a live
+        # one from now.
+        self.assertTrue(saved_metrics['CR 1h'] > 0)
+        self.assertEqual(scrapy_metrics['CR 1h'], 0)
+        saved_metrics.update((key, scrapy_metrics[key])
+                             for key in scrapy_metrics if '1h' in key)
+        self.assertEqual(saved_metrics, scrapy_metrics)
+        client = OverwatchClient(input_path=path, concurrent_spiders=2,
+                                 windows=['1h'])
+        self.assertEqual(client.gather_scrapy_metrics(),
+                         Overwatch(arguments).gather_scrapy_metrics())
+
+    def test_refresh_invalidates_only_on_change(self):
+        pending = dict(self.listjobs, pending=[{'id': 'queued',
+                                                'spider': 'spider_0'}])
+        finished = dict(self.listjobs,
+                        finished=self.listjobs['finished'] +
+                        [dict(self.listjobs['finished'][0], id='new')])
+        self.adapter.register_uri('GET', self.url, [{'json': self.listjobs},
+                                                    {'json': self.listjobs},
+                                                    {'json': pending},
+                                                    {'json': finished}])
+        client = self.build_client()
+        crawl_durations = client.gather_crawl_durations()
+
+        self.assertFalse(client.refresh())
+        with patch('client.parse_timestamp') as parse_mock:
+            self.assertFalse(client.refresh())
+        self.assertEqual(parse_mock.call_count, 0)
+        self.assertIs(client.gather_crawl_durations(), crawl_durations)
+        self.assertTrue(client.refresh())
+        self.assertEqual(client.metric('Completed crawls'), 51)
+        self.assertEqual(self.adapter.call_count, 4)
+
+    def test_refresh_moves_the_windows(self):
+        self.adapter.register_uri('GET', self.url, json=self.listjobs)
+        latest = max(parse_timestamp(item['end_time'])
+                     for item in self.listjobs['finished'])
+        now = [latest]
+        client = OverwatchClient('mock://0.0.0.1:6800', 'harvestman',
+                                 windows=['1h'], session=self.session,
+                                 clock=lambda: to_datetime(now[0]))
+        self.assertTrue(client.metric('CR 1h') > 0)
+        durations = client.gather_crawl_durations()
+
+        now[0] += 2 * 3600 * 10 ** 6
+        self.assertFalse(client.refresh())
+        self.assertEqual(client.metric('CR 1h'), 0)
+        self.assertIs(client.gather_crawl_durations(), durations)
+
+    def test_no_finished_jobs(self):
+        self.adapter.register_uri('GET', self.url,
+                                  json=dict(self.listjobs, finished=[]))
+        client = self.build_client()
+        self.assertEqual(client.gather_scrapy_metrics(), None)
+        self.assertEqual(client.gather_spider_metrics(), [])
+        self.assertEqual(client.metric('Av CR (S)'), None)
+        self.assertEqual(client.calculate_av_crawl_duration(), None)
+        self.assertEqual(client.calculate_est_total_crawls_per_hour(), None)
+        self.assertEqual(client.gather_completed_crawl_count(), 0)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, OverwatchClient, 'mock://0.0.0.1:6800')
+        self.adapter.register_uri('GET', self.url, status_code=500)
+        self.assertRaises(ValueError, self.build_client().refresh)
+
+
+class TestProjectDiscovery(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        outliers_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json'), 'rb').read())
+        for_loop_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_for_loop_json.json'), 'rb').read())
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET', 'mock://node1:6800/listprojects.json',
+            json={'status': 'ok', 'projects': ['alpha', 'beta']})
+        self.adapter.register_uri(
+            'GET', 'mock://node2:6800/listprojects.json',
+            json={'status': 'ok', 'projects': ['alpha']})
+        for node, project, listjobs in [('node1', 'alpha', outliers_json),
+                                        ('node1', 'beta', for_loop_json),
+                                        ('node2', 'alpha', for_loop_json)]:
+            self.adapter.register_uri(
+                'GET',
+                'mock://{}:6800/listjobs.json?project={}'.format(node,
+                                                                 project),
+                json=listjobs)
+
+        self.arguments = parse_arguments(['--all_projects',
+                                          '-n',
+                                          'mock://node1:6800',
+                                          'mock://node2:6800',
+                                          '--state_dir',
+                                          self.temp_dir,
+                                          '-s',
+                                          '10'])
+        self.nodes = gather_nodes(self.arguments)
+
+    def test_discover(self):
+        self.assertEqual(discover_targets(self.arguments, self.nodes,
+                                          self.session),
+                         [('mock://node1:6800', 'alpha'),
+                          ('mock://node1:6800', 'beta'),
+                          ('mock://node2:6800', 'alpha')])
+
+    def test_project_lists_are_cached(self):
+        path = os.path.join(self.temp_dir, 'projects.json')
+        ProjectDiscovery(path, 60, self.session).discover(self.nodes)
+        calls = self.adapter.call_count
+        self.assertEqual(ProjectDiscovery(path, 60, self.session).discover(
+            self.nodes)[-1], ('mock://node2:6800', 'alpha'))
+        self.assertEqual(self.adapter.call_count, calls)
+
+    def test_unreachable_node_uses_the_last_list(self):
+        discovery = ProjectDiscovery(os.path.join(self.temp_dir,
+                                                  'projects.json'),
+                                     0, self.session)
+        discovery.discover(self.nodes)
+        self.adapter.register_uri(
+            'GET', 'mock://node1:6800/listprojects.json', status_code=500)
+        self.adapter.register_uri(
+            'GET', 'mock://node3:6800/listprojects.json',
+            exc=requests.ConnectionError)
+        self.assertEqual(discovery.discover(['mock://node1:6800',
+                                             'mock://node3:6800']),
+                         [('mock://node1:6800', 'alpha'),
+                          ('mock://node1:6800', 'beta')])
+
+    def test_fleet_rows(self):
+        fleet = OverwatchFleet(self.arguments, self.nodes,
+                               session=self.session,
+                               targets=discover_targets(self.arguments,
+                                                        self.nodes,
+                                                        self.session))
+        fieldnames, rows = fleet.gather_csv_rows()
+        self.assertEqual(fieldnames[:2], ['Node', 'Project'])
+        self.assertEqual([(row['Node'], row['Project']) for row in rows],
+                         [('mock://node1:6800', 'alpha'),
+                          ('mock://node1:6800', 'beta'),
+                          ('mock://node2:6800', 'alpha'),
+                          ('cluster', 'alpha'),
+                          ('cluster', 'beta')])
+        self.assertEqual(rows[3]['Completed crawls'],
+                         rows[0]['Completed crawls'] +
+                         rows[2]['Completed crawls'])
+        self.assertTrue(fleet.output_file.endswith('_all_projects.csv'))
+
+    def test_parse_arguments(self):
+        self.assertEqual(gather_nodes(parse_arguments(
+            ['--all_projects', '-d', 'http://127.0.0.1', '-P', '6800'])),
+            ['http://127.0.0.1:6800'])
+        self.assertRaises(SystemExit, parse_arguments,
+                          ['-d', 'http://127.0.0.1'])
+        self.assertRaises(SystemExit, parse_arguments,
+                          ['-p', 'harvestman', '--all_projects',
+                           '-d', 'http://127.0.0.1'])
+
+
+class TestIncremental(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'http://192.168.124.30',
+                                     '-P',
+                                     '6800',
+                                     '-s',
+                                     '50',
+                                     '--incremental',
+                                     '--state_dir',
+                                     self.temp_dir])
+
+        with patch.object(Overwatch, 'fetch'):
+            self.overwatch = Overwatch(arguments)
+
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.outliers_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json'), 'rb').read())
+        self.response_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_response_json.json'), 'rb').read())
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            [{'json': self.outliers_json, 'status_code': 200},
+             {'json': self.response_json, 'status_code': 200}],
+            )
+
+    def fetch(self):
+        self.overwatch.response = self.session.get(
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman')
+
+    def full_job_metrics(self, json_dict):
+        job_metrics = CrawlMetrics()
+        for item in json_dict['finished']:
+            job_metrics.add(parse_timestamp(item['start_time']),
+                            parse_timestamp(item['end_time']))
+        return job_metrics
+
+    def test_build_state_file(self):
+        self.assertEqual(
+            self.overwatch.state_file,
+            os.path.join(self.temp_dir,
+                         'harvestman_192.168.124.30_6800.state.json'))
+        self.assertEqual(build_state_file('/tmp', 'harvestman',
+                                          'https://scrapyd.example.com/'),
+                         '/tmp/harvestman_scrapyd.example.com.state.json')
+
+    def test_first_run(self):
+        self.fetch()
+        self.assertEqual(self.overwatch.gather_completed_crawl_count(), 3)
+        self.assertEqual(self.overwatch.calculate_av_crawl_duration(), 244.56)
+        self.assertEqual(self.overwatch.calculate_total_duration(),
+                         343.416054)
+        self.assertTrue(os.path.exists(self.overwatch.state_file))
+
+    def test_only_new_jobs_are_parsed(self):
+        self.fetch()
+        self.overwatch.gather_job_metrics()
+        self.fetch()
+        with patch('overwatch.parse_timestamp',
+                   wraps=parse_timestamp) as parse_mock:
+            job_metrics = self.overwatch.gather_job_metrics()
+
+        new_jobs = len(self.response_json['finished']) - 3
+        self.assertEqual(parse_mock.call_count, new_jobs * 2)
+
+        expected = self.full_job_metrics(self.response_json)
+        self.assertEqual(job_metrics.count, expected.count)
+        self.assertEqual(job_metrics.duration_sum, expected.duration_sum)
+        self.assertEqual(job_metrics.longest, expected.longest)
+        self.assertEqual(job_metrics.shortest, expected.shortest)
+        self.assertEqual(job_metrics.earliest_start, expected.earliest_start)
+        self.assertEqual(job_metrics.latest_end, expected.latest_end)
+
+    def test_seen_ids_follow_the_response(self):
+        self.fetch()
+        self.overwatch.gather_job_metrics()
+        self.fetch()
+        self.overwatch.gather_job_metrics()
+
+        state = IncrementalState.load(self.overwatch.state_file)
+        self.assertEqual(state.seen_ids,
+                         set(item['id'] for item in
+                             self.response_json['finished']))
+        self.assertEqual(state.job_metrics.total.count,
+                         len(self.response_json['finished']))
+
+    def test_gather_crawl_durations(self):
+        self.fetch()
+        self.assertRaises(ValueError, self.overwatch.gather_crawl_durations)
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.sleeps = []
+        self.written = []
+
+    def clock(self):
+        return self.now[0]
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now[0] += seconds
+
+    def create_watcher(self, results, write=None, jitter=0.0):
+        results = list(results)
+        return Watcher(lambda: results.pop(0),
+                       write or self.written.append,
+                       10,
+                       jitter=jitter,
+                       max_interval=35,
+                       sleep=self.sleep,
+                       clock=self.clock,
+                       rand=lambda: 1.0)
+
+    def test_interval(self):
+        watcher = self.create_watcher(['a', 'b', 'c'])
+        watcher.run(polls=3)
+        self.assertEqual(self.sleeps, [10, 10])
+        self.assertEqual(self.written[-1], 'c')
+
+    def test_backoff(self):
+        watcher = self.create_watcher([None, None, None, 'a', None, 'b'])
+        watcher.run(polls=6)
+        self.assertEqual(self.sleeps, [20, 35, 35, 10, 20])
+        self.assertEqual(self.written[-1], 'b')
+
+    def test_jitter(self):
+        watcher = self.create_watcher(['a', 'b'], jitter=0.1)
+        watcher.run(polls=2)
+        self.assertEqual(self.sleeps, [11])
+
+    def test_poll_exception_backs_off(self):
+        def poll():
+            raise ZeroDivisionError('division by zero')
+
+        watcher = Watcher(poll, self.written.append, 10, jitter=0.0,
+                          max_interval=35, sleep=self.sleep,
+                          clock=self.clock)
+        watcher.run(polls=3)
+        self.assertEqual(self.sleeps, [20, 35])
+        self.assertEqual(watcher.failures, 3)
+        self.assertEqual(self.written, [])
+
+    def test_no_result_does_not_back_off(self):
+        watcher = self.create_watcher([NO_RESULT, 'a', NO_RESULT])
+        watcher.run(polls=3)
+        self.assertEqual(self.sleeps, [10, 10])
+        self.assertEqual(self.written, ['a'])
+
+    def test_write_exception_is_logged(self):
+        def write(result):
+            if result == 'a':
+                raise UnicodeEncodeError('ascii', u'\xe9', 0, 1, 'bad')
+            self.written.append(result)
+
+        watcher = self.create_watcher([], write=write)
+        watcher.pending = Queue()
+        for result in ['a', 'b', STOP]:
+            watcher.pending.put(result)
+        watcher.write_results()
+        self.assertEqual(self.written, ['b'])
+
+    def test_poll_without_finished_jobs(self):
+        temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        path = os.path.join(temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump({'status': 'ok', 'pending': [], 'running': [],
+                       'finished': []}, listjobs_file)
+
+        for options in [[], ['--by_spider']]:
+            arguments = parse_arguments(['-p', 'harvestman', '--input',
+                                         path] + options)
+            self.assertIs(poll_once(arguments, [], None), NO_RESULT)
+            self.assertEqual(Overwatch(arguments).gather_csv_rows(), ([], []))
+
+    def test_slow_write_does_not_delay_polls(self):
+        release = threading.Event()
+
+        def slow_write(result):
+            release.wait(5)
+            self.written.append(result)
+
+        polls = ['a', 'b', 'c', 'd']
+        polled = []
+
+        def poll():
+            polled.append(polls[len(polled)])
+            if len(polled) == len(polls):
+                release.set()
+            return polled[-1]
+
+        watcher = Watcher(poll, slow_write, 10, jitter=0.0,
+                          sleep=self.sleep, clock=self.clock)
+        watcher.run(polls=4)
+
+        self.assertEqual(polled, polls)
+        self.assertTrue(len(self.written) < len(polls))
+        self.assertEqual(self.written[-1], 'd')
+
+
+class TestGroupedMetrics(unittest.TestCase):
+    def setUp(self):
+        self.jobs = [
+            ('google_serp_spider',
+             '2016-04-29 10:00:00.000000', '2016-04-29 10:01:00.000000'),
+            ('deep_crawl_spider',
+             '2016-04-29 10:00:00.000000', '2016-04-29 11:00:00.000000'),
+            ('google_serp_spider',
+             '2016-04-29 23:59:00.000000', '2016-04-30 00:00:30.000000'),
+            ('google_serp_spider',
+             '2016-04-30 09:00:00.000000', '2016-04-30 09:02:00.000000'),
+        ]
+
+    def create_grouped_metrics(self, group_by):
+        grouped_metrics = GroupedMetrics(group_by)
+        for spider, start_time, end_time in self.jobs:
+            grouped_metrics.add(spider,
+                                parse_timestamp(start_time),
+                                parse_timestamp(end_time))
+        return grouped_metrics
+
+    def test_no_grouping(self):
+        grouped_metrics = self.create_grouped_metrics(None)
+        self.assertEqual(grouped_metrics.groups, {})
+        self.assertEqual(grouped_metrics.total.count, 4)
+        rows = grouped_metrics.scrapy_metrics(10)
+        self.assertEqual(len(rows), 1)
+        self.assertNotIn('Spider', rows[0])
+
+    def test_group_by_spider(self):
+        grouped_metrics = self.create_grouped_metrics('spider')
+        self.assertEqual(sorted(grouped_metrics.groups),
+                         [('deep_crawl_spider',), ('google_serp_spider',)])
+        serp = grouped_metrics.groups[('google_serp_spider',)]
+        self.assertEqual(serp.durations, [60.0, 90.0, 120.0])
+
+        rows = grouped_metrics.scrapy_metrics(10)
+        self.assertEqual([row['Spider'] for row in rows],
+                         ['deep_crawl_spider', 'google_serp_spider',
+                          'total'])
+        self.assertEqual(rows[0]['Av CR (S)'], 3600.0)
+        self.assertEqual(rows[1]['Av CR (S)'], 90.0)
+        self.assertEqual(rows[2]['Completed crawls'], 4)
+
+    def test_windows_share_one_reference(self):
+        grouped_metrics = self.create_grouped_metrics('spider')
+        rows = grouped_metrics.scrapy_metrics(10, ['1h'])
+        # deep_crawl_spider last finished the day before, so nothing of it
+        # falls in the hour before the latest crawl of any spider.
+        self.assertEqual([row['CR 1h'] for row in rows], [0, 1, 1])
+
+        reference = parse_timestamp('2016-04-29 11:30:00.000000')
+        rows = grouped_metrics.scrapy_metrics(10, ['1h'], reference)
+        self.assertEqual([row['CR 1h'] for row in rows], [1, 0, 1])
+
+    def test_group_by_spider_day(self):
+        grouped_metrics = self.create_grouped_metrics('spider_day')
+        rows = grouped_metrics.scrapy_metrics(10)
+        self.assertEqual([(row['Spider'], row['Day']) for row in rows],
+                         [('deep_crawl_spider', '2016-04-29'),
+                          ('google_serp_spider', '2016-04-29'),
+                          ('google_serp_spider', '2016-04-30'),
+                          ('total', '')])
+        self.assertEqual(rows[2]['Completed crawls'], 2)
+
+    def test_merge_and_state(self):
+        grouped_metrics = self.create_grouped_metrics('spider')
+        restored = GroupedMetrics.from_state(
+            json.loads(json.dumps(grouped_metrics.to_state())))
+        restored.merge(self.create_grouped_metrics('spider'))
+
+        self.assertEqual(restored.total.count, 8)
+        self.assertEqual(restored.groups[('google_serp_spider',)].count, 6)
+        self.assertEqual(restored.groups[('deep_crawl_spider',)].longest,
+                         3600.0)
+
+
+class TestOverwatchBySpider(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'http://192.168.124.30',
+                                     '-P',
+                                     '6800',
+                                     '-s',
+                                     '50',
+                                     '--by_spider'])
+
+        with patch.object(Overwatch, 'fetch'):
+            self.overwatch = Overwatch(arguments)
+
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        json_dict = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json'), 'rb').read())
+        json_dict['finished'][0]['spider'] = 'deep_crawl_spider'
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            json=json_dict,
+            status_code=200,
+            )
+
+        self.overwatch.response = self.session.get(
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman')
+
+    def test_gather_spider_metrics(self):
+        spider_metrics = self.overwatch.gather_spider_metrics()
+        self.assertEqual([row['Spider'] for row in spider_metrics],
+                         ['deep_crawl_spider', 'google_serp_spider',
+                          'total'])
+        self.assertEqual(spider_metrics[0]['Completed crawls'], 1)
+        self.assertEqual(spider_metrics[0]['Av CR (S)'], 241.55)
+        self.assertEqual(spider_metrics[1]['Completed crawls'], 2)
+        self.assertEqual(spider_metrics[2]['Av CR (S)'], 244.56)
+
+    def test_write_to_csv(self):
+        self.overwatch.output_file = os.path.join(self.temp_dir,
+                                                  'by_spider.csv')
+        self.overwatch.write_to_csv()
+
+        with open(self.overwatch.output_file, 'rb') as csvfile:
+            reader = csv.DictReader(csvfile)
+            csv_data = [row for row in reader]
+            self.assertEqual(reader.fieldnames[0], 'Spider')
+            self.assertEqual([row['Spider'] for row in csv_data],
+                             ['deep_crawl_spider', 'google_serp_spider',
+                              'total'])
+            self.assertEqual(csv_data[2]['Total Duration'], '343.416054')
+
+
+class TestTDigest(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.quantiles = [0.01, 0.1, 0.5, 0.9, 0.99, 0.999]
+
+    def rank(self, values, value):
+        return sum(1 for item in values if item < value) / float(len(values))
+
+    def fixture_durations(self, file_name):
+        json_dict = json.loads(open(self.create_file_path(file_name),
+                                    'rb').read())
+        return [(parse_timestamp(item['end_time']) -
+                 parse_timestamp(item['start_time'])) / 1e6
+                for item in json_dict['finished']]
+
+    def test_fixture_quantiles(self):
+        for file_name in ['scrapyd_list_jobs_response_json.json',
+                          'scrapyd_list_jobs_outliers_json.json']:
+            durations = self.fixture_durations(file_name)
+            digest = TDigest()
+            for duration in durations:
+                digest.add(duration)
+
+            # Small sets are kept exactly, so the estimate lies between the
+            # sorted neighbours of the exact quantile.
+            ordered = sorted(durations)
+            for q in self.quantiles:
+                index = q * len(ordered) - 0.5
+                lower = ordered[max(0, int(math.floor(index)))]
+                upper = ordered[min(len(ordered) - 1,
+                                    int(math.ceil(index)))]
+                self.assertTrue(lower <= digest.quantile(q) <= upper)
+
+            self.assertEqual(digest.quantile(0), min(durations))
+            self.assertEqual(digest.quantile(1), max(durations))
+
+    def test_synthetic_quantiles(self):
+        rand = random.Random(1)
+        durations = [rand.lognormvariate(5, 1) for _ in range(50000)]
+        digest = TDigest()
+        for duration in durations:
+            digest.add(duration)
+
+        self.assertTrue(len(digest.centroids) <= 100)
+        for q in self.quantiles:
+            self.assertAlmostEqual(self.rank(durations, digest.quantile(q)),
+                                   q, delta=0.005)
+
+    def test_merge(self):
+        rand = random.Random(2)
+        durations = [rand.expovariate(1 / 300.0) for _ in range(20000)]
+        digests = [TDigest() for _ in range(4)]
+        for index, duration in enumerate(durations):
+            digests[index % 4].add(duration)
+
+        merged = TDigest()
+        for digest in digests:
+            merged.merge(TDigest.from_state(
+                json.loads(json.dumps(digest.to_state()))))
+
+        self.assertEqual(merged.count, len(durations))
+        for q in self.quantiles:
+            self.assertAlmostEqual(self.rank(durations, merged.quantile(q)),
+                                   q, delta=0.005)
+
+    def test_empty(self):
+        self.assertEqual(TDigest().quantile(0.5), None)
+
+
+class TestDurationHistogram(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+
+    def build_histogram(self, durations):
+        histogram = DurationHistogram()
+        for duration in durations:
+            histogram.add(duration)
+        return histogram
+
+    def test_buckets(self):
+        bounds = bucket_bounds()
+        self.assertEqual(len(bounds), BUCKET_COUNT)
+        self.assertEqual(bucket_index(0.0), 0)
+        self.assertEqual(bucket_index(0.001), 0)
+        self.assertEqual(bucket_index(0.01), 1)
+        self.assertEqual(bucket_index(1e9), BUCKET_COUNT - 1)
+        for duration in [0.5, 1.0, 59.9, 60.0, 3600.0, 86400.0]:
+            index = bucket_index(duration)
+            self.assertTrue(bounds[index] <= duration * (1 + 1e-9))
+            self.assertTrue(duration < bounds[index + 1])
+
+    def test_merge_matches_one_pass(self):
+        rand = random.Random(3)
+        durations = [rand.lognormvariate(4, 1.5) for _ in range(2000)]
+        merged = self.build_histogram(durations[:700]).merge(
+            self.build_histogram(durations[700:]))
+        self.assertEqual(merged.counts, self.build_histogram(durations).counts)
+        self.assertEqual(merged.count, 2000)
+        restored = DurationHistogram.from_state(merged.to_state())
+        self.assertEqual(restored.counts, merged.counts)
+        self.assertRaises(ValueError, DurationHistogram, [1, 2])
+
+    def test_crawl_metrics_keep_histogram(self):
+        first = CrawlMetrics()
+        first.add(0, 60 * 10 ** 6)
+        second = CrawlMetrics()
+        second.add(0, 3600 * 10 ** 6)
+        merged = CrawlMetrics.from_state(first.merge(second).to_state())
+        self.assertEqual(merged.histogram.count, 2)
+        self.assertEqual(merged.histogram.counts[bucket_index(3600.0)], 1)
+
+    def test_merge_histogram_files(self):
+        counts = self.build_histogram([60.0] * 5).to_state()
+        path = os.path.join(self.temp_dir, 'histograms.json')
+        write_histograms(path, [
+            {'Node': 'a', 'Spider': 'spider_a', COUNT_KEY: counts},
+            {'Node': 'b', 'Spider': 'spider_a', COUNT_KEY: counts},
+            {'Node': 'b', 'Spider': 'spider_b', COUNT_KEY: counts}])
+        merged = merge_histograms(read_histograms(path), ['Spider'])
+        self.assertEqual([entry['Spider'] for entry in merged],
+                         ['spider_a', 'spider_b'])
+        self.assertEqual(merged[0][COUNT_KEY][bucket_index(60.0)], 10)
+        self.assertNotIn('Node', merged[0])
+
+    def test_overwatch_histograms(self):
+        listjobs = generate_listjobs(40, spiders=3)
+        path = os.path.join(self.temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump(listjobs, listjobs_file)
+
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '--histograms'])
+        overwatch = Overwatch(arguments)
+        overwatch.write_to_csv()
+        today = datetime.datetime.today().strftime('%d-%m-%Y')
+        entries = read_histograms(os.path.join(
+            settings.OUTPUT_PATH,
+            '{}_harvestman_histograms.json'.format(today)))
+        self.assertEqual([entry['Spider'] for entry in entries],
+                         ['spider_0', 'spider_1', 'spider_2', 'total'])
+        self.assertEqual(sum(sum(entry[COUNT_KEY])
+                             for entry in entries[:-1]), 40)
+        self.assertEqual(entries[:-1], merge_histograms(entries[:-1],
+                                                        ['Spider']))
+
+        fieldnames, rows = overwatch.gather_csv_rows()
+        self.assertNotIn('Spider', fieldnames)
+        self.assertEqual(len(rows), 1)
+
+    def test_histograms_keep_their_own_grouping(self):
+        grouped_metrics = GroupedMetrics(histogram_by='spider_day')
+        for spider, start_time, end_time in [
+                ('spider_a', 0, 60 * 10 ** 6),
+                ('spider_a', 86400 * 10 ** 6, 86460 * 10 ** 6),
+                ('spider_b', 0, 3600 * 10 ** 6)]:
+            grouped_metrics.add(spider, start_time, end_time)
+
+        self.assertEqual(grouped_metrics.groups, {})
+        self.assertEqual(len(grouped_metrics.scrapy_metrics(10)), 1)
+        rows = GroupedMetrics.from_state(
+            grouped_metrics.to_state()).histogram_rows()
+        self.assertEqual(rows, grouped_metrics.histogram_rows())
+        self.assertEqual([(row['Spider'], row['Day']) for row in rows],
+                         [('spider_a', '1970-01-01'),
+                          ('spider_a', '1970-01-02'),
+                          ('spider_b', '1970-01-01'),
+                          ('total', '')])
+        self.assertEqual(rows[2][COUNT_KEY][bucket_index(3600.0)], 1)
+
+
+class TestWindowIndex(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        rand = random.Random(3)
+        self.start_times = []
+        self.end_times = []
+        for _ in range(2000):
+            start_time = rand.randint(0, 10 * 86400 * 10 ** 6)
+            self.start_times.append(start_time)
+            self.end_times.append(start_time +
+                                  rand.randint(1, 3600 * 10 ** 6))
+
+        self.window_index = WindowIndex(self.start_times, self.end_times)
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+
+    def brute_force(self, start, end):
+        count = 0
+        duration_sum = 0
+        for start_time, end_time in zip(self.start_times, self.end_times):
+            if start < end_time <= end:
+                count += 1
+                duration_sum += end_time - start_time
+        return count, duration_sum
+
+    def test_parse_window(self):
+        self.assertEqual(parse_window('15m'), 900)
+        self.assertEqual(parse_window('1h'), 3600)
+        self.assertEqual(parse_window('24h'), 86400)
+        self.assertEqual(parse_window('7d'), 604800)
+        for label in ['0h', '1w', 'h', '1.5h', '-1h']:
+            self.assertRaises(ValueError, parse_window, label)
+
+    def test_window(self):
+        latest = max(self.end_times)
+        for seconds in [1, 900, 3600, 86400, 7 * 86400, 30 * 86400]:
+            start = latest - seconds * 10 ** 6
+            self.assertEqual(self.window_index.window(start, latest),
+                             self.brute_force(start, latest))
+
+    def test_window_metrics(self):
+        window_metrics = self.window_index.window_metrics(['1h', '7d'])
+        latest = max(self.end_times)
+        count, duration_sum = self.brute_force(latest - 3600 * 10 ** 6,
+                                               latest)
+        self.assertEqual(window_metrics['CR 1h'], count)
+        self.assertEqual(window_metrics['CR p/h 1h'], count)
+        self.assertEqual(window_metrics['Av CR 1h (S)'],
+                         round(duration_sum / 1e6 / count, 2))
+
+    def test_overwatch_windows(self):
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'http://192.168.124.30',
+                                     '-s',
+                                     '50',
+                                     '--windows',
+                                     '15m',
+                                     '1h',
+                                     '7d'])
+        json_dict = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_response_json.json'), 'rb').read())
+        latest = max(parse_timestamp(item['end_time'])
+                     for item in json_dict['finished'])
+        with patch.object(Overwatch, 'fetch'):
+            overwatch = Overwatch(arguments,
+                                  clock=lambda: to_datetime(latest))
+
+        session = requests.Session()
+        adapter = requests_mock.Adapter()
+        session.mount('mock', adapter)
+        adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            json=json_dict,
+            status_code=200,
+            )
+        overwatch.response = session.get(
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman')
+
+        expected_15m = sum(
+            1 for item in json_dict['finished']
+            if parse_timestamp(item['end_time']) > latest - 900 * 10 ** 6)
+
+        scrapy_metrics = overwatch.gather_scrapy_metrics()
+        self.assertEqual(scrapy_metrics['CR 15m'], expected_15m)
+        self.assertEqual(scrapy_metrics['CR 1h'] < 100, True)
+        self.assertEqual(scrapy_metrics['CR 7d'], 100)
+        self.assertEqual(scrapy_metrics['Completed crawls'], 100)
+
+    def test_input_windows_end_at_latest_crawl(self):
+        path = self.create_file_path('scrapyd_list_jobs_response_json.json')
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '--windows', '7d'])
+        scrapy_metrics = Overwatch(arguments).gather_scrapy_metrics()
+        self.assertEqual(scrapy_metrics['CR 7d'], 100)
+
+    def test_windows_need_the_jobs(self):
+        self.assertRaises(SystemExit, parse_arguments,
+                          ['-p', 'harvestman', '-d', 'http://localhost',
+                           '--stream', '--windows', '1h'])
+        self.assertRaises(SystemExit, parse_arguments,
+                          ['-p', 'harvestman', '-d', 'http://localhost',
+                           '--windows', '1y'])
+
+
+class TestConcurrencyProfile(unittest.TestCase):
+    def setUp(self):
+        second = 10 ** 6
+        # Running: 0-10 one, 10-20 two, 20-30 one, 30-40 none, 40-50 one.
+        self.start_times = [0, 10 * second, 40 * second, 30 * second]
+        self.end_times = [20 * second, 30 * second, 50 * second, 30 * second]
+        self.profile = ConcurrencyProfile(self.start_times, self.end_times)
+
+    def brute_force_level(self, time):
+        return sum(1 for start_time, end_time in zip(self.start_times,
+                                                     self.end_times)
+                   if start_time <= time < end_time)
+
+    def test_peak_and_mean(self):
+        self.assertEqual(self.profile.peak, 2)
+        self.assertEqual(self.profile.busy, 50 * 10 ** 6)
+        self.assertEqual(self.profile.span, 50 * 10 ** 6)
+        self.assertEqual(self.profile.mean(), 1.0)
+
+    def test_back_to_back_crawls_do_not_overlap(self):
+        profile = ConcurrencyProfile([0, 10], [10, 20])
+        self.assertEqual(profile.peak, 1)
+
+    def test_segments_match_brute_force(self):
+        rand = random.Random(4)
+        self.start_times = [rand.randint(0, 1000) for _ in range(300)]
+        self.end_times = [start_time + rand.randint(1, 100)
+                          for start_time in self.start_times]
+        profile = ConcurrencyProfile(self.start_times, self.end_times)
+
+        for segment_start, segment_end, level in profile.segments():
+            self.assertEqual(self.brute_force_level(segment_start), level)
+            self.assertEqual(self.brute_force_level(segment_end - 1), level)
+
+        self.assertEqual(profile.peak,
+                         max(self.brute_force_level(time)
+                             for time in range(0, 1100)))
+
+    def test_timeline(self):
+        timeline = self.profile.timeline(20 * 10 ** 6)
+        self.assertEqual(timeline, [(0, 1.5, 2),
+                                    (20 * 10 ** 6, 0.5, 1),
+                                    (40 * 10 ** 6, 0.5, 1)])
+
+    def test_concurrency_slots(self):
+        job_metrics = CrawlMetrics()
+        for start_time, end_time in zip(self.start_times, self.end_times):
+            job_metrics.add(start_time, end_time)
+
+        self.assertEqual(job_metrics.slots(), 2)
+        self.assertEqual(job_metrics.slots(10), 10)
+        self.assertEqual(job_metrics.concurrency_metrics(4)['Utilisation'],
+                         0.25)
+        self.assertEqual(job_metrics.est_total_crawls_per_hour(),
+                         job_metrics.single_crawls_per_hour() * 2)
+
+
+@unittest.skipUnless(numpy_available(), 'NumPy is not installed')
+class TestVectorised(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+
+    def gather(self, path):
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '--windows', '15m', '1h', '7d'])
+        overwatch = Overwatch(arguments)
+        job_metrics = overwatch.gather_job_metrics()
+        model = DurationModel(job_metrics.jobs)
+        return (overwatch.gather_scrapy_metrics(),
+                overwatch.gather_crawl_durations(),
+                job_metrics.concurrency_profile().timeline_rows(60 * 10 ** 6),
+                model.spider_durations, model.all_durations)
+
+    def assert_backends_match(self, path):
+        vectorised = self.gather(path)
+        with patch('vectorised.numpy', None):
+            self.assertEqual(vectorised, self.gather(path))
+
+    def test_fixtures_match_pure_python(self):
+        for file_name in ['scrapyd_list_jobs_response_json.json',
+                          'scrapyd_list_jobs_outliers_json.json',
+                          'scrapyd_list_jobs_for_loop_json.json']:
+            self.assert_backends_match(self.create_file_path(file_name))
+
+    def test_generated_jobs_match_pure_python(self):
+        listjobs = generate_listjobs(3000, spiders=7)
+        # Back to back and same instant crawls exercise the tie breaks.
+        finished = listjobs['finished']
+        finished[1]['start_time'] = finished[0]['end_time']
+        finished[2]['end_time'] = finished[0]['end_time']
+        path = os.path.join(self.temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump(listjobs, listjobs_file)
+        self.assert_backends_match(path)
+
+    def test_completions(self):
+        second = 10 ** 6
+        profile = ConcurrencyProfile([0, 0, 5 * second, 25 * second],
+                                     [10 * second, 20 * second,
+                                      21 * second, 40 * second])
+        self.assertEqual(profile.completions(20 * second), [2, 2])
+        with patch('vectorised.numpy', None):
+            self.assertEqual(profile.completions(20 * second), [2, 2])
+
+
+class TestForecast(unittest.TestCase):
+    def setUp(self):
+        second = 10 ** 6
+        self.jobs = JobTable()
+        for _ in range(3):
+            self.jobs.append('quick', 0, 10 * second)
+        self.jobs.append('slow', 0, 100 * second)
+        self.model = DurationModel(self.jobs)
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+
+    def test_duration_model(self):
+        self.assertEqual(len(self.model), 4)
+        self.assertEqual(self.model.durations('quick'), [10.0] * 3)
+        self.assertEqual(self.model.durations('unknown'),
+                         [10.0, 10.0, 10.0, 100.0])
+
+    def test_drain_time(self):
+        rand = random.Random(0).random
+        quick = self.model.durations('quick')
+        # Five ten second crawls on two slots take three rounds.
+        self.assertEqual(drain_time([(quick, 3)] * 5, [], 2, rand), 30.0)
+        # A crawl four seconds in holds its slot for six more.
+        self.assertEqual(drain_time([(quick, 3)] * 2, [(quick, 4.0)], 2,
+                                    rand), 16.0)
+        # A crawl running longer than any finished one is about to end.
+        self.assertEqual(drain_time([], [(quick, 50.0)], 1, rand), 0.0)
+
+    def test_forecast(self):
+        forecast = DrainForecast(self.model, ['quick'] * 4 + ['slow'],
+                                 [('slow', 20.0)], 2, runs=5)
+        # The quick crawls share the free slot until 40s, then the slow
+        # crawl takes it for 100s.
+        self.assertEqual(forecast.drain_times, [140.0] * 5)
+        row = forecast.row()
+        self.assertEqual(row['Pending crawls'], 5)
+        self.assertEqual(row['Running crawls'], 1)
+        self.assertEqual(row['Expected drain (S)'], 140.0)
+        self.assertEqual(row['Drain p99 (S)'], 140.0)
+
+    def test_forecast_is_repeatable(self):
+        pending = ['unknown'] * 50
+        self.assertEqual(DrainForecast(self.model, pending, [], 3).row(),
+                         DrainForecast(self.model, pending, [], 3).row())
+
+    def test_combine(self):
+        forecast = DrainForecast(self.model, ['quick'], [], 1, runs=2)
+        forecast.combine(DrainForecast(self.model, ['quick'] * 3, [], 1,
+                                       runs=2))
+        self.assertEqual(forecast.drain_times, [30.0, 30.0])
+        self.assertEqual(forecast.pending_count, 4)
+        self.assertEqual(forecast.slots, 2)
+        self.assertRaises(ValueError, forecast.combine,
+                          DrainForecast(self.model, ['quick'], [], 1, runs=3))
+
+    def test_iter_named_items(self):
+        body = b'{"pending": [1, 2], "finished": [3], "running": [4]}'
+        self.assertEqual(list(iter_named_items([body],
+                                               ('pending', 'running'))),
+                         [('pending', 1), ('pending', 2), ('running', 4)])
+
+    def test_overwatch_forecast(self):
+        listjobs = generate_listjobs(50, spiders=2)
+        listjobs['pending'] = [{'id': str(number), 'spider': 'spider_0'}
+                               for number in range(20)]
+        listjobs['running'] = [{'id': 'a', 'spider': 'spider_1',
+                                'start_time': '2016-04-01 00:00:00'}]
+        path = os.path.join(self.temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump(listjobs, listjobs_file)
+
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '-s', '4', '--forecast'])
+        overwatch = Overwatch(arguments)
+        now = parse_timestamp('2016-04-01 00:01:00')
+        pending, running = overwatch.gather_queued_jobs(now)
+        self.assertEqual(pending, ['spider_0'] * 20)
+        self.assertEqual(running, [('spider_1', 60.0)])
+
+        row = overwatch.gather_forecast(now).row()
+        self.assertEqual(row['Slots'], 4)
+        self.assertTrue(0 < row['Drain p50 (S)'] <= row['Drain p99 (S)'])
+
+    def test_forecast_needs_kept_durations(self):
+        self.assertRaises(SystemExit, parse_arguments,
+                          ['-p', 'harvestman', '-d', 'http://127.0.0.1',
+                           '-s', '4', '--stream', '--forecast'])
+
+    def test_from_datetime(self):
+        dt = datetime.datetime(2016, 4, 1, 1, 1, 59, 999999)
+        self.assertEqual(to_datetime(from_datetime(dt)), dt)
+
+
+class TestLogs(unittest.TestCase):
+    STATS_DUMP = (
+        "2016-04-01 01:05:00 [scrapy.core.engine] INFO: Closing spider "
+        "(finished)\n"
+        "2016-04-01 01:05:00 [scrapy.statscollectors] INFO: Dumping Scrapy "
+        "stats:\n"
+        "{{'downloader/request_bytes': 2048,\n"
+        " 'downloader/request_count': {requests},\n"
+        " 'downloader/response_bytes': {response_bytes},\n"
+        " 'downloader/response_count': {requests},\n"
+        " 'finish_reason': 'finished',\n"
+        " 'finish_time': datetime.datetime(2016, 4, 1, 1, 5),\n"
+        " 'item_scraped_count': {items},\n"
+        " 'log_count/INFO': 7}}\n"
+        "2016-04-01 01:05:00 [scrapy.core.engine] INFO: Spider closed "
+        "(finished)\n")
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+
+    def write_log(self, name, items=50, requests=20, response_bytes=4096,
+                  dump=True):
+        path = os.path.join(self.temp_dir, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as log_file:
+            log_file.write('2016-04-01 01:00:00 [scrapy] INFO: Spider '
+                           'opened\n' * 100)
+            if dump:
+                log_file.write(self.STATS_DUMP.format(
+                    items=items, requests=requests,
+                    response_bytes=response_bytes))
+        return path
+
+    def test_read_log_stats(self):
+        self.assertEqual(read_log_stats(self.write_log('a.log')),
+                         {'item_scraped_count': 50,
+                          'downloader/request_count': 20,
+                          'downloader/response_bytes': 4096})
+        self.assertEqual(read_log_stats(self.write_log('b.log', dump=False)),
+                         None)
+        open(os.path.join(self.temp_dir, 'empty.log'), 'w').close()
+        self.assertEqual(read_log_stats(os.path.join(self.temp_dir,
+                                                     'empty.log')), None)
+
+    def test_scan_logs_reads_unchanged_logs_once(self):
+        path = self.write_log('a.log')
+        missing = os.path.join(self.temp_dir, 'missing.log')
+        cache_file = os.path.join(self.temp_dir, 'logs.json')
+        self.assertEqual(list(scan_logs([path, missing],
+                                        LogStatsCache(cache_file))),
+                         [path])
+
+        with patch('logs.read_log_stats') as read:
+            stats = scan_logs([path], LogStatsCache(cache_file))
+            self.assertEqual(read.call_count, 0)
+        self.assertEqual(stats[path]['item_scraped_count'], 50)
+
+        self.write_log('a.log', items=7000)
+        stats = scan_logs([path], LogStatsCache(cache_file))
+        self.assertEqual(stats[path]['item_scraped_count'], 7000)
+
+    def test_scan_logs_in_parallel(self):
+        paths = [self.write_log('{}.log'.format(number), items=number)
+                 for number in range(80)]
+        stats = scan_logs(paths, processes=2)
+        self.assertEqual(stats, scan_logs(paths, processes=1))
+        self.assertEqual(stats[paths[79]]['item_scraped_count'], 79)
+
+    def test_log_totals(self):
+        log_totals = LogTotals()
+        log_totals.add(10.0, {'item_scraped_count': 50,
+                              'downloader/request_count': 20,
+                              'downloader/response_bytes': 4096})
+        log_totals.merge(LogTotals.from_state(log_totals.to_state()))
+        self.assertEqual(log_totals.scrapy_metrics(),
+                         {'Logged crawls': 2,
+                          'Items scraped': 100,
+                          'Items p/s': 5.0,
+                          'Requests': 40,
+                          'Requests p/s': 2.0,
+                          'Response bytes': 8192})
+
+    def test_overwatch_log_metrics(self):
+        listjobs = generate_listjobs(20, spiders=3)
+        logged = [item for item in listjobs['finished']
+                  if item['spider'] != 'spider_2'][:15]
+        for item in logged:
+            self.write_log(build_log_path('logs', 'harvestman',
+                                          item['spider'], item['id']))
+        path = os.path.join(self.temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump(listjobs, listjobs_file)
+
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '--by_spider',
+                                     '--state_dir', self.temp_dir,
+                                     '--logs_dir',
+                                     os.path.join(self.temp_dir, 'logs')])
+        fieldnames, rows = Overwatch(arguments).gather_csv_rows()
+        self.assertEqual(rows[-1]['Logged crawls'], 15)
+        self.assertEqual(rows[-1]['Items scraped'], 750)
+        self.assertEqual(sum(row.get('Logged crawls', 0)
+                             for row in rows[:-1]), 15)
+        self.assertNotIn('Logged crawls', rows[2])
+        self.assertIn('Items p/s', fieldnames)
+        self.assertTrue(rows[-1]['Items p/s'] > 0)
+
+
+class TestAnomalyDetector(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.state_file = os.path.join(self.temp_dir, 'anomaly.json')
+
+    def build_jobs(self, durations, spider='spider_a', first=0):
+        jobs = []
+        for number, duration in enumerate(durations, first):
+            start_time = number * 3600 * 10 ** 6
+            jobs.append(('{}_{}'.format(spider, number), spider, start_time,
+                         start_time + duration * 10 ** 6))
+        return jobs
+
+    def test_flags_slow_crawl_after_warmup(self):
+        detector = AnomalyDetector(self.state_file, warmup=5)
+        alerts = detector.observe(self.build_jobs([60, 300] +
+                                                  [60, 62, 58] * 4 + [300]))
+        self.assertEqual([alert['id'] for alert in alerts],
+                         ['spider_a_14'])
+        self.assertEqual(alerts[0]['duration'], 300.0)
+        self.assertTrue(alerts[0]['z'] > 3)
+
+    def test_only_new_crawls_are_scored(self):
+        jobs = self.build_jobs([60] * 12)
+        detector = AnomalyDetector(self.state_file)
+        detector.observe(jobs)
+        detector.save()
+
+        detector = AnomalyDetector(self.state_file)
+        self.assertFalse(detector.is_new('spider_a', jobs[-1][3]))
+        self.assertTrue(detector.is_new('spider_b', jobs[0][3]))
+        slow = self.build_jobs([600], first=12)
+        alerts = detector.observe(jobs + slow)
+        self.assertEqual([alert['id'] for alert in alerts], ['spider_a_12'])
+        self.assertEqual(detector.spiders['spider_a'][0], 13)
+        self.assertEqual(detector.observe(jobs + slow), [])
+
+    def test_write_alerts(self):
+        path = os.path.join(self.temp_dir, 'alerts.jsonl')
+        write_alerts(path, [{'id': 'a'}])
+        write_alerts(path, [])
+        write_alerts(path, [{'id': 'b'}])
+        with open(path) as alerts_file:
+            self.assertEqual([json.loads(line)['id'] for line in alerts_file],
+                             ['a', 'b'])
+
+    def test_overwatch_anomalies(self):
+        listjobs = {'status': 'ok', 'pending': [], 'running': [],
+                    'finished': []}
+        for job_id, spider, start_time, end_time in self.build_jobs(
+                [60] * 12 + [900]):
+            listjobs['finished'].append(
+                {'id': job_id, 'spider': spider,
+                 'start_time': str(to_datetime(start_time)),
+                 'end_time': str(to_datetime(end_time))})
+        path = os.path.join(self.temp_dir, 'listjobs.json')
+        with open(path, 'w') as listjobs_file:
+            json.dump(listjobs, listjobs_file)
+        alerts_path = os.path.join(self.temp_dir, 'alerts.jsonl')
+
+        arguments = parse_arguments(['-p', 'harvestman', '--input', path,
+                                     '--state_dir', self.temp_dir,
+                                     '--anomalies',
+                                     '--alerts_file', alerts_path])
+        Overwatch(arguments).gather_csv_rows()
+        Overwatch(arguments).gather_csv_rows()
+        with open(alerts_path) as alerts_file:
+            alerts = [json.loads(line) for line in alerts_file]
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0]['id'], 'spider_a_12')
+        self.assertEqual(alerts[0]['project'], 'harvestman')
+        self.assertEqual(alerts[0]['end_time'], '1970-01-01 12:15:00')
+
+
+class TestHistoryStore(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        rand = random.Random(11)
+        self.jobs = []
+        for number in range(50):
+            start_time = rand.randint(0, 10 ** 9)
+            self.jobs.append(('{:032x}'.format(number),
+                              rand.choice(['harvestman', 'arachnid']),
+                              rand.choice(['node-a', 'node-b']),
+                              start_time,
+                              start_time + rand.randint(1, 10 ** 8)))
+
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.response_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_response_json.json'), 'rb').read())
+
+    def test_append_and_query(self):
+        store = HistoryStore(self.temp_dir)
+        self.assertEqual(store.append(self.jobs), 50)
+        self.assertEqual(len(store), 50)
+        self.assertEqual(sorted(store.query()), sorted(self.jobs))
+
+    def test_duplicates_are_skipped(self):
+        store = HistoryStore(self.temp_dir)
+        store.append(self.jobs[:30])
+        self.assertEqual(store.append(self.jobs[20:]), 20)
+        self.assertEqual(len(store), 50)
+
+    def test_reopened_store(self):
+        HistoryStore(self.temp_dir).append(self.jobs)
+        store = HistoryStore(self.temp_dir)
+        self.assertEqual(sorted(store.query()), sorted(self.jobs))
+        self.assertEqual(store.append(self.jobs), 0)
+
+    def test_stores_share_a_directory(self):
+        first = HistoryStore(self.temp_dir)
+        second = HistoryStore(self.temp_dir)
+        first.append([('a' * 32, 'harvestman', 'node-a', 1000, 2000)])
+        second.append([('b' * 32, 'harvestman', 'node-b', 1000, 3000)])
+
+        self.assertEqual(list(first.query(1500)),
+                         [('a' * 32, 'harvestman', 'node-a', 1000, 2000),
+                          ('b' * 32, 'harvestman', 'node-b', 1000, 3000)])
+        self.assertEqual(first.names, ['harvestman', 'node-a', 'node-b'])
+        self.assertEqual(HistoryStore(self.temp_dir).blocks, [[2000, 3000]])
+
+    def test_torn_record_is_overwritten(self):
+        store = HistoryStore(self.temp_dir)
+        store.append(self.jobs[:10])
+        with open(store.records_path, 'ab') as records_file:
+            records_file.write(b'torn')
+
+        store.append(self.jobs[10:])
+        self.assertEqual(len(store), 50)
+        self.assertEqual(os.path.getsize(store.records_path),
+                         50 * RECORD.size)
+        self.assertEqual(sorted(store.query()), sorted(self.jobs))
+
+    def test_missing_blocks_are_rebuilt(self):
+        with patch('history.BLOCK_RECORDS', 4):
+            HistoryStore(self.temp_dir).append(self.jobs)
+            store = HistoryStore(self.temp_dir)
+            expected = store.blocks
+            with open(store.blocks_path, 'rb') as blocks_file:
+                data = blocks_file.read()
+            with open(store.blocks_path, 'wb') as blocks_file:
+                blocks_file.write(data[:5 * 16])
+
+            store = HistoryStore(self.temp_dir)
+            self.assertEqual(store.blocks, expected)
+            start = 5 * 10 ** 8
+            self.assertEqual(sorted(store.query(start)),
+                             sorted(job for job in self.jobs
+                                    if job[4] >= start))
+
+    def test_range_query_uses_block_index(self):
+        with patch('history.BLOCK_RECORDS', 4):
+            store = HistoryStore(self.temp_dir)
+            for number in range(0, 50, 7):
+                store.append(self.jobs[number:number + 7])
+
+            self.assertEqual(len(store.blocks), 13)
+            for block, (lowest, highest) in enumerate(store.blocks):
+                end_times = [job[4] for job in
+                             self.jobs[block * 4:block * 4 + 4]]
+                self.assertEqual([lowest, highest],
+                                 [min(end_times), max(end_times)])
+
+            start, end = 3 * 10 ** 8, 6 * 10 ** 8
+            expected = [job for job in self.jobs if start <= job[4] < end]
+            self.assertEqual(sorted(store.query(start, end)),
+                             sorted(expected))
+            self.assertEqual(
+                sorted(store.query(start, end, spider='arachnid',
+                                   node='node-b')),
+                sorted(job for job in expected
+                       if job[1] == 'arachnid' and job[2] == 'node-b'))
+
+    def test_query_metrics(self):
+        store = HistoryStore(self.temp_dir)
+        store.append(self.jobs)
+        job_metrics = store.query_metrics(spider='harvestman')
+        harvestman = [job for job in self.jobs if job[1] == 'harvestman']
+        self.assertEqual(job_metrics.count, len(harvestman))
+        self.assertAlmostEqual(job_metrics.duration_sum,
+                               sum(job[4] - job[3] for job in harvestman) /
+                               10.0 ** 6)
+
+    def test_overwatch_appends_history(self):
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'http://192.168.124.30',
+                                     '-P',
+                                     '6800',
+                                     '--history',
+                                     self.temp_dir])
+        with patch.object(Overwatch, 'fetch'):
+            overwatch = Overwatch(arguments)
+        session = requests.Session()
+        adapter = requests_mock.Adapter()
+        session.mount('mock', adapter)
+        adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            json=self.response_json,
+            status_code=200)
+
+        for _ in range(2):
+            overwatch.response = session.get(
+                'mock://0.0.0.1:6800/listjobs.json?project=harvestman')
+            overwatch.gather_job_metrics()
+
+        store = HistoryStore(os.path.join(self.temp_dir, 'harvestman'))
+        finished = self.response_json['finished']
+        self.assertEqual(len(store), len(finished))
+        self.assertEqual(
+            sorted(store.query()),
+            sorted((item['id'], item['spider'], 'http://192.168.124.30:6800',
+                    parse_timestamp(item['start_time']),
+                    parse_timestamp(item['end_time']))
+                   for item in finished))
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.rows = [{'Node': 'http://10.0.0.1:6800',
+                      'Spider': 'harvestman',
+                      'Completed crawls': 3,
+                      'Av CR (S)': 244.56,
+                      'p50 CR (S)': 241.547793,
+                      'Utilisation': None,
+                      'CR p/h 1h': 2.0},
+                     {'Node': 'cluster',
+                      'Spider': 'total',
+                      'Completed crawls': 5,
+                      'Av CR (S)': 200.5}]
+        self.cache = MetricsCache(clock=lambda: 1460000000.0)
+
+    def test_rows_to_samples(self):
+        samples = rows_to_samples('harvestman', self.rows[:1])
+        self.assertEqual(len(samples), 4)
+        self.assertIn(('crawl_duration_seconds',
+                       {'project': 'harvestman',
+                        'node': 'http://10.0.0.1:6800',
+                        'spider': 'harvestman',
+                        'quantile': '0.5'},
+                       241.547793,
+                       'Crawl duration quantiles'), samples)
+        self.assertIn('window',
+                      [sample for sample in samples
+                       if sample[0] == 'window_crawls_per_hour'][0][1])
+
+    def test_render(self):
+        body = render(rows_to_samples('harvestman', self.rows))
+        lines = body.splitlines()
+        self.assertEqual(lines.count(
+            '# TYPE overwatch_completed_crawls gauge'), 1)
+        self.assertIn('overwatch_completed_crawls{node="cluster",'
+                      'project="harvestman",spider="total"} 5', lines)
+        self.assertIn('overwatch_crawl_duration_seconds_mean{'
+                      'node="http://10.0.0.1:6800",project="harvestman",'
+                      'spider="harvestman"} 244.56', lines)
+        self.assertEqual(render([]), '')
+
+    def test_escape_labels(self):
+        body = render([('completed_crawls', {'spider': 'a"b\\c\nd'}, 1,
+                        'Finished crawls')])
+        self.assertIn('overwatch_completed_crawls{spider="a\\"b\\\\c\\nd"} 1',
+                      body)
+
+    def test_update_keeps_other_projects(self):
+        self.cache.update('harvestman', self.rows)
+        self.cache.update('arachnid', self.rows[1:], node='cluster')
+        self.cache.update('harvestman', self.rows[1:])
+        body = self.cache.body().decode('utf-8')
+        self.assertIn('project="arachnid"', body)
+        self.assertNotIn('spider="harvestman"', body)
+        self.assertIn('overwatch_last_refresh_timestamp_seconds{'
+                      'project="harvestman"} 1460000000.0', body)
+
+    def test_scrape_serves_cached_body(self):
+        self.cache.update('harvestman', self.rows)
+        server = start_server(self.cache, '127.0.0.1', 0)
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+            session = requests.Session()
+            response = session.get(url + '/metrics')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, self.cache.body())
+            self.assertTrue(response.headers['Content-Type'].startswith(
+                'text/plain; version=0.0.4'))
+            self.assertEqual(session.get(url + '/other').status_code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestJobTable(unittest.TestCase):
+    def test_columns(self):
+        table = JobTable()
+        table.append('harvestman', 0, 60 * 10 ** 6)
+        table.append('arachnid', 10 ** 6, 31 * 10 ** 6)
+        table.append('harvestman', 2 * 10 ** 6, 3 * 10 ** 6)
+
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.spiders, ['harvestman', 'arachnid'])
+        self.assertEqual(list(table.spider_ids), [0, 1, 0])
+        self.assertEqual(table.spider(1), 'arachnid')
+        self.assertEqual(table.durations(), [60.0, 30.0, 1.0])
+        self.assertEqual(table.start_times.itemsize, 8)
+
+    def test_extend_reinterns_spiders(self):
+        table = JobTable()
+        table.append('harvestman', 0, 1)
+        other = JobTable()
+        other.append('arachnid', 2, 3)
+        other.append('harvestman', 4, 5)
+        table.extend(other)
+
+        self.assertEqual([table.spider(index) for index in range(3)],
+                         ['harvestman', 'arachnid', 'harvestman'])
+        self.assertEqual(list(table.end_times), [1, 3, 5])
+
+    def test_metrics_match_lists(self):
+        rand = random.Random(17)
+        grouped_metrics = GroupedMetrics('spider')
+        start_times = []
+        end_times = []
+        for _ in range(500):
+            start_time = rand.randint(0, 10 ** 12)
+            end_time = start_time + rand.randint(1, 10 ** 9)
+            start_times.append(start_time)
+            end_times.append(end_time)
+            grouped_metrics.add(rand.choice(['a', 'b']), start_time, end_time)
+
+        job_metrics = grouped_metrics.total
+        self.assertEqual(job_metrics.concurrency_profile().peak,
+                         ConcurrencyProfile(start_times, end_times).peak)
+        self.assertEqual(job_metrics.window_metrics(['1h']),
+                         WindowIndex(start_times,
+                                     end_times).window_metrics(['1h']))
+        self.assertEqual(sum(len(group.jobs) for group in
+                             grouped_metrics.groups.values()), 500)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_generate_listjobs(self):
+        listjobs = generate_listjobs(500, spiders=3, durations='exponential')
+        finished = listjobs['finished']
+        self.assertEqual(len(finished), 500)
+        self.assertEqual(len(set(item['id'] for item in finished)), 500)
+
+        end_times = [parse_timestamp(item['end_time']) for item in finished]
+        self.assertEqual(end_times, sorted(end_times))
+        for item in finished:
+            self.assertTrue(parse_timestamp(item['start_time']) <
+                            parse_timestamp(item['end_time']))
+
+        spiders = [item['spider'] for item in finished]
+        self.assertEqual(set(spiders), set(['spider_0', 'spider_1',
+                                            'spider_2']))
+        self.assertTrue(spiders.count('spider_0') > spiders.count('spider_2'))
+        self.assertEqual(generate_listjobs(500, spiders=3,
+                                           durations='exponential'),
+                         listjobs)
+
+    def test_bench_pipeline(self):
+        with patch('overwatch.write_csv') as write_mock, \
+                patch.object(Overwatch, 'fold_jobs', autospec=True,
+                             side_effect=Overwatch.fold_jobs) as fold_mock:
+            result = bench_pipeline(generate_listjobs(200), repeat=2)
+        # Every timed outliers run folds a freshly fetched response, as do
+        # both pipelines.
+        self.assertEqual(fold_mock.call_count, 6)
+        self.assertEqual(write_mock.call_count, 4)
+        for call in write_mock.call_args_list:
+            self.assertFalse(call[0][0].startswith(settings.OUTPUT_PATH))
+        self.assertEqual(result['jobs'], 200)
+        self.assertEqual(sorted(result['stages']),
+                         sorted(['fetch', 'decode', 'parse', 'aggregate',
+                                 'outliers', 'metrics', 'csv', 'forecast',
+                                 'pipeline', 'stream_pipeline']))
+
+
+class TestInstruments(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.scrapyd_json = open(self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json'), 'rb').read()
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.adapter.register_uri(
+            'GET',
+            'mock://0.0.0.1:6800/listjobs.json?project=harvestman',
+            content=self.scrapyd_json,
+            status_code=200)
+
+        self.summaries = []
+        self.instruments = Instruments([self.summaries.append])
+
+    def run_overwatch(self, *extra_arguments):
+        arguments = parse_arguments(['-p',
+                                     'harvestman',
+                                     '-d',
+                                     'mock://0.0.0.1',
+                                     '-P',
+                                     '6800'] + list(extra_arguments))
+        Overwatch(arguments, session=self.session,
+                  instruments=self.instruments).write_to_csv()
+        self.instruments.report()
+        return dict((stage['stage'], stage) for stage in self.summaries[0])
+
+    def test_stages(self):
+        stages = self.run_overwatch()
+        self.assertEqual([stage['stage'] for stage in self.summaries[0]],
+                         ['fetch', 'fold', 'metrics', 'write'])
+        self.assertEqual(stages['fetch']['bytes'], len(self.scrapyd_json))
+        self.assertEqual(stages['fold']['items'], 3)
+        self.assertEqual(stages['write']['items'], 1)
+        for stage in self.summaries[0]:
+            self.assertEqual(stage['calls'], 1)
+            self.assertTrue(stage['seconds'] >= 0)
+
+    def test_stream_bytes(self):
+        stages = self.run_overwatch('--stream', '-s', '50')
+        self.assertEqual(stages['fetch']['bytes'], 0)
+        self.assertEqual(stages['fold']['bytes'], len(self.scrapyd_json))
+        self.assertEqual(stages['fold']['items'], 3)
+
+    def test_disabled_by_default(self):
+        arguments = parse_arguments(['-p', 'harvestman', '-d',
+                                     'mock://0.0.0.1', '-P', '6800'])
+        overwatch = Overwatch(arguments, session=self.session)
+        self.assertIs(overwatch.instruments, NULL_INSTRUMENTS)
+        self.assertIs(overwatch.instruments.stage('fetch'), NULL_STAGE)
+        self.assertEqual(overwatch.gather_completed_crawl_count(), 3)
+
+    def test_json_file_sink(self):
+        path = os.path.join(self.temp_dir, 'stages.json')
+        self.instruments.sinks.append(JSONFileSink(path))
+        self.instruments.record('fetch', 0.5, nbytes=10)
+        self.instruments.record('fetch', 0.25, nbytes=5)
+        self.instruments.report()
+        with open(path) as json_file:
+            self.assertEqual(json.load(json_file),
+                             {'stages': [{'stage': 'fetch',
+                                          'calls': 2,
+                                          'seconds': 0.75,
+                                          'items': 0,
+                                          'bytes': 15}]})
+
+    def test_profiled(self):
+        path = os.path.join(self.temp_dir, 'overwatch.prof')
+        with open(os.devnull, 'w') as devnull:
+            with profiled(path, stream=devnull):
+                sorted(range(1000))
+        self.assertTrue(os.path.getsize(path) > 0)
+
+
+class TestReplay(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        self.json_file = self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json')
+        self.scrapyd_json = open(self.json_file, 'rb').read()
+
+        self.session = requests.Session()
+        self.adapter = requests_mock.Adapter()
+        self.session.mount('mock', self.adapter)
+        self.url = 'mock://0.0.0.1:6800/listjobs.json?project=harvestman'
+        self.adapter.register_uri('GET', self.url,
+                                  content=self.scrapyd_json,
+                                  status_code=200)
+        self.now = 1000.0
+
+    def cache(self, ttl=60, max_bytes=10 ** 6):
+        return ResponseCache(os.path.join(self.temp_dir, 'cache'), ttl,
+                             max_bytes, clock=lambda: self.now)
+
+    def test_input_file(self):
+        for extra_arguments in [[], ['--stream', '-s', '50']]:
+            arguments = parse_arguments(['-p', 'harvestman',
+                                         '--input', self.json_file] +
+                                        extra_arguments)
+            overwatch = Overwatch(arguments)
+            self.assertEqual(overwatch.node, self.json_file)
+            self.assertTrue(overwatch.check_response_code())
+            self.assertEqual(overwatch.gather_completed_crawl_count(), 3)
+            self.assertEqual(overwatch.calculate_av_crawl_duration(), 244.56)
+
+    def test_file_response(self):
+        response = FileResponse(self.json_file)
+        self.assertEqual(response.content, self.scrapyd_json)
+        self.assertIs(response.content, response.content)
+        self.assertEqual(b''.join(response.iter_content(100)),
+                         self.scrapyd_json)
+        self.assertEqual(len(response.json()['finished']), 3)
+
+    def test_cache_hit_within_ttl(self):
+        cache = self.cache()
+        first = cache.fetch(self.session, self.url)
+        self.now += 59
+        second = cache.fetch(self.session, self.url)
+        self.assertEqual(self.adapter.call_count, 1)
+        self.assertEqual(first.content, self.scrapyd_json)
+        self.assertEqual(second.content, self.scrapyd_json)
+
+        self.now += 1
+        cache.fetch(self.session, self.url)
+        self.assertEqual(self.adapter.call_count, 2)
+
+    def test_failed_response_not_cached(self):
+        self.adapter.register_uri('GET', self.url, status_code=500)
+        cache = self.cache()
+        self.assertEqual(cache.fetch(self.session, self.url).status_code, 500)
+        self.assertEqual(cache.lookup(self.url), None)
+
+    def test_failed_download_leaves_no_file(self):
+        def chunks():
+            yield self.scrapyd_json[:100]
+            raise IOError('connection reset')
+
+        cache = self.cache()
+        self.assertRaises(IOError, cache.store, self.url, chunks())
+        self.assertEqual(os.listdir(cache.path), [])
+        self.assertEqual(cache.lookup(self.url), None)
+
+    def test_eviction(self):
+        cache = self.cache(max_bytes=2 * len(self.scrapyd_json))
+        for number in range(3):
+            self.now += 1
+            cache.store('url{}'.format(number), [self.scrapyd_json])
+
+        self.assertEqual(cache.lookup('url0'), None)
+        self.assertNotEqual(cache.lookup('url1'), None)
+        self.assertNotEqual(cache.lookup('url2'), None)
+
+        self.now += 60
+        cache.store('url3', [self.scrapyd_json])
+        self.assertEqual(os.listdir(cache.path),
+                         [os.path.basename(cache.entry_path('url3'))])
+
+    def test_overwatch_uses_cache(self):
+        arguments = parse_arguments(['-p', 'harvestman', '-d',
+                                     'mock://0.0.0.1', '-P', '6800',
+                                     '--cache_dir', self.temp_dir])
+        for by_spider in [False, True]:
+            arguments.by_spider = by_spider
+            overwatch = Overwatch(arguments, session=self.session)
+            self.assertEqual(overwatch.gather_completed_crawl_count(), 3)
+
+        self.assertEqual(self.adapter.call_count, 1)
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.path = os.path.join(self.temp_dir, 'state.json')
+
+    def test_replaces_the_file(self):
+        with open(self.path, 'w') as state_file:
+            state_file.write('old')
+        atomic_write(self.path, lambda state_file: state_file.write('new'))
+        with open(self.path) as state_file:
+            self.assertEqual(state_file.read(), 'new')
+        self.assertEqual(os.listdir(self.temp_dir), ['state.json'])
+
+    def test_threads_use_their_own_temp_file(self):
+        temp_paths = []
+
+        def write(state_file):
+            temp_paths.append(state_file.name)
+            state_file.write('written')
+
+        threads = [threading.Thread(target=atomic_write,
+                                    args=(self.path, write))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual(len(set(temp_paths)), 2)
+        self.assertFalse(self.path in temp_paths)
+
+    def test_failed_write_leaves_no_file(self):
+        def write(state_file):
+            state_file.write('partial')
+            raise IOError('disk full')
+
+        self.assertRaises(IOError, atomic_write, self.path, write)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+
+class TestBatch(unittest.TestCase):
+    def create_file_path(self, file_name):
+        path = os.path.join(self.data_file_path, file_name)
+        return path
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='temp_test_dir')
+        self.data_file_path = os.path.join(os.getcwd(), 'test_data')
+        response_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_response_json.json'), 'rb').read())
+        outliers_json = json.loads(open(self.create_file_path(
+            'scrapyd_list_jobs_outliers_json.json'), 'rb').read())
+
+        finished = response_json['finished']
+        third = len(finished) // 3
+        # Hourly snapshots of one node overlap; the other node has one.
+        self.dumps = {'node-a': [finished[:2 * third],
+                                 finished[third:],
+                                 finished[2 * third:]],
+                      'node-b': [outliers_json['finished']]}
+        self.unique_jobs = finished + outliers_json['finished']
+
+        for node, snapshots in self.dumps.items():
+            os.mkdir(os.path.join(self.temp_dir, node))
+            for hour, jobs in enumerate(snapshots):
+                path = os.path.join(self.temp_dir, node,
+                                    '2016-04-29T{:02d}.json'.format(hour))
+                with open(path, 'w') as dump_file:
+                    json.dump({'finished': jobs}, dump_file)
+
+    def test_find_dumps(self):
+        paths = find_dumps([os.path.join(self.temp_dir, 'node-a'),
+                            os.path.join(self.temp_dir, 'node-*',
+                                         '*T00.json')])
+        self.assertEqual([os.path.relpath(path, self.temp_dir)
+                          for path in paths],
+                         [os.path.join('node-a', '2016-04-29T00.json'),
+                          os.path.join('node-a', '2016-04-29T01.json'),
+                          os.path.join('node-a', '2016-04-29T02.json'),
+                          os.path.join('node-b', '2016-04-29T00.json')])
+
+    def test_build_tasks(self):
+        tasks = build_tasks(find_dumps([os.path.join(self.temp_dir, '*')]))
+        self.assertEqual([(os.path.basename(path),
+                           previous and os.path.basename(previous))
+                          for path, previous, _, _ in tasks],
+                         [('2016-04-29T00.json', None),
+                          ('2016-04-29T01.json', '2016-04-29T00.json'),
+                          ('2016-04-29T02.json', '2016-04-29T01.json'),
+                          ('2016-04-29T00.json', None)])
+
+    def test_analyse_dumps(self):
+        paths = find_dumps([os.path.join(self.temp_dir, '*')])
+        grouped_metrics = analyse_dumps(paths, 'spider', processes=2)
+
+        expected = CrawlMetrics()
+        for item in self.unique_jobs:
+            expected.add(parse_timestamp(item['start_time']),
+                         parse_timestamp(item['end_time']))
+
+        job_metrics = grouped_metrics.total
+        self.assertEqual(job_metrics.count, len(self.unique_jobs))
+        self.assertAlmostEqual(job_metrics.duration_sum,
+                               expected.duration_sum)
+        self.assertEqual(job_metrics.longest, expected.longest)
+        self.assertEqual(job_metrics.shortest, expected.shortest)
+        self.assertEqual(job_metrics.earliest_start, expected.earliest_start)
+        self.assertEqual(job_metrics.latest_end, expected.latest_end)
+        self.assertEqual(sum(group.count for group in
+                             grouped_metrics.groups.values()),
+                         len(self.unique_jobs))
+
+    def test_analyse_dump_reuses_previous_ids(self):
+        tasks = build_tasks(find_dumps([os.path.join(self.temp_dir,
+                                                     'node-a')]))
+        analyse_dump(tasks[0])
+        with patch('batch.read_job_ids') as read_mock:
+            state = analyse_dump(tasks[1])
+        self.assertEqual(read_mock.call_count, 0)
+        self.assertEqual(state['total']['count'],
+                         len(self.dumps['node-a'][2]))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+from __future__ import division
+
+import datetime
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_DATE = EPOCH.date()
+DAY_MICROSECONDS = 86400 * 10 ** 6
+
+_epoch_days = {}
+
+
+def _parse_epoch_days(date_part):
+    """
+    Convert the <"yyyy-mm-dd"> part of a timestamp to days since the epoch
+    and remember the result, scrapyd jobs share a handful of dates.
+
+    :param date_part:  a string
+    :returns days:     integer
+    """
+    if (len(date_part) != 10 or date_part[4] != '-' or
+            date_part[7] != '-' or not date_part[:4].isdigit() or
+            not date_part[5:7].isdigit() or not date_part[8:10].isdigit()):
+        raise ValueError('Invalid date: {!r}'.format(date_part))
+
+    date = datetime.date(int(date_part[:4]),
+                         int(date_part[5:7]),
+                         int(date_part[8:10]))
+    days = (date - EPOCH_DATE).days
+    _epoch_days[date_part] = days
+    return days
+
+
+def parse_timestamp(date_string):
+    """
+    Convert a scrapyd timestamp to integer microseconds since the epoch.
+
+    Scrapyd writes str(datetime), a fixed layout, so the fields are sliced
+    out by position rather than matched with strptime. The fraction is
+    optional, as str() drops it when the microseconds are zero. Every
+    field must be all digits, int() alone would take a sign or spaces.
+
+    :param date_string:  a date in format <"yyyy-mm-dd hh:mm:ss.mmmmmm">
+    :returns microseconds:  integer
+    """
+    try:
+        days = _epoch_days[date_string[:10]]
+    except KeyError:
+        days = _parse_epoch_days(date_string[:10])
+
+    length = len(date_string)
+    if (length < 19 or length > 26 or length == 20 or
+            date_string[10] != ' ' or
+            date_string[13] != ':' or
+            date_string[16] != ':' or
+            not date_string[11:13].isdigit() or
+            not date_string[14:16].isdigit() or
+            not date_string[17:19].isdigit()):
+        raise ValueError('Invalid timestamp: {!r}'.format(date_string))
+
+    hour = int(date_string[11:13])
+    minute = int(date_string[14:16])
+    second = int(date_string[17:19])
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError('Invalid timestamp: {!r}'.format(date_string))
+
+    microsecond = 0
+    if length > 19:
+        if date_string[19] != '.' or not date_string[20:].isdigit():
+            raise ValueError('Invalid timestamp: {!r}'.format(date_string))
+        microsecond = int(date_string[20:]) * 10 ** (26 - length)
+
+    seconds = days * 86400 + hour * 3600 + minute * 60 + second
+    return seconds * 1000000 + microsecond
+
+
+def parse_timestamps(date_strings):
+    """
+    Convert an iterable of scrapyd timestamps to epoch microseconds.
+
+    :param date_strings:    an iterable of strings
+    :returns microseconds:  a list of integers
+    """
+    parse = parse_timestamp
+    return [parse(date_string) for date_string in date_strings]
+
+
+def to_datetime(microseconds):
+    """
+    Convert epoch microseconds back to a naive datetime.
+
+    :param microseconds:  integer
+    :returns dt:          a datetime.datetime type object
+    """
+    return EPOCH + datetime.timedelta(microseconds=microseconds)
+
+
+def from_datetime(dt):
+    """
+    Convert a naive datetime to epoch microseconds.
+
+    :param dt:  a datetime.datetime type object
+    :returns microseconds:  integer
+    """
+    delta = dt - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 10 ** 6 +
+            delta.microseconds)
+
+
+def to_seconds(microseconds):
+    """
+    Convert a span in microseconds to seconds, matching the value of
+    timedelta.total_seconds() for the same span.
+
+    :param microseconds:  integer
+    :returns seconds:     a float
+    """
+    return microseconds / 10 ** 6
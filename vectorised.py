@@ -0,0 +1,171 @@
+"""
+NumPy versions of the bulk computations over the finished jobs.
+
+NumPy is optional. Callers check available() and otherwise take their own
+pure Python path, which gives the same results: times and durations stay
+integer microseconds until the final conversion to seconds, which divides
+by 10 ** 6 exactly as timestamps.to_seconds does.
+
+NumPy takes about 100 ms to import, so it is only imported the first time
+available() is asked, keeping this module cheap to import.
+"""
+from __future__ import division
+
+from array import array
+
+
+numpy = None
+_numpy_imported = False
+
+
+def available():
+    """Whether NumPy can be used, importing it on the first call."""
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy is not None
+
+
+def int64_array(column):
+    """
+    Load a column of times into a NumPy array, copying it once.
+
+    :param column:  an array of integer microseconds, or a list
+    :returns values:  a numpy.ndarray of int64
+    """
+    if (isinstance(column, array) and column.typecode != 'd' and
+            column.itemsize == 8):
+        return numpy.frombuffer(column, dtype=numpy.int64).copy()
+    return numpy.array(column, dtype=numpy.int64)
+
+
+def to_column(values, typecode):
+    """
+    Convert a NumPy array of times back to an array column.
+
+    :param values:    a numpy.ndarray of integer microseconds
+    :param typecode:  jobtable.TIME_TYPECODE, a 64 bit array typecode
+    :returns column:  an array of typecode
+    """
+    dtype = numpy.float64 if typecode == 'd' else numpy.int64
+    return array(typecode, values.astype(dtype).tobytes())
+
+
+def to_seconds(spans):
+    """
+    Convert spans in microseconds to seconds.
+
+    :param spans:  a numpy.ndarray of int64
+    :returns seconds:  a numpy.ndarray of float64
+    """
+    return spans / 10 ** 6
+
+
+def crawl_durations(start_times, end_times):
+    """
+    The duration of every crawl in seconds, in table order.
+
+    :param start_times:  an array of integer microseconds
+    :param end_times:    an array of integer microseconds
+    :returns durations:  a list of floats
+    """
+    return to_seconds(int64_array(end_times) -
+                      int64_array(start_times)).tolist()
+
+
+def sorted_intervals(start_times, end_times, typecode):
+    """
+    The start times and the end times of the crawls that ended after they
+    started, each sorted, with the time those crawls were running and the
+    most running at once.
+
+    An end is taken before a start at the same instant, so back to back
+    crawls do not overlap.
+
+    :param start_times:  an array of integer microseconds
+    :param end_times:    an array of integer microseconds
+    :param typecode:     the array typecode of the sorted columns
+    :returns starts, ends, busy, peak:  two arrays of typecode and two
+                                        integers
+    """
+    starts = int64_array(start_times)
+    ends = int64_array(end_times)
+    kept = ends > starts
+    starts = numpy.sort(starts[kept])
+    ends = numpy.sort(ends[kept])
+
+    busy = int(ends.sum()) - int(starts.sum())
+    peak = 0
+    if len(starts):
+        times = numpy.concatenate((ends, starts))
+        changes = numpy.concatenate((numpy.full(len(ends), -1, numpy.int64),
+                                     numpy.ones(len(starts), numpy.int64)))
+        order = numpy.lexsort((changes, times))
+        peak = int(numpy.cumsum(changes[order]).max())
+
+    return (to_column(starts, typecode), to_column(ends, typecode), busy,
+            peak)
+
+
+def end_time_index(start_times, end_times, typecode):
+    """
+    The end times in order with a prefix sum of the crawl durations in
+    the same order, for a windows.WindowIndex. Crawls that ended at the
+    same time keep their table order.
+
+    :param start_times:  an array of integer microseconds
+    :param end_times:    an array of integer microseconds
+    :param typecode:     the array typecode of the returned columns
+    :returns end_times, duration_prefix:  two arrays of typecode
+    """
+    starts = int64_array(start_times)
+    ends = int64_array(end_times)
+    order = numpy.argsort(ends, kind='mergesort')
+    prefix = numpy.zeros(len(ends) + 1, numpy.int64)
+    numpy.cumsum(ends[order] - starts[order], out=prefix[1:])
+    return to_column(ends[order], typecode), to_column(prefix, typecode)
+
+
+def bucket_counts(times, bucket, first, length):
+    """
+    The number of times falling in each bucket, a time on the boundary of
+    two buckets counting in the earlier one.
+
+    :param times:   an array of integer microseconds
+    :param bucket:  the bucket length in integer microseconds
+    :param first:   the index of the first bucket, counted from the epoch
+    :param length:  the number of buckets
+    :returns counts:  a list of integers
+    """
+    indexes = (int64_array(times) - 1) // bucket - first
+    return numpy.bincount(indexes, minlength=length)[:length].tolist()
+
+
+def spider_durations(job_table):
+    """
+    The sorted crawl durations of each spider, and of every spider.
+
+    :param job_table:  a jobtable.JobTable object
+    :returns spider_durations, all_durations:  a dictionary of spider name
+                                               to a sorted list of seconds,
+                                               and a sorted list of seconds
+    """
+    durations = to_seconds(int64_array(job_table.end_times) -
+                           int64_array(job_table.start_times))
+    spider_ids = numpy.frombuffer(job_table.spider_ids, dtype=numpy.int32)
+    order = numpy.lexsort((durations, spider_ids))
+    counts = numpy.bincount(spider_ids,
+                            minlength=len(job_table.spiders)).tolist()
+
+    ordered = durations[order].tolist()
+    spider_durations = {}
+    offset = 0
+    for spider, count in zip(job_table.spiders, counts):
+        spider_durations[spider] = ordered[offset:offset + count]
+        offset += count
+
+    return spider_durations, numpy.sort(durations).tolist()
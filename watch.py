@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+import traceback
+
+try:
+    from Queue import Empty, Queue
+except ImportError:
+    from queue import Empty, Queue
+
+
+STOP = object()
+# Returned by a poll that succeeded with nothing to write, e.g. from a node
+# with no finished jobs yet.
+NO_RESULT = object()
+
+
+class Watcher(object):
+    """
+    Poll on a fixed interval from one long lived process.
+
+    poll() fetches and computes, returning a result to write, NO_RESULT
+    when there is nothing to write, or None when the poll failed. Results are handed to write() on a separate thread
+    through a single slot queue, so a slow write never delays the next
+    poll; if the writer falls behind, an unwritten result is replaced by
+    the newer one.
+
+    Failed polls back off exponentially up to max_interval. A poll that
+    raises is logged and backed off the same way, so one bad response
+    never stops the watcher, and a write that raises is logged and the
+    writer carries on. Every delay is jittered so that many watchers
+    started together drift apart.
+    """
+
+    def __init__(self, poll, write, interval, jitter=0.1, max_interval=None,
+                 sleep=time.sleep, clock=time.time, rand=random.random):
+        self.poll = poll
+        self.write = write
+        self.interval = interval
+        self.jitter = jitter
+        self.max_interval = max(max_interval or interval, interval)
+        self.sleep = sleep
+        self.clock = clock
+        self.rand = rand
+        self.failures = 0
+        self.pending = Queue(maxsize=1)
+
+    def next_delay(self):
+        """
+        Seconds between the start of this poll and the start of the next.
+
+        :returns delay:  a float
+        """
+        delay = self.interval
+        if self.failures:
+            delay = min(self.interval * 2 ** self.failures,
+                        self.max_interval)
+
+        return delay * (1 + self.jitter * (2 * self.rand() - 1))
+
+    def submit(self, result):
+        """Queue a result for the writer, dropping one it has not taken."""
+        try:
+            self.pending.get_nowait()
+        except Empty:
+            pass
+        self.pending.put(result)
+
+    def write_results(self):
+        """Write queued results until told to stop."""
+        while True:
+            result = self.pending.get()
+            if result is STOP:
+                return
+            try:
+                self.write(result)
+            except (IOError, OSError) as error:
+                print('Write failed: {}'.format(error))
+            except Exception as error:
+                print('Write failed unexpectedly: {!r}'.format(error))
+                traceback.print_exc()
+
+    def run(self, polls=None):
+        """
+        Poll until interrupted, or polls times when given.
+
+        :param polls:  integer or None
+        """
+        writer = threading.Thread(target=self.write_results)
+        writer.daemon = True
+        writer.start()
+
+        count = 0
+        try:
+            while polls is None or count < polls:
+                started = self.clock()
+                try:
+                    result = self.poll()
+                except Exception as error:
+                    print('Poll failed unexpectedly: {!r}'.format(error))
+                    traceback.print_exc()
+                    result = None
+                if result is None:
+                    self.failures += 1
+                else:
+                    self.failures = 0
+                    if result is not NO_RESULT:
+                        self.submit(result)
+
+                count += 1
+                if polls is None or count < polls:
+                    elapsed = self.clock() - started
+                    self.sleep(max(0, self.next_delay() - elapsed))
+        finally:
+            self.pending.put(STOP)
+            writer.join()
@@ -0,0 +1,99 @@
+from __future__ import division
+
+import bisect
+import re
+import vectorised
+
+from array import array
+from jobtable import TIME_TYPECODE
+
+
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_window(label):
+    """
+    Convert a window label such as 15m, 1h, 24h or 7d to seconds.
+
+    :param label:  a string, a whole number followed by s, m, h or d
+    :returns seconds:  integer
+    """
+    match = re.match(r'^(\d+)([smhd])$', label)
+    if not match or not int(match.group(1)):
+        raise ValueError('Invalid window: {!r}'.format(label))
+
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+
+class WindowIndex(object):
+    """
+    Finished jobs sorted by end time with a prefix sum of their durations.
+
+    The jobs that ended within any trailing window are found with two
+    binary searches, and their count and total duration are differences
+    of the prefix sums, so each extra window costs O(log n) rather than a
+    rescan of the jobs. With NumPy the sort and the prefix sum are array
+    operations.
+    """
+
+    def __init__(self, start_times, end_times):
+        count = len(end_times)
+        self.count = count
+        if vectorised.available():
+            self.end_times, self.duration_prefix = vectorised.end_time_index(
+                start_times, end_times, TIME_TYPECODE)
+            return
+
+        order = range(count)
+        if any(end_times[i] > end_times[i + 1] for i in range(count - 1)):
+            order = sorted(order, key=end_times.__getitem__)
+
+        self.end_times = array(TIME_TYPECODE, [end_times[i] for i in order])
+        self.duration_prefix = array(TIME_TYPECODE, [0])
+        total = 0
+        for i in order:
+            total += end_times[i] - start_times[i]
+            self.duration_prefix.append(total)
+
+    def window(self, start, end):
+        """
+        Count and total duration of the jobs that ended after start and
+        no later than end.
+
+        :param start:  integer microseconds since the epoch
+        :param end:    integer microseconds since the epoch
+        :returns count, duration_sum:  integer, integer microseconds
+        """
+        low = bisect.bisect_right(self.end_times, start)
+        high = bisect.bisect_right(self.end_times, end)
+        return (high - low,
+                self.duration_prefix[high] - self.duration_prefix[low])
+
+    def window_metrics(self, labels, reference=None):
+        """
+        Populate a dictionary of metrics for each trailing window, ending
+        at reference or, by default, at the latest end time.
+
+        :param labels:     a list of window labels, e.g. ['15m', '1h']
+        :param reference:  integer microseconds since the epoch
+        :returns window_metrics:  a dictionary object
+        """
+        if reference is None:
+            reference = self.end_times[-1] if self.end_times else 0
+
+        window_metrics = {}
+        for label in labels:
+            seconds = parse_window(label)
+            count, duration_sum = self.window(
+                reference - seconds * 10 ** 6, reference)
+
+            av_crawl_seconds = None
+            if count:
+                av_crawl_seconds = round(duration_sum / count / 10 ** 6, 2)
+
+            window_metrics['CR {}'.format(label)] = count
+            window_metrics['Av CR {} (S)'.format(label)] = av_crawl_seconds
+            window_metrics['CR p/h {}'.format(label)] = round(
+                count * 3600 / seconds, 2)
+
+        return window_metrics